@@ -0,0 +1,185 @@
+"""Presupuesto de llamadas a RapidAPI: ritmo, cuota mensual, reintentos y circuit breaker"""
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime
+
+from kiwi_client import KiwiAPIError
+
+
+class BudgetExhaustedError(KiwiAPIError):
+    """No queda cuota de RapidAPI disponible para esta llamada"""
+
+
+class CircuitOpenError(KiwiAPIError):
+    """La API ha fallado repetidamente y las llamadas se rechazan temporalmente"""
+
+
+class ApiBudget:
+    """Control del consumo de la API de Kiwi en el lado del cliente.
+
+    - Token bucket con el ritmo del plan de RapidAPI (`rate_per_minute`, ráfagas de `burst`).
+    - Cuota mensual: se toma de las cabeceras `X-RateLimit-Requests-*` cuando la
+      API las envía; si no, se cuentan las llamadas del mes frente a `monthly_quota`.
+    - Reintentos con backoff exponencial y jitter para errores transitorios.
+    - Circuit breaker: tras `failure_threshold` fallos seguidos se rechazan las
+      llamadas durante `open_seconds`; después se deja pasar una de prueba.
+    """
+
+    def __init__(self, rate_per_minute=30, burst=5, monthly_quota=0, reserve=0,
+                 max_retries=3, backoff_base=1.0, backoff_cap=20.0,
+                 failure_threshold=5, open_seconds=60):
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.monthly_quota = monthly_quota
+        self.reserve = reserve
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._lock = None
+
+        # Cuota: contador local del mes y último valor informado por la API
+        self._month = datetime.now().strftime("%Y-%m")
+        self.used_this_month = 0
+        self.header_limit = None
+        self.header_remaining = None
+        self.header_reset_at = None
+
+        # Circuit breaker
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probe_started = None
+
+        self.retries = 0
+        self.rejected = 0
+
+    # --- Cuota -----------------------------------------------------------
+
+    def remaining(self):
+        """Llamadas restantes en el periodo actual, o None si no se conoce el límite"""
+        if self.header_remaining is not None:
+            return self.header_remaining
+        if self.monthly_quota:
+            return max(0, self.monthly_quota - self.used_this_month)
+        return None
+
+    def _roll_month(self):
+        month = datetime.now().strftime("%Y-%m")
+        if month != self._month:
+            self._month = month
+            self.used_this_month = 0
+            self.header_remaining = None
+
+    def update_from_headers(self, headers):
+        """Actualiza la cuota con las cabeceras de RapidAPI si vienen en la respuesta"""
+        limit = headers.get("x-ratelimit-requests-limit")
+        remaining = headers.get("x-ratelimit-requests-remaining")
+        reset = headers.get("x-ratelimit-requests-reset")
+        try:
+            if limit is not None:
+                self.header_limit = int(limit)
+            if remaining is not None:
+                self.header_remaining = int(remaining)
+            if reset is not None:
+                self.header_reset_at = time.time() + int(reset)
+        except ValueError:
+            logging.warning(f"Cabeceras de cuota no válidas: {limit}/{remaining}/{reset}")
+
+    # --- Circuit breaker -------------------------------------------------
+
+    @property
+    def state(self):
+        """Estado del circuit breaker: closed, open o half-open"""
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.open_seconds:
+            return "open"
+        return "half-open"
+
+    def check(self, retrying=False):
+        """Lanza un error si la llamada no debe hacerse (circuito abierto o sin cuota).
+        Los reintentos (`retrying`) de una llamada ya admitida solo comprueban la cuota:
+        en half-open son la propia llamada de prueba.
+        """
+        self._roll_month()
+        if not retrying:
+            state = self.state
+            # En half-open solo pasa una llamada de prueba (si se pierde, otra tras open_seconds)
+            probing = self._probe_started is not None and time.monotonic() - self._probe_started < self.open_seconds
+            if state == "open" or (state == "half-open" and probing):
+                self.rejected += 1
+                raise CircuitOpenError("Circuito abierto: la API de Kiwi está fallando, se reintentará más tarde")
+        remaining = self.remaining()
+        if remaining is not None and remaining <= self.reserve:
+            self.rejected += 1
+            self.release_probe()
+            raise BudgetExhaustedError(f"Cuota de RapidAPI agotada ({remaining} restantes)")
+        if not retrying and state == "half-open":
+            self._probe_started = time.monotonic()
+
+    def release_probe(self):
+        """Deja pasar otra llamada de prueba cuando la actual termina sin decir nada de la API
+        (p. ej. un 4xx por la propia consulta)
+        """
+        self._probe_started = None
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logging.info("API de Kiwi recuperada: circuito cerrado")
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probe_started = None
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self._probe_started = None
+        if self.opened_at is not None or self.consecutive_failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            logging.error(f"Circuito abierto tras {self.consecutive_failures} fallos seguidos de la API de Kiwi")
+
+    # --- Ritmo y reintentos ----------------------------------------------
+
+    async def acquire(self):
+        """Espera un token del bucket y contabiliza la llamada"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+                self._last_refill = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    break
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+        self.used_this_month += 1
+        if self.header_remaining is not None:
+            self.header_remaining = max(0, self.header_remaining - 1)
+
+    def backoff_delay(self, attempt, retry_after=None):
+        """Espera antes del reintento `attempt` (0, 1, ...): exponencial con jitter completo"""
+        self.retries += 1
+        if retry_after is not None:
+            return min(self.backoff_cap, retry_after)
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def stats(self):
+        """Estado del presupuesto para consultarlo desde /status"""
+        self._roll_month()
+        return {
+            "remaining": self.remaining(),
+            "limit": self.header_limit or self.monthly_quota or None,
+            "used_this_month": self.used_this_month,
+            "reset_in": max(0, int(self.header_reset_at - time.time())) if self.header_reset_at else None,
+            "tokens": round(min(self.burst, self._tokens + (time.monotonic() - self._last_refill) * self.rate), 1),
+            "circuit": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "retries": self.retries,
+            "rejected": self.rejected
+        }
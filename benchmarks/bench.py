@@ -0,0 +1,272 @@
+"""Micro-benchmarks offline de las funciones más usadas del bot.
+
+Uso:
+    python benchmarks/bench.py                   # ejecuta y compara con la línea base si existe
+    python benchmarks/bench.py --save-baseline   # guarda los resultados como nueva línea base
+    python benchmarks/bench.py --filter parse    # solo los benchmarks cuyo nombre contiene "parse"
+
+No hace llamadas de red: las respuestas de Kiwi salen de una respuesta grabada
+(fixtures/round_trip_sample.json) ampliada hasta el tamaño de cada caso.
+"""
+import argparse
+import copy
+import gc
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import flight_bot  # noqa: E402
+from preferences_store import PreferencesStore  # noqa: E402
+from fare_history import FareHistory  # noqa: E402
+from itinerary import Itinerary  # noqa: E402
+from places import PlaceIndex  # noqa: E402
+from sharding import merge_shard_results  # noqa: E402
+from response_parser import parse_response  # noqa: E402
+from trip_shapes import SHAPES, TripCalendar, load_holidays, parse_shape  # noqa: E402
+
+FIXTURE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "round_trip_sample.json")
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+FIXTURE_SIZES = (5, 20, 100, 500)
+WEEKEND_YEARS = range(2024, 2031)
+FARE_HISTORY_ROWS = 200_000
+MERGE_SHARDS = 4
+PLACE_QUERIES = ("ber", "milan", "lon", "BGY", "valencia", "s")
+
+
+def load_fixture(size):
+    """Respuesta de /round-trip con `size` itinerarios, derivados de los grabados.
+
+    Precios y horarios varían de forma determinista para que cada tamaño
+    produzca siempre los mismos datos.
+    """
+    with open(FIXTURE_FILE, "r", encoding="utf-8") as f:
+        sample = json.load(f)
+
+    rng = random.Random(size)
+    recorded = sample["itineraries"]
+    itineraries = []
+    for i in range(size):
+        itinerary = copy.deepcopy(recorded[i % len(recorded)])
+        itinerary["id"] = f"{itinerary['id']}-{i}"
+        itinerary["price"]["amount"] = f"{rng.uniform(20, 150):.2f}"
+        shift = timedelta(minutes=rng.randrange(0, 300, 5))
+        for leg in ("outbound", "inbound"):
+            for sector in itinerary[leg]["sectorSegments"]:
+                for end in ("source", "destination"):
+                    point = sector["segment"][end]
+                    local_time = datetime.fromisoformat(point["localTime"][:19]) + shift
+                    point["localTime"] = local_time.strftime("%Y-%m-%dT%H:%M:%S.000")
+        itineraries.append(itinerary)
+    sample["itineraries"] = itineraries
+    return sample
+
+
+def fill_fare_history(history, rows):
+    """Histórico sintético: observaciones repartidas en 30 días para varios destinos y fines de semana"""
+    rng = random.Random(rows)
+    destinations = [("Milan Bergamo", "BGY", "IT"), ("Paris Beauvais", "BVA", "FR"), ("Porto", "OPO", "PT"),
+                    ("London Stansted", "STN", "GB"), ("Eindhoven", "EIN", "NL"), ("Roma Ciampino", "CIA", "IT")]
+    now = time.time()
+    first_friday = datetime.fromtimestamp(now).replace(hour=18, minute=0, second=0, microsecond=0)
+    for start in range(0, rows, 100):
+        batch = []
+        for _ in range(min(100, rows - start)):
+            name, code, country = rng.choice(destinations)
+            outbound = first_friday + timedelta(days=7 * rng.randrange(12))
+            batch.append(Itinerary(
+                rng.uniform(20, 150), outbound, outbound + timedelta(days=2), "Alicante", name,
+                "Ryanair", "Ryanair", "", origin_code="ALC", destination_code=code, destination_country=country
+            ))
+        history.record(batch, observed_at=now - rng.uniform(0, 30 * 86400))
+
+
+def measure(func, min_time=0.2, repeat=5):
+    """Operaciones por segundo (mejor de `repeat` rondas), pico de memoria y bloques que quedan vivos por llamada"""
+    # Calibrar el número de llamadas por ronda
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / 10:
+            break
+        number *= 2
+
+    best = float("inf")
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                func()
+            best = min(best, (time.perf_counter() - start) / number)
+    finally:
+        gc.enable()
+
+    # Memoria de una sola llamada, medida aparte para no distorsionar los tiempos
+    gc.collect()
+    tracemalloc.start()
+    blocks_before = sys.getallocatedblocks()
+    result = func()
+    blocks = sys.getallocatedblocks() - blocks_before
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+
+    return {
+        "ops_per_sec": 1 / best if best else float("inf"),
+        "us_per_op": best * 1e6,
+        "peak_kib": peak / 1024,
+        "alloc_blocks": blocks
+    }
+
+
+def build_benchmarks(state_dir):
+    """Casos a medir: nombre -> función sin argumentos"""
+    benchmarks = {}
+
+    for size in FIXTURE_SIZES:
+        data = load_fixture(size)
+        benchmarks[f"parse_and_filter_flights[{size}]"] = lambda data=data: flight_bot.parse_and_filter_flights(data)
+
+    # Del cuerpo en bytes a itinerarios: árbol JSON completo frente a decodificación incremental
+    for size in FIXTURE_SIZES:
+        body = json.dumps(load_fixture(size), ensure_ascii=False).encode("utf-8")
+        benchmarks[f"decode_parse[json {size}]"] = \
+            lambda body=body: flight_bot.parse_and_filter_flights(json.loads(body))
+        benchmarks[f"decode_parse[stream {size}]"] = \
+            lambda body=body: flight_bot.parse_and_filter_flights(parse_response(body)[0])
+
+    def weekends_all_years():
+        return [flight_bot.get_weekends(month, year) for year in WEEKEND_YEARS for month in range(1, 13)]
+    benchmarks[f"get_weekends[{WEEKEND_YEARS[0]}-{WEEKEND_YEARS[-1]}]"] = weekends_all_years
+
+    holidays = load_holidays(flight_bot.HOLIDAYS_FILE, flight_bot.HOLIDAY_REGIONS)
+    trip_calendar = flight_bot.get_trip_calendar()
+    benchmarks["trip_calendar_build"] = lambda: TripCalendar(holidays)
+    years_start, years_end = datetime(WEEKEND_YEARS[0], 1, 1), datetime(WEEKEND_YEARS[-1], 12, 31)
+    benchmarks[f"trip_pairs[puente {WEEKEND_YEARS[0]}-{WEEKEND_YEARS[-1]}]"] = \
+        lambda: SHAPES["puente"].pairs(trip_calendar, years_start, years_end)
+    matrix_shape = parse_shape(f"{flight_bot.MATRIX_NIGHTS}n")
+    matrix_end = years_start + timedelta(days=flight_bot.MATRIX_MAX_DAYS - 1)
+    benchmarks[f"trip_pairs[{matrix_shape.name} {flight_bot.MATRIX_MAX_DAYS}d]"] = \
+        lambda: matrix_shape.pairs(trip_calendar, years_start, matrix_end)
+
+    flight_bot.preferences_store = PreferencesStore(os.path.join(state_dir, "bench_state.sqlite3"), flight_bot.DESTINATIONS_MASTER)
+
+    def destinations_round_trip():
+        config = flight_bot.load_destinations(1)
+        config["Country:FR"] = not config["Country:FR"]
+        flight_bot.save_destinations(config, 1)
+        return config
+    benchmarks["load_save_destinations"] = destinations_round_trip
+    benchmarks["toggle_destination"] = lambda: flight_bot.preferences_store.toggle(1, "Country:IT")
+
+    history = FareHistory(os.path.join(state_dir, "bench_fares.sqlite3"))
+    fill_fare_history(history, FARE_HISTORY_ROWS)
+    history.load()
+    benchmarks[f"fare_history_summary[{FARE_HISTORY_ROWS}]"] = lambda: history.summary(days=30, since_outbound=datetime.now())
+    benchmarks[f"fare_history_trend[{FARE_HISTORY_ROWS}]"] = lambda: history.trend("IT", days=30)
+
+    places = PlaceIndex(flight_bot.PLACES_INDEX_FILE)
+    if places.available:
+        benchmarks[f"places_search[{len(PLACE_QUERIES)}]"] = lambda: [places.search(q) for q in PLACE_QUERIES]
+        benchmarks["places_get"] = lambda: places.get("Airport:BGY")
+
+    # Cuatro shards de SEARCH_LIMIT itinerarios ya ordenados, fusionados con cupo por destino
+    flights = flight_bot.parse_and_filter_flights(load_fixture(100))
+    shard_results = [
+        ((f"Country:S{i}",), sorted(flights[i::MERGE_SHARDS] * 4, key=lambda it: it.price)[:flight_bot.SEARCH_LIMIT])
+        for i in range(MERGE_SHARDS)
+    ]
+    benchmarks[f"merge_shard_results[{MERGE_SHARDS}x{flight_bot.SEARCH_LIMIT}]"] = \
+        lambda: merge_shard_results(shard_results, flight_bot.SEARCH_LIMIT, destination_cap=5)
+
+    config = flight_bot.get_default_destinations()
+    benchmarks["build_destinations_menu"] = lambda: flight_bot.build_destinations_menu(config)
+    benchmarks["render_destinations_menu[cached]"] = lambda: flight_bot.render_destinations_menu(2)
+    benchmarks["build_months_keyboard"] = flight_bot.build_months_keyboard
+    return benchmarks
+
+
+def compare(results, baseline, threshold):
+    """Nombres de los benchmarks que empeoran más de `threshold` respecto a la línea base"""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if result["ops_per_sec"] < previous["ops_per_sec"] * (1 - threshold):
+            regressions.append(f"{name}: {previous['ops_per_sec']:.0f} → {result['ops_per_sec']:.0f} ops/s")
+        if result["peak_kib"] > previous["peak_kib"] * (1 + threshold) + 1:
+            regressions.append(f"{name}: pico {previous['peak_kib']:.1f} → {result['peak_kib']:.1f} KiB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks offline del bot de vuelos")
+    parser.add_argument("--filter", default="", help="Solo benchmarks cuyo nombre contenga este texto")
+    parser.add_argument("--min-time", type=float, default=0.2, help="Segundos mínimos por ronda de medida")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="Fichero JSON de la línea base")
+    parser.add_argument("--save-baseline", action="store_true", help="Guarda los resultados como línea base")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Empeoramiento tolerado (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    baseline = {}
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as state_dir:
+        benchmarks = build_benchmarks(state_dir)
+        print(f"{'benchmark':<36} {'ops/s':>12} {'µs/op':>10} {'pico KiB':>10} {'bloques':>8} {'vs base':>8}")
+        for name, func in benchmarks.items():
+            if args.filter not in name:
+                continue
+            result = measure(func, min_time=args.min_time)
+            results[name] = result
+            change = ""
+            if name in baseline:
+                change = f"{result['ops_per_sec'] / baseline[name]['ops_per_sec'] - 1:+.0%}"
+            print(f"{name:<36} {result['ops_per_sec']:>12.0f} {result['us_per_op']:>10.1f} "
+                  f"{result['peak_kib']:>10.1f} {result['alloc_blocks']:>8} {change:>8}")
+        flight_bot.preferences_store.close()
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({
+                "created_at": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "results": results
+            }, f, indent=2)
+        print(f"\n💾 Línea base guardada en {args.baseline}")
+        return 0
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\n⚠️ Regresiones (más de un {args.threshold:.0%} peor que la línea base):")
+        for line in regressions:
+            print(f"• {line}")
+        return 1
+    if baseline:
+        print("\n✅ Sin regresiones respecto a la línea base")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
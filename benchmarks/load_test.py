@@ -0,0 +1,347 @@
+"""Prueba de carga de extremo a extremo con Kiwi y Telegram falsos en local.
+
+Arranca un servidor /round-trip falso (latencia, errores y 429 configurables)
+y una API de Telegram falsa, y hace pasar N chats simulados por
+/start → find_<mes> → /destinations + toggles usando la Application real del
+bot. Informa de p50/p95/p99 del tiempo hasta el primer resultado y hasta el
+final de la búsqueda, llamadas a la API y mensajes enviados.
+
+Uso:
+    python benchmarks/load_test.py --chats 50
+    python benchmarks/load_test.py --chats 200 --latency 800 --error-rate 0.05 --rate-limit-rate 0.02
+
+Todo funciona sin conexión; el estado del bot se guarda en un directorio temporal.
+"""
+import argparse
+import asyncio
+import copy
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+from urllib.parse import parse_qsl, urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "round_trip_sample.json")
+BOT_TOKEN = "123456:LOADTEST"
+BOT_PASSWORD = "load-test"
+REASONS = {200: "OK", 404: "Not Found", 429: "Too Many Requests", 500: "Internal Server Error"}
+
+
+async def serve_http(handler, host="127.0.0.1"):
+    """Servidor HTTP/1.1 mínimo con keep-alive; `handler(method, target, headers, body)`
+    devuelve (status, cabeceras extra, cuerpo)"""
+
+    async def handle_connection(reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                status, extra, payload = await handler(method, target, headers, body)
+                head = [
+                    f"HTTP/1.1 {status} {REASONS.get(status, 'OK')}",
+                    "Content-Type: application/json",
+                    f"Content-Length: {len(payload)}",
+                    "Connection: keep-alive"
+                ] + [f"{name}: {value}" for name, value in extra.items()]
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + payload)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle_connection, host, 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+class FakeKiwi:
+    """/round-trip falso: itinerarios dentro de las ventanas pedidas con latencia, errores 5xx y 429"""
+
+    def __init__(self, latency_ms=300, jitter_ms=150, error_rate=0.0, rate_limit_rate=0.0, results=20, seed=1):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.results = results
+        self.rng = random.Random(seed)
+        self.calls = 0
+        self.errors = 0
+        self.rate_limited = 0
+        with open(FIXTURE_FILE, "r", encoding="utf-8") as f:
+            self.templates = json.load(f)["itineraries"]
+
+    def _random_time(self, start, end):
+        start, end = datetime.fromisoformat(start), datetime.fromisoformat(end)
+        moment = start + (end - start) * self.rng.random()
+        return moment.strftime("%Y-%m-%dT%H:%M:00.000")
+
+    def _itinerary(self, i, params):
+        itinerary = copy.deepcopy(self.templates[i % len(self.templates)])
+        itinerary["id"] = f"load-{self.calls}-{i}"
+        itinerary["price"]["amount"] = f"{self.rng.uniform(20, 150):.2f}"
+        destinations = params.get("destination", "").split(",")
+        outbound = itinerary["outbound"]["sectorSegments"][0]["segment"]
+        inbound = itinerary["inbound"]["sectorSegments"][0]["segment"]
+        outbound["source"]["localTime"] = self._random_time(
+            params["outboundDepartureDateStart"], params["outboundDepartureDateEnd"])
+        inbound["source"]["localTime"] = self._random_time(
+            params["inboundDepartureDateStart"], params["inboundDepartureDateEnd"])
+        outbound["destination"]["station"]["name"] = self.rng.choice(destinations)
+        return itinerary
+
+    async def __call__(self, method, target, headers, body):
+        self.calls += 1
+        latency = max(0.0, self.latency_ms + self.rng.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+        await asyncio.sleep(latency)
+
+        roll = self.rng.random()
+        if roll < self.rate_limit_rate:
+            self.rate_limited += 1
+            return 429, {"Retry-After": "1"}, b'{"message": "Too many requests"}'
+        if roll < self.rate_limit_rate + self.error_rate:
+            self.errors += 1
+            return 500, {}, b'{"message": "Internal error"}'
+
+        params = dict(parse_qsl(urlsplit(target).query))
+        count = min(self.results, int(params.get("limit", 5)))
+        payload = {"metadata": {}, "itineraries": [self._itinerary(i, params) for i in range(count)]}
+        return 200, {}, json.dumps(payload).encode("utf-8")
+
+
+class FakeTelegram:
+    """API de Telegram falsa: registra cada mensaje enviado o editado con su instante"""
+
+    def __init__(self, latency_ms=20):
+        self.latency_ms = latency_ms
+        self.message_ids = itertools.count(1)
+        self.calls = {}
+        self.events = {}  # chat_id -> [(instante, método, texto)]
+
+    async def __call__(self, method, target, headers, body):
+        await asyncio.sleep(self.latency_ms / 1000)
+        api_method = urlsplit(target).path.rsplit("/", 1)[-1]
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        if "json" in headers.get("content-type", ""):
+            params = json.loads(body or b"{}")
+        else:
+            params = dict(parse_qsl(body.decode("utf-8")))
+
+        if api_method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Bot de Vuelos", "username": "load_test_bot"}
+        elif api_method in ("sendMessage", "editMessageText", "editMessageReplyMarkup"):
+            chat_id = int(params["chat_id"])
+            self.events.setdefault(chat_id, []).append((time.perf_counter(), api_method, params.get("text", "")))
+            result = {
+                "message_id": int(params.get("message_id") or next(self.message_ids)),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": 1, "is_bot": True, "first_name": "Bot de Vuelos"},
+                "text": params.get("text", "")
+            }
+        else:
+            result = True
+        return 200, {}, json.dumps({"ok": True, "result": result}).encode("utf-8")
+
+
+class ChatSimulator:
+    """Genera las actualizaciones de un usuario que sigue el flujo típico del bot"""
+
+    update_ids = itertools.count(1)
+
+    def __init__(self, app, chat_id):
+        self.app = app
+        self.chat_id = chat_id
+        self.user = {"id": chat_id, "is_bot": False, "first_name": f"Usuario {chat_id}"}
+        self.bot_message = {
+            "message_id": 1, "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": 1, "is_bot": True, "first_name": "Bot de Vuelos"}, "text": "menú"
+        }
+
+    async def command(self, text):
+        from telegram import Update
+        command = text.split()[0]
+        data = {
+            "update_id": next(self.update_ids),
+            "message": {
+                "message_id": next(self.update_ids), "date": int(time.time()),
+                "chat": {"id": self.chat_id, "type": "private"}, "from": self.user, "text": text,
+                "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}]
+            }
+        }
+        await self.app.process_update(Update.de_json(data, self.app.bot))
+
+    async def button(self, callback_data):
+        from telegram import Update
+        data = {
+            "update_id": next(self.update_ids),
+            "callback_query": {
+                "id": str(next(self.update_ids)), "from": self.user, "chat_instance": str(self.chat_id),
+                "data": callback_data, "message": self.bot_message
+            }
+        }
+        await self.app.process_update(Update.de_json(data, self.app.bot))
+
+
+def percentile(values, p):
+    """Percentil por rango más cercano (None si no hay valores)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(p / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+async def run_chat(app, telegram, chat_id, month, toggles, start_delay, timings):
+    """Flujo completo de un chat: login, /start, búsqueda de un mes, /destinations y toggles"""
+    await asyncio.sleep(start_delay)
+    chat = ChatSimulator(app, chat_id)
+    await chat.command(f"/login {BOT_PASSWORD}")
+    await chat.command("/start")
+
+    started = time.perf_counter()
+    await chat.button(f"find_{month}")
+    finished = time.perf_counter()
+    results = [
+        moment for moment, method, text in telegram.events.get(chat_id, ())
+        # El primer resultado llega con la primera línea de fin de semana del mensaje de progreso
+        if moment >= started and ("🗓️" in text or text.startswith(("❌", "⚠️")))
+    ]
+    timings["first_result"].append((min(results) if results else finished) - started)
+    timings["completion"].append(finished - started)
+
+    toggle_started = time.perf_counter()
+    await chat.command("/destinations")
+    codes = ["Country:BE", "Country:CH", "Country:AT", "Country:CZ", "Country:PL"]
+    for code in codes[:toggles]:
+        await chat.button(f"toggle_{code}")
+    timings["destinations"].append(time.perf_counter() - toggle_started)
+
+
+async def main(args):
+    kiwi = FakeKiwi(
+        latency_ms=args.latency, jitter_ms=args.jitter, error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate, results=args.results
+    )
+    telegram = FakeTelegram(latency_ms=args.telegram_latency)
+    kiwi_server, kiwi_port = await serve_http(kiwi)
+    telegram_server, telegram_port = await serve_http(telegram)
+
+    # La configuración del bot se lee del entorno al importarlo
+    os.environ.update({
+        "RAPIDAPI_KEY": "load-test",
+        "BOT_PASSWORD": BOT_PASSWORD,
+        "KIWI_API_URL": f"http://127.0.0.1:{kiwi_port}",
+        "KIWI_RATE_PER_MINUTE": str(args.kiwi_rate),
+        "KIWI_BURST": str(args.kiwi_burst),
+        "CACHE_TTL": "0" if args.no_cache else os.environ.get("CACHE_TTL", "1800"),
+        "PREWARM_HOURS": "",
+        "WATCH_INTERVAL": str(10 ** 6)
+    })
+    sys.path.insert(0, ROOT)
+    import flight_bot
+
+    app = flight_bot.build_application(BOT_TOKEN, base_url=f"http://127.0.0.1:{telegram_port}/bot")
+    await app.initialize()
+    await flight_bot.on_startup(app)
+
+    months = [m.strip().lower() for m in args.months.split(",") if m.strip()]
+    timings = {"first_result": [], "completion": [], "destinations": []}
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        run_chat(app, telegram, 10_000 + i, months[i % len(months)], args.toggles,
+                 args.ramp * i / max(1, args.chats), timings)
+        for i in range(args.chats)
+    ))
+    elapsed = time.perf_counter() - started
+
+    api = flight_bot.kiwi_client.stats()
+    budget = flight_bot.api_budget.stats()
+    outbox_stats = {"sent": flight_bot.outbox.sent, "flood_waits": flight_bot.outbox.flood_waits}
+    await flight_bot.on_shutdown(app)
+    await app.shutdown()
+    kiwi_server.close()
+    telegram_server.close()
+
+    report = {
+        "chats": args.chats,
+        "elapsed_s": elapsed,
+        "latency_s": {
+            name: {f"p{p}": percentile(values, p) for p in (50, 95, 99)}
+            for name, values in timings.items()
+        },
+        "kiwi": {
+            "server_calls": kiwi.calls, "server_errors": kiwi.errors, "server_429": kiwi.rate_limited,
+            "client_requests": api["requests"], "coalesced": api["coalesced"],
+            "retries": budget["retries"], "rejected": budget["rejected"],
+            "parse_mode": api["parse_mode"], "parse_ms": api["parse_ms"], "parse_peak_bytes": api["parse_peak_bytes"]
+        },
+        "telegram": {"calls": telegram.calls, **outbox_stats}
+    }
+
+    print(f"\n📊 {args.chats} chats en {elapsed:.1f} s")
+    for name, label in (("first_result", "Primer resultado"), ("completion", "Búsqueda completa"),
+                        ("destinations", "/destinations + toggles")):
+        values = report["latency_s"][name]
+        print(f"• {label:<24} p50 {values['p50']:.2f} s  p95 {values['p95']:.2f} s  p99 {values['p99']:.2f} s")
+    k = report["kiwi"]
+    print(f"• Kiwi: {k['server_calls']} peticiones al servidor ({k['server_errors']} errores, {k['server_429']} 429), "
+          f"{k['client_requests']} llamadas del cliente, {k['coalesced']} compartidas, {k['retries']} reintentos")
+    print(f"• Parseo ({k['parse_mode']}): {k['parse_ms']:.1f} ms por respuesta, "
+          f"pico retenido {k['parse_peak_bytes'] / 1024:.0f} KiB")
+    print(f"• Telegram: {telegram.calls.get('sendMessage', 0)} mensajes, "
+          f"{telegram.calls.get('editMessageText', 0)} ediciones, {outbox_stats['flood_waits']} esperas por flood")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Prueba de carga offline del bot de vuelos")
+    parser.add_argument("--chats", type=int, default=20, help="Chats simulados simultáneos")
+    parser.add_argument("--ramp", type=float, default=2.0, help="Segundos en que se reparten los inicios de los chats")
+    parser.add_argument("--months", default="enero,febrero,marzo,abril,mayo,junio",
+                        help="Meses buscados, repartidos entre los chats")
+    parser.add_argument("--toggles", type=int, default=3, help="Toggles de destinos por chat (máx. 5)")
+    parser.add_argument("--latency", type=float, default=300, help="Latencia media de Kiwi (ms)")
+    parser.add_argument("--jitter", type=float, default=150, help="Variación de la latencia de Kiwi (± ms)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fracción de respuestas 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fracción de respuestas 429")
+    parser.add_argument("--results", type=int, default=20, help="Itinerarios máximos por respuesta")
+    parser.add_argument("--telegram-latency", type=float, default=20, help="Latencia de la API de Telegram falsa (ms)")
+    parser.add_argument("--kiwi-rate", type=float, default=6000,
+                        help="Llamadas/minuto permitidas por el presupuesto (alto para medir el bot, no el plan)")
+    parser.add_argument("--kiwi-burst", type=int, default=100, help="Ráfaga permitida por el presupuesto")
+    parser.add_argument("--no-cache", action="store_true", help="Desactiva la caché de respuestas")
+    parser.add_argument("--json", help="Guarda el informe en este fichero JSON")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    if arguments.json:
+        arguments.json = os.path.abspath(arguments.json)
+    # El estado del bot (SQLite, destinations.json) queda en un directorio temporal
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        asyncio.run(main(arguments))
@@ -0,0 +1,44 @@
+"""Lectura de destinations.json, la configuración común anterior a las preferencias por usuario"""
+import json
+import logging
+
+
+def load_destinations_file(path, master):
+    """Configuración de destinations.json reconciliada con la maestra (código -> activo).
+
+    Solo se usa para migrarla a la base de datos de preferencias, así que el
+    archivo no se modifica: los destinos que faltan toman su valor por
+    defecto, los obsoletos se ignoran y los valores no booleanos pasan a False.
+    Si el archivo no se puede leer se devuelve la configuración por defecto.
+    """
+    defaults = {code: config["default"] for code, config in master.items()}
+    try:
+        with open(path, "r", encoding='utf-8') as f:
+            loaded_data = json.load(f)
+    except FileNotFoundError:
+        logging.info(f"{path} no encontrado. Se usa la configuración por defecto.")
+        return defaults
+    except (OSError, json.JSONDecodeError, UnicodeDecodeError) as e:
+        logging.error(f"Error al leer {path}: {e}. Se usa la configuración por defecto.")
+        return defaults
+
+    # Validar que los datos cargados sean un diccionario
+    if not isinstance(loaded_data, dict):
+        logging.warning(f"{path} no contiene un diccionario válido. Se usa la configuración por defecto.")
+        return defaults
+
+    missing_keys = set(defaults) - set(loaded_data)
+    if missing_keys:
+        logging.info(f"Destinos sin valor en {path} (se usa el de por defecto): {missing_keys}")
+    obsolete_keys = set(loaded_data) - set(defaults)
+    if obsolete_keys:
+        logging.info(f"Ignorando destinos obsoletos de {path}: {obsolete_keys}")
+
+    config = {}
+    for code, default in defaults.items():
+        value = loaded_data.get(code, default)
+        if not isinstance(value, bool):
+            logging.warning(f"Corrigiendo valor no booleano para {code}: {value} -> False")
+            value = False
+        config[code] = value
+    return config
@@ -0,0 +1,272 @@
+"""Histórico de precios observados y estadísticas vectorizadas con NumPy"""
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+DAY = 86400
+EPOCH = datetime(1970, 1, 1)
+# Columnas que se mantienen en memoria para las consultas
+COLUMNS = np.dtype([
+    ("rowid", "i8"), ("observed_at", "i8"), ("country", "U2"),
+    ("destination", "i4"), ("outbound", "i8"), ("price_cents", "i4")
+])
+
+
+def to_seconds(local_time):
+    """Hora local sin zona (la de la API) como segundos desde 1970, sin desplazamientos"""
+    return int(local_time.replace(tzinfo=timezone.utc).timestamp())
+
+
+def to_date(day):
+    """Día (segundos // DAY) a fecha"""
+    return (EPOCH + timedelta(days=int(day))).date()
+
+
+def group_starts(keys):
+    """Posiciones donde empieza cada grupo en un array de claves ya ordenado"""
+    if len(keys) == 0:
+        return np.empty(0, dtype=np.int64)
+    return np.concatenate(([0], np.flatnonzero(keys[1:] != keys[:-1]) + 1))
+
+
+def group_order(groups, prices_cents):
+    """Orden por (grupo, precio): un único argsort sobre una clave entera combinada, más rápido que lexsort"""
+    return np.argsort((groups.astype(np.int64) << 32) | prices_cents.astype(np.int64))
+
+
+def grouped_percentiles(sorted_values, starts, quantiles):
+    """Percentiles de cada grupo de un array ordenado por (grupo, valor), con interpolación lineal.
+
+    Devuelve una matriz grupos × cuantiles sin recorrer los grupos en Python.
+    """
+    sizes = np.diff(np.append(starts, len(sorted_values)))
+    positions = starts[:, None] + np.asarray(quantiles)[None, :] * (sizes[:, None] - 1)
+    low = np.floor(positions).astype(np.int64)
+    high = np.minimum(low + 1, (starts + sizes - 1)[:, None])
+    fraction = positions - low
+    return sorted_values[low] * (1 - fraction) + sorted_values[high] * fraction
+
+
+class FareHistory:
+    """Registro append-only de cada itinerario devuelto por la API.
+
+    Las filas son solo enteros: fechas en segundos, precio en céntimos y los
+    textos repetidos (destino, ruta, aerolínea) codificados con una tabla de
+    diccionario, así que cada observación ocupa unas decenas de bytes.
+
+    Las columnas que usan las consultas se cargan una vez en un array de NumPy
+    (unos 40 bytes por fila) y después solo se leen las filas nuevas por
+    `rowid`, incluidas las que escriben otros workers. Filtrar y agregar
+    millones de filas es entonces cuestión de milisegundos.
+
+    Las observaciones se acumulan en memoria y se escriben en lote en un hilo
+    (`asyncio.to_thread`) con su propia conexión, `flush_delay` segundos
+    después de la primera, así que el event loop nunca espera al disco.
+    """
+
+    def __init__(self, path, flush_delay=0.0):
+        self._db = sqlite3.connect(path, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS fare_labels ("
+            " id INTEGER PRIMARY KEY, label TEXT NOT NULL UNIQUE);"
+            "CREATE TABLE IF NOT EXISTS fares ("
+            " observed_at INTEGER NOT NULL, country TEXT NOT NULL,"
+            " destination INTEGER NOT NULL, route INTEGER NOT NULL, carrier INTEGER NOT NULL,"
+            " outbound INTEGER NOT NULL, inbound INTEGER NOT NULL, price_cents INTEGER NOT NULL);"
+        )
+        self._db.commit()
+        self._label_ids = dict(self._db.execute("SELECT label, id FROM fare_labels"))
+        self._labels = {label_id: label for label, label_id in self._label_ids.items()}
+        self.recorded = 0
+        self._columns = np.empty(0, dtype=COLUMNS)
+        self._last_rowid = 0
+        # Escrituras: una conexión aparte que solo usa quien tiene `_write_lock`
+        self._writer = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self._writer.execute("PRAGMA synchronous=NORMAL")
+        self._write_lock = threading.Lock()
+        self.flush_delay = flush_delay
+        self._pending = []
+        self._flush_handle = None
+        self._flush_task = None
+
+    def _label_id(self, label):
+        label_id = self._label_ids.get(label)
+        if label_id is None:
+            self._writer.execute("INSERT OR IGNORE INTO fare_labels (label) VALUES (?)", (label,))
+            # Otro worker puede haberla insertado antes
+            label_id = self._writer.execute("SELECT id FROM fare_labels WHERE label = ?", (label,)).fetchone()[0]
+            self._label_ids[label] = label_id
+            self._labels[label_id] = label
+        return label_id
+
+    def label(self, label_id):
+        label = self._labels.get(label_id)
+        if label is None:
+            row = self._db.execute("SELECT label FROM fare_labels WHERE id = ?", (label_id,)).fetchone()
+            label = self._labels[label_id] = row[0] if row else "?"
+        return label
+
+    def record(self, itineraries, country="", observed_at=None):
+        """Encola las observaciones; `country` se usa si el itinerario no trae el país del destino"""
+        if not itineraries:
+            return
+        observed_at = int(observed_at or time.time())
+        self._pending.extend(
+            (
+                observed_at, it.destination_country or country, it.destination,
+                f"{it.origin_code or it.origin}-{it.destination_code or it.destination}", it.outbound_carrier,
+                to_seconds(it.outbound_time), to_seconds(it.inbound_time), round(it.price * 100)
+            )
+            for it in itineraries
+        )
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        """Programa el volcado en lote; sin event loop en marcha se escribe al momento"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+
+        if loop is None:
+            self.flush()
+        elif self._flush_handle is None and self._flush_task is None:
+            self._flush_handle = loop.call_later(self.flush_delay, self._start_flush)
+
+    def _start_flush(self):
+        self._flush_handle = None
+        rows, self._pending = self._pending, []
+        self._flush_task = asyncio.ensure_future(asyncio.to_thread(self._write, rows))
+        self._flush_task.add_done_callback(self._flush_done)
+
+    def _flush_done(self, task):
+        self._flush_task = None
+        # Lo que llegó mientras se escribía va en el siguiente lote
+        if self._pending:
+            self._schedule_flush()
+
+    def flush(self):
+        """Escribe ya las observaciones pendientes (tras el lote en curso, si lo hay)"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        rows, self._pending = self._pending, []
+        self._write(rows)
+
+    def _write(self, rows):
+        """Inserta un lote en una transacción; se ejecuta en un hilo salvo desde `flush`"""
+        if not rows:
+            return
+        with self._write_lock:
+            try:
+                self._writer.executemany("INSERT INTO fares VALUES (?, ?, ?, ?, ?, ?, ?, ?)", [
+                    (observed_at, country, self._label_id(destination), self._label_id(route),
+                     self._label_id(carrier), outbound, inbound, price_cents)
+                    for observed_at, country, destination, route, carrier, outbound, inbound, price_cents in rows
+                ])
+                self._writer.commit()
+                self.recorded += len(rows)
+            except sqlite3.Error as e:
+                logging.error(f"Error guardando el histórico de precios: {e}")
+
+    def load(self):
+        """Columnas en memoria, añadiendo las filas escritas desde la última consulta"""
+        new = np.fromiter(self._db.execute(
+            "SELECT rowid, observed_at, country, destination, outbound, price_cents"
+            " FROM fares WHERE rowid > ? ORDER BY rowid", (self._last_rowid,)
+        ), dtype=COLUMNS)
+        if len(new):
+            self._columns = np.concatenate((self._columns, new))
+            self._last_rowid = int(new["rowid"][-1])
+        return self._columns
+
+    def summary(self, days=30, since_outbound=None, max_destinations=10):
+        """Estadísticas de lo observado en los últimos `days` días.
+
+        Por destino: observaciones, mínimo y percentiles 25/50/75. Por fin de
+        semana (desde `since_outbound`): el precio más bajo y su destino.
+        """
+        columns = self.load()
+        columns = columns[columns["observed_at"] >= time.time() - days * DAY]
+        destinations, outbound, prices = columns["destination"], columns["outbound"], columns["price_cents"] / 100
+
+        order = group_order(destinations, columns["price_cents"])
+        starts = group_starts(destinations[order])
+        counts = np.diff(np.append(starts, len(order)))
+        percentiles = grouped_percentiles(prices[order], starts, (0, 0.25, 0.5, 0.75))
+        by_destination = [
+            {
+                "destination": self.label(int(destinations[order[start]])), "observations": int(count),
+                "min": float(row[0]), "p25": float(row[1]), "median": float(row[2]), "p75": float(row[3])
+            }
+            for start, count, row in zip(starts, counts, percentiles)
+        ]
+        by_destination.sort(key=lambda d: -d["observations"])
+
+        # El primer elemento de cada día de salida tras ordenar por (día, precio) es el más barato
+        days_out = outbound // DAY
+        if since_outbound is not None:
+            upcoming = days_out >= to_seconds(since_outbound) // DAY
+            days_out, prices, destinations = days_out[upcoming], prices[upcoming], destinations[upcoming]
+        order = group_order(days_out, prices * 100)
+        starts = group_starts(days_out[order])
+        cheapest = [
+            {"date": to_date(days_out[i]), "price": float(prices[i]), "destination": self.label(int(destinations[i]))}
+            for i in order[starts]
+        ]
+
+        return {
+            "observations": len(columns),
+            "destinations": by_destination[:max_destinations],
+            "weekends": cheapest
+        }
+
+    def trend(self, country, days=30):
+        """Evolución del precio de un país: mínimo y mediana por día de observación y pendiente (€/semana)"""
+        columns = self.load()
+        columns = columns[(columns["country"] == country) & (columns["observed_at"] >= time.time() - days * DAY)]
+        if len(columns) == 0:
+            return None
+        observed_days, prices = columns["observed_at"] // DAY, columns["price_cents"] / 100
+
+        order = group_order(observed_days, columns["price_cents"])
+        sorted_days = observed_days[order]
+        starts = group_starts(sorted_days)
+        day_values = sorted_days[starts].astype(np.float64)
+        daily_min = prices[order][starts]
+        daily_median = grouped_percentiles(prices[order], starts, (0.5,))[:, 0]
+
+        # Regresión lineal del mínimo diario; con un solo día no hay tendencia
+        slope = float(np.polyfit(day_values, daily_min, 1)[0]) * 7 if len(starts) > 1 else 0.0
+        overall = np.percentile(prices, (10, 50, 90))
+        return {
+            "observations": len(columns),
+            "days": [
+                {"date": to_date(day), "min": float(low), "median": float(median)}
+                for day, low, median in zip(day_values, daily_min, daily_median)
+            ],
+            "slope_per_week": slope,
+            "p10": float(overall[0]), "median": float(overall[1]), "p90": float(overall[2])
+        }
+
+    def stats(self):
+        # Tabla append-only: MAX(rowid) cuenta las filas sin recorrerlas
+        rows = self._db.execute("SELECT MAX(rowid), MIN(observed_at) FROM fares").fetchone()
+        return {
+            "rows": rows[0] or 0,
+            "since": datetime.fromtimestamp(rows[1]) if rows[1] else None,
+            "recorded": self.recorded,
+            "pending": len(self._pending)
+        }
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+        self._db.close()
@@ -1,13 +1,39 @@
-import json
+import asyncio
 import logging
 import calendar
 import os
+import time
+import unicodedata
+from urllib.parse import urlsplit
 from datetime import datetime, timedelta
-import requests
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes, CallbackQueryHandler
+from telegram import (
+    Update, InlineKeyboardButton, InlineKeyboardMarkup, LinkPreviewOptions,
+    InlineQueryResultArticle, InputTextMessageContent
+)
+from telegram.error import BadRequest
+from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes, CallbackQueryHandler, InlineQueryHandler
 from dotenv import load_dotenv
 from functools import wraps
+from kiwi_client import KiwiClient, KiwiAPIError, KIWI_BASE_URL, build_round_trip_params
+from flight_cache import ResponseCache
+from api_budget import ApiBudget
+from destinations_store import load_destinations_file
+from preferences_store import PreferencesStore, is_place_id
+from outbox import MessageOutbox, StatusMessage, pack_messages
+from query_planner import QueryPlanner
+from itinerary import Itinerary
+from price_watch import WatchStore, diff_itineraries
+from prewarm import SearchHistory, PrewarmBudget, parse_hours, prioritize_months
+from metrics import Gauge, Histogram, start_metrics_server
+from tracing import HandlerProfiler, tracer
+from shared_state import SharedState
+from fare_history import FareHistory
+from result_sessions import ResultSessions, SearchResults, WeekendResults
+from response_parser import ParserPool
+from places import PlaceIndex, place_label
+from render_cache import RenderCache
+from sharding import DestinationSharder, merge_shard_results
+from trip_shapes import SHAPES, WEEKDAY_SHORT, TripCalendar, load_holidays, parse_shape
 
 load_dotenv()
 
@@ -23,9 +49,185 @@ MONTHS = {
     "enero": 1, "febrero": 2, "marzo": 3, "abril": 4, "mayo": 5, "junio": 6,
     "julio": 7, "agosto": 8, "septiembre": 9, "octubre": 10, "noviembre": 11, "diciembre": 12
 }
+MONTH_NAMES = {number: name for name, number in MONTHS.items()}
 DESTINATIONS_FILE = "destinations.json"
 BOT_PASSWORD = os.getenv('BOT_PASSWORD')
-AUTHORIZED_USERS = set()
+# Búsqueda en curso por chat en este worker (chat_id -> asyncio.Task); entre workers se
+# coordinan con shared_state y cada búsqueda comprueba cada ACTIVE_SEARCH_POLL segundos si sigue vigente
+ACTIVE_SEARCHES = {}
+ACTIVE_SEARCH_POLL = float(os.getenv('ACTIVE_SEARCH_POLL', '1'))
+
+# Cliente HTTP compartido para la API de Kiwi (pool de conexiones keep-alive)
+KIWI_POOL_SIZE = int(os.getenv('KIWI_POOL_SIZE', '10'))
+KIWI_KEEPALIVE_CONNECTIONS = int(os.getenv('KIWI_KEEPALIVE_CONNECTIONS', '5'))
+KIWI_CONNECT_TIMEOUT = float(os.getenv('KIWI_CONNECT_TIMEOUT', '10'))
+KIWI_READ_TIMEOUT = float(os.getenv('KIWI_READ_TIMEOUT', '30'))
+KIWI_API_URL = os.getenv('KIWI_API_URL', KIWI_BASE_URL)
+# Decodificación de las respuestas según llegan, fuera del event loop:
+# "thread", "process" o "inline" (en el propio event loop), y tamaño del pool
+KIWI_PARSE_MODE = os.getenv('KIWI_PARSE_MODE', 'thread')
+KIWI_PARSE_WORKERS = int(os.getenv('KIWI_PARSE_WORKERS', '2'))
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '64'))
+# Consultas simultáneas a la API: en todo el proceso y dentro de una misma búsqueda
+KIWI_MAX_CONCURRENCY = int(os.getenv('KIWI_MAX_CONCURRENCY', '10'))
+SEARCH_CONCURRENCY = int(os.getenv('SEARCH_CONCURRENCY', '5'))
+
+# Planificador de consultas: fines de semana por llamada y huecos máximos a unir
+# (PLANNER_MAX_GAP_DAYS=0 solo agrupa ventanas repetidas o solapadas)
+SEARCH_LIMIT = int(os.getenv('SEARCH_LIMIT', '20'))
+PLANNER_MAX_GAP_DAYS = int(os.getenv('PLANNER_MAX_GAP_DAYS', '0'))
+PLANNER_MAX_SPAN_DAYS = int(os.getenv('PLANNER_MAX_SPAN_DAYS', '31'))
+PLANNER_OVERSAMPLE = int(os.getenv('PLANNER_OVERSAMPLE', '3'))
+PLANNER_MAX_LIMIT = int(os.getenv('PLANNER_MAX_LIMIT', '100'))
+
+query_planner = QueryPlanner(
+    window_limit=SEARCH_LIMIT,
+    max_gap_days=PLANNER_MAX_GAP_DAYS,
+    max_span_days=PLANNER_MAX_SPAN_DAYS,
+    oversample=PLANNER_OVERSAMPLE,
+    max_limit=PLANNER_MAX_LIMIT
+)
+
+# Reparto de los destinos de cada consulta en varias llamadas según lo que
+# suele devolver cada uno (SEARCH_SHARDS=1: una sola llamada con todos) y
+# vuelos máximos por destino en los resultados (0 = sin límite)
+SEARCH_SHARDS = int(os.getenv('SEARCH_SHARDS', '1'))
+DESTINATION_CAP = int(os.getenv('DESTINATION_CAP', '0'))
+destination_sharder = None
+
+# Estado persistente del bot (suscripciones /watch)
+STATE_DB_FILE = os.getenv('STATE_DB_FILE', 'bot_state.sqlite3')
+# Vigilancia de precios: segundos entre revisiones, bajada mínima (%) para avisar
+# y segundos que se recuerda un itinerario que ha dejado de aparecer
+WATCH_INTERVAL = int(os.getenv('WATCH_INTERVAL', '21600'))
+WATCH_DROP_PERCENT = float(os.getenv('WATCH_DROP_PERCENT', '10'))
+WATCH_SEEN_TTL = int(os.getenv('WATCH_SEEN_TTL', '604800'))
+watch_store = None
+
+# Precarga de la caché en horas valle: horas en que se ejecuta, meses por delante,
+# fracción de la cuota mensual (o máximo diario si no se conoce), vigencia de lo precargado
+# y cuántas de las selecciones de destinos más comunes entre los usuarios se precargan
+PREWARM_HOURS = parse_hours(os.getenv('PREWARM_HOURS', '2-6'))
+PREWARM_MONTHS = int(os.getenv('PREWARM_MONTHS', '3'))
+PREWARM_BUDGET_SHARE = float(os.getenv('PREWARM_BUDGET_SHARE', '0.2'))
+PREWARM_MAX_CALLS_PER_DAY = int(os.getenv('PREWARM_MAX_CALLS_PER_DAY', '50'))
+PREWARM_TTL = int(os.getenv('PREWARM_TTL', '43200'))
+PREWARM_SELECTIONS = int(os.getenv('PREWARM_SELECTIONS', '3'))
+PREWARM_INTERVAL = 3600
+prewarm_budget = PrewarmBudget(share=PREWARM_BUDGET_SHARE, max_calls_per_day=PREWARM_MAX_CALLS_PER_DAY)
+search_history = None
+
+# Resultados de /find: se envía un resumen y el detalle se pagina desde una
+# sesión (en STATE_DB_FILE) sin volver a llamar a la API
+RESULTS_PAGE_SIZE = int(os.getenv('RESULTS_PAGE_SIZE', '5'))
+RESULT_SESSION_TTL = int(os.getenv('RESULT_SESSION_TTL', '86400'))
+RESULT_SESSION_MAX = int(os.getenv('RESULT_SESSION_MAX', '200'))
+result_sessions = None
+
+# Histórico de precios de cada respuesta nueva de la API (vacío = desactivado)
+# y días observados que resumen /stats y /trend
+FARE_HISTORY_FILE = os.getenv('FARE_HISTORY_FILE', 'fare_history.sqlite3')
+FARE_STATS_DAYS = int(os.getenv('FARE_STATS_DAYS', '30'))
+# Las observaciones se escriben en lote, fuera del event loop, cada FARE_HISTORY_FLUSH_DELAY segundos
+FARE_HISTORY_FLUSH_DELAY = float(os.getenv('FARE_HISTORY_FLUSH_DELAY', '2'))
+fare_history = None
+
+# Datos que acompañan al código (índice de lugares, festivos): por defecto junto
+# a este fichero, se arranque el bot desde donde se arranque
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# Registro de aeropuertos, ciudades y países para /destino, /origen y el modo
+# inline (índice generado con places.py; se mapea en memoria al primer uso)
+PLACES_INDEX_FILE = os.getenv('PLACES_INDEX_FILE', os.path.join(DATA_DIR, 'places.idx'))
+PLACE_CHOICES = int(os.getenv('PLACE_CHOICES', '5'))
+INLINE_RESULTS = int(os.getenv('INLINE_RESULTS', '10'))
+# Origen de las búsquedas para quien no ha elegido uno con /origen
+DEFAULT_SOURCE = os.getenv('DEFAULT_SOURCE', 'Airport:ALC,Airport:RMU')
+places = PlaceIndex(PLACES_INDEX_FILE)
+
+# Formas de viaje de /find y /matrix: festivos (CSV date,region,name) de las
+# regiones indicadas para calcular los puentes, noches por defecto de /matrix,
+# días máximos de su rango y límites de sus llamadas (cada llamada cubre como
+# mucho MATRIX_WINDOWS_PER_CALL combinaciones de salida y vuelta y pide
+# MATRIX_OVERSAMPLE itinerarios por combinación, sin pasar de MATRIX_MAX_LIMIT)
+HOLIDAYS_FILE = os.getenv('HOLIDAYS_FILE', os.path.join(DATA_DIR, 'holidays.csv'))
+HOLIDAY_REGIONS = {region.strip() for region in os.getenv('HOLIDAY_REGIONS', 'ES,VC,MC').split(',') if region.strip()}
+DEFAULT_SHAPE = SHAPES["finde"]
+MATRIX_NIGHTS = os.getenv('MATRIX_NIGHTS', '2-4')
+MATRIX_MAX_DAYS = int(os.getenv('MATRIX_MAX_DAYS', '62'))
+MATRIX_MAX_SPAN_DAYS = int(os.getenv('MATRIX_MAX_SPAN_DAYS', '35'))
+MATRIX_WINDOWS_PER_CALL = int(os.getenv('MATRIX_WINDOWS_PER_CALL', '6'))
+MATRIX_OVERSAMPLE = int(os.getenv('MATRIX_OVERSAMPLE', '15'))
+MATRIX_MAX_LIMIT = int(os.getenv('MATRIX_MAX_LIMIT', str(PLANNER_MAX_LIMIT)))
+# Columnas de noches que caben en un mensaje de Telegram con MATRIX_MAX_DAYS filas
+MATRIX_MAX_NIGHTS = 7
+# Celda de /matrix de la que no se sabe el precio (la llamada se llenó con otras más baratas)
+MATRIX_UNKNOWN = object()
+trip_calendar = None
+
+# En la matriz solo interesa el vuelo más barato de cada celda: un itinerario
+# por ventana y pocas ventanas por llamada, para que los vuelos baratos de unas
+# combinaciones no llenen el `limit` y dejen a las demás sin resultados
+matrix_planner = QueryPlanner(
+    window_limit=1,
+    max_gap_days=MATRIX_MAX_SPAN_DAYS,
+    max_span_days=MATRIX_MAX_SPAN_DAYS,
+    oversample=MATRIX_OVERSAMPLE,
+    max_limit=MATRIX_MAX_LIMIT,
+    max_windows=MATRIX_WINDOWS_PER_CALL
+)
+
+# Caché de respuestas de la API (CACHE_TTL=0 la desactiva)
+CACHE_FILE = os.getenv('CACHE_FILE', 'flight_cache.sqlite3')
+CACHE_TTL = int(os.getenv('CACHE_TTL', '1800'))
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '1000'))
+response_cache = None
+
+# Presupuesto de RapidAPI: ritmo del plan, cuota mensual (0 = según cabeceras),
+# llamadas reservadas, reintentos y circuit breaker
+KIWI_RATE_PER_MINUTE = float(os.getenv('KIWI_RATE_PER_MINUTE', '30'))
+KIWI_BURST = int(os.getenv('KIWI_BURST', '5'))
+KIWI_MONTHLY_QUOTA = int(os.getenv('KIWI_MONTHLY_QUOTA', '0'))
+KIWI_QUOTA_RESERVE = int(os.getenv('KIWI_QUOTA_RESERVE', '0'))
+KIWI_MAX_RETRIES = int(os.getenv('KIWI_MAX_RETRIES', '3'))
+KIWI_BREAKER_THRESHOLD = int(os.getenv('KIWI_BREAKER_THRESHOLD', '5'))
+KIWI_BREAKER_SECONDS = int(os.getenv('KIWI_BREAKER_SECONDS', '60'))
+
+api_budget = ApiBudget(
+    rate_per_minute=KIWI_RATE_PER_MINUTE,
+    burst=KIWI_BURST,
+    monthly_quota=KIWI_MONTHLY_QUOTA,
+    reserve=KIWI_QUOTA_RESERVE,
+    max_retries=KIWI_MAX_RETRIES,
+    failure_threshold=KIWI_BREAKER_THRESHOLD,
+    open_seconds=KIWI_BREAKER_SECONDS
+)
+
+kiwi_client = KiwiClient(
+    RAPIDAPI_KEY,
+    pool_size=KIWI_POOL_SIZE,
+    keepalive_connections=KIWI_KEEPALIVE_CONNECTIONS,
+    connect_timeout=KIWI_CONNECT_TIMEOUT,
+    read_timeout=KIWI_READ_TIMEOUT,
+    max_concurrency=KIWI_MAX_CONCURRENCY,
+    budget=api_budget,
+    base_url=KIWI_API_URL,
+    parser=ParserPool(KIWI_PARSE_MODE, KIWI_PARSE_WORKERS)
+)
+
+# Envío a Telegram: mensajes/segundo de todo el bot, segundos entre mensajes
+# a un mismo chat (privado / grupo) y segundos entre ediciones del estado
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '30'))
+TELEGRAM_CHAT_INTERVAL = float(os.getenv('TELEGRAM_CHAT_INTERVAL', '1'))
+TELEGRAM_GROUP_INTERVAL = float(os.getenv('TELEGRAM_GROUP_INTERVAL', '3'))
+STATUS_EDIT_INTERVAL = float(os.getenv('STATUS_EDIT_INTERVAL', '2'))
+NO_LINK_PREVIEW = LinkPreviewOptions(is_disabled=True)
+
+outbox = MessageOutbox(
+    global_rate=TELEGRAM_GLOBAL_RATE,
+    private_interval=TELEGRAM_CHAT_INTERVAL,
+    group_interval=TELEGRAM_GROUP_INTERVAL
+)
 
 # Configuración maestra de destinos disponibles (nombres y valores por defecto)
 DESTINATIONS_MASTER = {
@@ -51,11 +253,73 @@ DESTINATIONS_MASTER = {
     "Country:IE": {"name": "🇮🇪 Irlanda", "default": False}
 }
 
+# Endpoint de métricas Prometheus en local (METRICS_PORT=0 lo desactiva)
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+metrics_server = None
+
+HANDLER_SECONDS = Histogram("handler_seconds", "Duración de cada handler de Telegram", labels=("handler",))
+PARSE_SECONDS = Histogram("parse_flights_seconds", "Duración de parse_and_filter_flights")
+PARSED_ITINERARIES = Histogram(
+    "parsed_itineraries", "Itinerarios obtenidos por cada respuesta parseada",
+    buckets=(0, 1, 5, 10, 20, 50, 100, 200, 500)
+)
+DESTINATIONS_SECONDS = Histogram(
+    "destinations_config_seconds", "Duración de las lecturas y escrituras de destinos", labels=("operation",)
+)
+ACTIVE_SEARCHES_GAUGE = Gauge("active_searches", "Búsquedas /find en curso", function=lambda: len(ACTIVE_SEARCHES))
+
+# Trazas por actualización (JSONL en formato Trace Event; vacío = desactivadas), fracción
+# de actualizaciones trazadas y % de invocaciones de handlers perfiladas con cProfile
+TRACE_FILE = os.getenv('TRACE_FILE', '')
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '1'))
+PROFILE_SAMPLE_PERCENT = float(os.getenv('PROFILE_SAMPLE_PERCENT', '0'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+tracer.configure(TRACE_FILE, sample_rate=TRACE_SAMPLE_RATE)
+handler_profiler = HandlerProfiler(sample_percent=PROFILE_SAMPLE_PERCENT, output_dir=PROFILE_DIR)
+
+# Modo webhook: URL pública completa (vacía = polling); su ruta es la que escucha
+# el servidor local. Varios procesos pueden servir el mismo bot detrás de un proxy
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+
+# Textos y teclados ya generados (/start, /destinations, /help), por usuario y
+# versión de su configuración
+RENDER_CACHE_MAX = int(os.getenv('RENDER_CACHE_MAX', '1000'))
+render_cache = RenderCache(max_entries=RENDER_CACHE_MAX)
+
+# Usuarios autenticados y turnos de las tareas periódicas, compartidos por
+# todos los workers en STATE_DB_FILE
+shared_state = None
+
+# Destinos activos de cada usuario (en STATE_DB_FILE); destinations.json solo
+# se lee una vez para importar la configuración común anterior a quien ya la usaba.
+# Los cambios se vuelcan tras DESTINATIONS_FLUSH_DELAY segundos sin toggles
+DESTINATIONS_FLUSH_DELAY = float(os.getenv('DESTINATIONS_FLUSH_DELAY', '1'))
+preferences_store = None
+
+def instrument_handler(handler):
+    """Mide la duración del handler, abre una traza por actualización y perfila una muestra de invocaciones"""
+    name = handler.__name__
+
+    @wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
+        chat_id = update.effective_chat.id if update.effective_chat else None
+        with HANDLER_SECONDS.time(handler=name), \
+                tracer.trace(name, update_id=update.update_id, chat_id=chat_id), \
+                handler_profiler.sample(name):
+            return await handler(update, context, *args, **kwargs)
+    return wrapper
+
+@instrument_handler
 async def login(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Permite al usuario autenticarse con la contraseña del bot"""
     user_id = update.effective_user.id
 
-    if user_id in AUTHORIZED_USERS:
+    if shared_state.is_authorized(user_id):
         await update.message.reply_text("✅ Ya estás autenticado.")
         return
 
@@ -65,7 +329,7 @@ async def login(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     password = context.args[0]
     if password == BOT_PASSWORD:
-        AUTHORIZED_USERS.add(user_id)
+        shared_state.authorize(user_id)
         await update.message.reply_text("🔓 Acceso concedido. Ya puedes usar el bot.")
     else:
         await update.message.reply_text("❌ Contraseña incorrecta. Inténtalo de nuevo.")
@@ -74,7 +338,7 @@ def require_authentication(handler):
     @wraps(handler)
     async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
         user_id = update.effective_user.id
-        if user_id not in AUTHORIZED_USERS:
+        if not shared_state.is_authorized(user_id):
             await update.effective_message.reply_text("🚫 Necesitas autenticarte con `/login tu_contraseña`.")
             return
         return await handler(update, context, *args, **kwargs)
@@ -89,187 +353,268 @@ def get_default_destinations():
     return {code: config["default"] for code, config in DESTINATIONS_MASTER.items()}
 
 def get_country_name(code):
-    """Obtiene el nombre amigable de un país"""
-    return DESTINATIONS_MASTER.get(code, {}).get("name", code.replace("Country:", ""))
+    """Obtiene el nombre amigable de un destino (país de la configuración maestra o lugar del registro)"""
+    if code in DESTINATIONS_MASTER:
+        return DESTINATIONS_MASTER[code]["name"]
+    place = places.get(code)
+    return place_label(place) if place else code.split(":", 1)[-1]
+
+def get_source_name(source):
+    """Nombre amigable de un origen, que puede combinar varios lugares ("Airport:ALC,Airport:RMU")"""
+    return " + ".join(get_country_name(code) for code in source.split(","))
+
+def get_search_source(user_id):
+    """Origen de las búsquedas del usuario: el elegido con /origen o el predeterminado"""
+    return preferences_store.get_origin(user_id) or DEFAULT_SOURCE
+
+def find_country(text):
+    """Código de destino ("Country:IT") a partir de un nombre ("italia") o código ISO ("IT")"""
+    def normalize(value):
+        value = unicodedata.normalize("NFKD", value.lower())
+        return "".join(c for c in value if c.isalnum() or c == " ").strip()
+
+    wanted = normalize(text)
+    for code, info in DESTINATIONS_MASTER.items():
+        if wanted in (normalize(info["name"]), code.split(":")[1].lower()):
+            return code
+    return None
 
 def is_valid_destination(code):
     """Verifica si un código de destino es válido"""
     return code in DESTINATIONS_MASTER
 
-def load_destinations():
-    """Carga la configuración de destinos desde el archivo JSON"""
+def load_destinations(user_id):
+    """Carga la configuración de destinos del usuario"""
     try:
-        with open(DESTINATIONS_FILE, "r", encoding='utf-8') as f:
-            loaded_data = json.load(f)
-            
-        # Validar que los datos cargados sean un diccionario
-        if not isinstance(loaded_data, dict):
-            logging.warning("destinations.json no contiene un diccionario válido. Recreando archivo.")
-            default_config = get_default_destinations()
-            save_destinations(default_config)
-            return default_config.copy()
-            
-        # Verificar que todas las claves esperadas estén presentes
-        default_config = get_default_destinations()
-        missing_keys = set(default_config.keys()) - set(loaded_data.keys())
-        if missing_keys:
-            logging.info(f"Agregando destinos faltantes: {missing_keys}")
-            for key in missing_keys:
-                loaded_data[key] = default_config[key]
-            save_destinations(loaded_data)
-            
-        # Eliminar claves obsoletas que ya no están en la configuración
-        obsolete_keys = set(loaded_data.keys()) - set(default_config.keys())
-        if obsolete_keys:
-            logging.info(f"Eliminando destinos obsoletos: {obsolete_keys}")
-            for key in obsolete_keys:
-                del loaded_data[key]
-            save_destinations(loaded_data)
-            
-        return loaded_data
-        
-    except FileNotFoundError:
-        logging.info("destinations.json no encontrado. Creando archivo con configuración por defecto.")
-        default_config = get_default_destinations()
-        save_destinations(default_config)
-        return default_config.copy()
-        
-    except json.JSONDecodeError as e:
-        logging.error(f"Error al decodificar destinations.json: {e}")
-        logging.info("Recreando archivo con configuración por defecto.")
-        default_config = get_default_destinations()
-        save_destinations(default_config)
-        return default_config.copy()
-        
+        with DESTINATIONS_SECONDS.time(operation="load"):
+            return preferences_store.get(user_id)
+
     except Exception as e:
-        logging.error(f"Error inesperado al cargar destinations.json: {e}")
+        logging.error(f"Error cargando los destinos del usuario {user_id}: {e}")
         return get_default_destinations().copy()
 
-def save_destinations(data):
-    """Guarda la configuración de destinos en el archivo JSON.
+def save_destinations(data, user_id):
+    """Guarda la configuración de destinos del usuario.
     Solo guarda el estado activo/inactivo, no los nombres ni configuración maestra.
     """
-    try:
-        # Validar que data sea un diccionario
-        if not isinstance(data, dict):
-            logging.error("Intento de guardar datos no válidos en destinations.json")
-            return False
-        
-        # Filtrar solo destinos válidos y valores booleanos
-        filtered_data = {}
-        for key, value in data.items():
-            if is_valid_destination(key) and isinstance(value, bool):
-                filtered_data[key] = value
-            elif is_valid_destination(key):
-                # Convertir valores no booleanos a False
-                filtered_data[key] = False
-                logging.warning(f"Convirtiendo valor no booleano a False para {key}")
-            else:
-                logging.warning(f"Ignorando destino no válido: {key}")
-            
-        with open(DESTINATIONS_FILE, "w", encoding='utf-8') as f:
-            json.dump(filtered_data, f, indent=2, ensure_ascii=False)
-        logging.info(f"Configuración de destinos guardada: {len(filtered_data)} destinos")
-        return True
-        
-    except Exception as e:
-        logging.error(f"Error al guardar destinations.json: {e}")
-        return False
+    with DESTINATIONS_SECONDS.time(operation="save"):
+        return preferences_store.save(user_id, data)
+
+def get_destinations_version(user_id):
+    """Versión de la configuración de destinos del usuario; cambia con cada modificación"""
+    return preferences_store.version(user_id)
 
-def get_selected_destinations():
-    """Obtiene solo los destinos activos"""
-    config = load_destinations()
+def get_selected_destinations(user_id):
+    """Obtiene solo los destinos activos del usuario"""
+    config = load_destinations(user_id)
     selected = [k for k, v in config.items() if v is True]
-    logging.info(f"Destinos activos: {len(selected)} de {len(config)}")
+    logging.info(f"Destinos activos del usuario {user_id}: {len(selected)} de {len(config)}")
     return selected
 
-def validate_destinations_config():
-    """Valida y corrige la configuración de destinos si es necesario"""
-    try:
-        config = load_destinations()
-        corrected = False
-        
-        # Asegurar que todos los valores sean booleanos
-        for key, value in config.items():
-            if not isinstance(value, bool):
-                logging.warning(f"Corrigiendo valor no booleano para {key}: {value} -> False")
-                config[key] = False
-                corrected = True
-                
-        if corrected:
-            save_destinations(config)
-            
-        return config
-        
-    except Exception as e:
-        logging.error(f"Error validando configuración de destinos: {e}")
-        return get_default_destinations().copy()
+def migrate_destinations_file():
+    """Importa destinations.json (configuración común anterior) para los usuarios que ya estaban autenticados.
+    Los nuevos parten de los valores por defecto de DESTINATIONS_MASTER.
+    """
+    legacy = load_destinations_file(DESTINATIONS_FILE, DESTINATIONS_MASTER) if os.path.exists(DESTINATIONS_FILE) else None
+    preferences_store.migrate_from_json(legacy, shared_state.authorized_users())
 
-def get_weekends(month: int, year: int):
-    """Obtiene todos los fines de semana (viernes-domingo) de un mes"""
-    weekends = []
+def resolve_year(month: int, args):
+    """Año de la búsqueda: el primer argumento numérico tras el mes (en cualquier posición,
+    p. ej. "agosto puente 2027") o, si no hay, la próxima vez que llegue ese mes
+    """
+    years = [arg for arg in args[1:] if arg.isdigit()]
+    if years:
+        return int(years[0])
+    # Si el mes ya pasó este año, usar el próximo año
+    now = datetime.now()
+    return now.year + 1 if month < now.month else now.year
+
+def get_trip_calendar():
+    """Calendario de días laborables, festivos y puentes (se calcula la primera vez que se usa)"""
+    global trip_calendar
+    if trip_calendar is None:
+        trip_calendar = TripCalendar(load_holidays(HOLIDAYS_FILE, HOLIDAY_REGIONS))
+    return trip_calendar
+
+def get_weekends(month: int, year: int, shape=DEFAULT_SHAPE):
+    """Obtiene los viajes de una forma (por defecto viernes-domingo) que salen en un mes.
+    La vuelta puede caer ya en el mes siguiente (viernes 30 → domingo 1).
+    """
     _, last_day = calendar.monthrange(year, month)
-    
-    for day in range(1, last_day + 1):
-        date = datetime(year, month, day)
-        if date.weekday() == 4:  # Viernes
-            sunday = date + timedelta(days=2)
-            # Solo agregar si el domingo está en el mismo mes
-            if sunday.month == month:
-                weekends.append((date, sunday))
-    
-    return weekends
+    return shape.pairs(get_trip_calendar(), datetime(year, month, 1), datetime(year, month, last_day))
 
 def parse_and_filter_flights(data):
-    """Parsea y filtra los vuelos de la respuesta de la API"""
+    """Parsea y filtra los vuelos de la respuesta de la API.
+    Devuelve objetos Itinerary; el Markdown se genera al enviarlos.
+    """
     if not data or "itineraries" not in data:
         return []
     
+    started = time.perf_counter()
     filtered = []
     for itinerary in data.get("itineraries", []):
         try:
-            outbound_seg = itinerary["outbound"]["sectorSegments"][0]["segment"]
-            inbound_seg = itinerary["inbound"]["sectorSegments"][0]["segment"]
-
-            # Parsear fechas
-            outbound_dt = datetime.strptime(outbound_seg["source"]["localTime"][:16], "%Y-%m-%dT%H:%M")
-            inbound_dt = datetime.strptime(inbound_seg["source"]["localTime"][:16], "%Y-%m-%dT%H:%M")
-
-            # Información del vuelo
-            origin = outbound_seg["source"]["station"]["name"]
-            destination = outbound_seg["destination"]["station"]["name"]
-            price = f"{float(itinerary['price']['amount']):.2f}"
+            filtered.append(Itinerary.from_api(itinerary))
             
-            # Aerolíneas
-            outbound_carrier = outbound_seg["carrier"]["name"]
-            inbound_carrier = inbound_seg["carrier"]["name"]
-
-            # Link de booking
-            booking = itinerary.get("bookingOptions", {}).get("edges", [])
-            link = "https://www.kiwi.com" + booking[0]["node"]["bookingUrl"] if booking else "https://www.kiwi.com"
-
-            message = (
-                f"✈️ *{origin} → {destination}*\n"
-                f"🛫 Ida: `{outbound_dt.strftime('%d/%m %H:%M')}` ({outbound_carrier})\n"
-                f"🛬 Vuelta: `{inbound_dt.strftime('%d/%m %H:%M')}` ({inbound_carrier})\n"
-                f"💰 Precio: *{price} €*\n"
-                f"[🔗 Reservar]({link})"
-            )
-            filtered.append(message)
-            
-        except (KeyError, ValueError, IndexError) as e:
+        except (KeyError, ValueError, IndexError, TypeError) as e:
             logging.warning(f"Error procesando itinerario: {e}")
             continue
     
+    PARSE_SECONDS.observe(time.perf_counter() - started)
+    PARSED_ITINERARIES.observe(len(filtered))
     return filtered
 
+def record_fares(params, itineraries):
+    """Guarda en el histórico los itinerarios ya parseados de una respuesta recién llegada de la API"""
+    if fare_history is None:
+        return
+    # Si la respuesta no trae el país del destino, solo se sabe cuando se buscó uno solo
+    searched = params.get("destination", "").split(",")
+    country = searched[0].split(":")[1] if len(searched) == 1 and searched[0].startswith("Country:") else ""
+    fare_history.record(itineraries, country=country)
+
+async def fetch_flights(params, cache_ttl=None, refresh=False):
+    """Consulta /round-trip, parsea la respuesta una sola vez y, si es nueva, la añade al histórico"""
+    data, fresh = await kiwi_client.round_trip_fresh(params, cache_ttl, refresh)
+    with tracer.span("parse", fresh=fresh) as span:
+        flights = parse_and_filter_flights(data)
+        span.set(itineraries=len(flights))
+    if fresh:
+        record_fares(params, flights)
+    return data, flights
+
+def weekend_window(outbound_date, inbound_date, shape=DEFAULT_SHAPE):
+    """Ventana de búsqueda de un viaje: por defecto viernes 17:00-23:59 → domingo 11:00-23:59"""
+    return shape.window(outbound_date, inbound_date)
+
+def planned_call_params(destinations, call, source=DEFAULT_SOURCE, limit=None):
+    """Parámetros de /round-trip para una llamada planificada"""
+    return build_round_trip_params(
+        destinations, call.outbound_start, call.outbound_end, call.inbound_start, call.inbound_end,
+        source=source, limit=limit or call.limit
+    )
+
+def planned_shard_params(destinations, call, source=DEFAULT_SOURCE, scale=True):
+    """Shards de destinos de una llamada planificada y los parámetros de /round-trip de cada uno.
+
+    Con `scale` el `limit` de la llamada se escala al cupo por ventana del
+    shard, de modo que un shard de destinos con pocos vuelos no pide (ni
+    descarga) de más.
+    """
+    return [
+        (shard, planned_call_params(
+            shard, call, source,
+            max(1, call.limit * destination_sharder.window_limit(shard) // SEARCH_LIMIT) if scale else None
+        ))
+        for shard in destination_sharder.plan(destinations)
+    ]
+
+async def fetch_planned_call(destinations, call, semaphore, source, window_limit=None):
+    """Ejecuta una llamada planificada (una consulta por shard, a la vez) y reparte los itinerarios por ventana.
+
+    Con `window_limit` (el del planificador de /matrix) cada ventana se queda
+    con ese número de itinerarios y el `limit` no se escala por shard; si no,
+    con el cupo de cada shard. Devuelve, para cada ventana, la lista de
+    (shard, itinerarios de la ventana, llamada llena): si la llamada devolvió
+    tantos itinerarios como su `limit`, una ventana con menos de su cupo puede
+    haberse quedado sin los suyos.
+    """
+    async def fetch_shard(shard, params):
+        with tracer.span("kiwi_call", windows=len(call.windows), limit=params["limit"], destinations=len(shard)):
+            async with semaphore:
+                data, flights = await fetch_flights(params)
+            saturated = len((data or {}).get("itineraries") or []) >= int(params["limit"])
+            limit = window_limit or destination_sharder.window_limit(shard)
+            return shard, call.split(flights, limit), saturated
+
+    results = await asyncio.gather(*(
+        fetch_shard(shard, params)
+        for shard, params in planned_shard_params(destinations, call, source, scale=window_limit is None)
+    ))
+    return {window: [(shard, split[window], saturated) for shard, split, saturated in results] for window in call.windows}
+
+async def fetch_window_flights(call_task, window):
+    """Espera la llamada que cubre la ventana y fusiona por precio los vuelos de cada shard.
+    Solo estas búsquedas (las de /find) alimentan el rendimiento de los destinos; /matrix no.
+    """
+    results = await call_task
+    with tracer.span("merge", outbound=window.outbound_start.date()) as span:
+        shard_results = []
+        for shard, window_flights, saturated in results[window]:
+            flights = sorted(window_flights, key=lambda it: it.price)
+            if SEARCH_SHARDS > 1:
+                destination_sharder.observe(shard, flights, saturated)
+            shard_results.append((shard, flights))
+        flights = merge_shard_results(shard_results, SEARCH_LIMIT, DESTINATION_CAP)
+        span.set(itineraries=len(flights), shards=len(shard_results))
+    return flights
+
+async def fetch_matrix_cell(call_task, window, window_limit):
+    """Vuelo más barato de una ventana de /matrix: el itinerario, False si no hay vuelos
+    o MATRIX_UNKNOWN si algún shard llenó su llamada sin llegar a cubrirla.
+    """
+    results = await call_task
+    flights = []
+    complete = True
+    for _, window_flights, saturated in results[window]:
+        if saturated and len(window_flights) < window_limit:
+            complete = False
+        flights.extend(window_flights)
+    if flights:
+        return min(flights, key=lambda it: it.price)
+    return False if complete else MATRIX_UNKNOWN
+
+def plan_weekend_calls(weekends, shape=DEFAULT_SHAPE):
+    """Ventanas de los viajes y las llamadas que las cubren.
+
+    /find y la precarga planifican igual (todos los viajes del mes, también
+    los que ya han salido), porque al unir ventanas las llamadas y sus claves
+    de caché dependen de la lista completa.
+    """
+    windows = [weekend_window(outbound_date, inbound_date, shape) for outbound_date, inbound_date in weekends]
+    return windows, query_planner.plan(windows)
+
+def launch_planned_calls(destinations, calls, source=DEFAULT_SOURCE, window_limit=None):
+    """Lanza a la vez las llamadas planificadas: ventana -> tarea de su llamada"""
+    semaphore = asyncio.Semaphore(SEARCH_CONCURRENCY)
+    call_tasks = {}
+    for call in calls:
+        call_task = asyncio.create_task(fetch_planned_call(destinations, call, semaphore, source, window_limit))
+        for window in call.windows:
+            call_tasks[window] = call_task
+    return call_tasks
+
+def launch_weekend_searches(destinations, weekends, source=DEFAULT_SOURCE, shape=DEFAULT_SHAPE):
+    """Planifica el mínimo de llamadas para los fines de semana y las lanza a la vez.
+
+    Devuelve una tarea por fin de semana (en el mismo orden) y la lista de todas
+    las tareas creadas, para poder cancelarlas si la búsqueda se interrumpe.
+    """
+    windows, calls = plan_weekend_calls(weekends, shape)
+    call_tasks = launch_planned_calls(destinations, calls, source)
+    tasks = [asyncio.create_task(fetch_window_flights(call_tasks[window], window)) for window in windows]
+    return tasks, tasks + list(set(call_tasks.values()))
+
+def launch_matrix_searches(destinations, pairs, source, shape):
+    """Como `launch_weekend_searches`, pero con el planificador de /matrix: una tarea por celda"""
+    windows = [shape.window(outbound_date, inbound_date) for outbound_date, inbound_date in pairs]
+    window_limit = matrix_planner.window_limit
+    call_tasks = launch_planned_calls(destinations, matrix_planner.plan(windows), source, window_limit)
+    tasks = [asyncio.create_task(fetch_matrix_cell(call_tasks[window], window, window_limit)) for window in windows]
+    return tasks, tasks + list(set(call_tasks.values()))
+
+@instrument_handler
 @require_authentication
 async def find(update: Update, context: ContextTypes.DEFAULT_TYPE, from_callback=False):
     """Comando principal para buscar vuelos"""
     send_to = update.callback_query.message if from_callback else update.message
 
     if not context.args:
-        await send_to.reply_text("📅 Usa el comando así: `/find agosto` [opcional: año]", parse_mode="Markdown")
+        await send_to.reply_text(
+            "📅 Usa el comando así: `/find agosto` [opcional: año] [opcional: forma]\n\n"
+            f"**Formas:** {', '.join(SHAPES)} (por defecto {DEFAULT_SHAPE.name})",
+            parse_mode="Markdown"
+        )
         return
 
     month_name = context.args[0].lower()
@@ -278,24 +623,36 @@ async def find(update: Update, context: ContextTypes.DEFAULT_TYPE, from_callback
         await send_to.reply_text(f"❌ Mes no reconocido.\n\n**Meses válidos:** {valid_months}", parse_mode="Markdown")
         return
 
+    # Forma del viaje: el argumento que no es el año
+    shape = DEFAULT_SHAPE
+    shape_args = [arg for arg in context.args[1:] if not arg.isdigit()]
+    if shape_args:
+        shape = parse_shape(shape_args[0])
+        if shape is None or shape.daily:
+            await send_to.reply_text(
+                f"❌ Forma de viaje no reconocida.\n\n**Formas válidas:** {', '.join(SHAPES)}\n"
+                "💡 Para viajes de N noches cualquier día usa `/matrix agosto 3n`.",
+                parse_mode="Markdown"
+            )
+            return
+
     # Determinar año
-    now = datetime.now()
     month = MONTHS[month_name]
-    
-    if len(context.args) > 1 and context.args[1].isdigit():
-        year = int(context.args[1])
-    else:
-        # Si el mes ya pasó este año, usar el próximo año
-        year = now.year + 1 if month < now.month else now.year
+    year = resolve_year(month, context.args)
 
-    weekends = get_weekends(month, year)
+    weekends = get_weekends(month, year, shape)
     
     if not weekends:
-        await send_to.reply_text(f"❌ No hay fines de semana completos en {month_name.title()} {year}")
+        await send_to.reply_text(f"❌ No hay viajes de {shape.description} en {month_name.title()} {year}")
         return
 
+    # Historial para priorizar la precarga de la caché
+    if search_history is not None:
+        search_history.record(month, year)
+
     # Verificar destinos activos
-    destinations = get_selected_destinations()
+    destinations = get_selected_destinations(update.effective_user.id)
+    source = get_search_source(update.effective_user.id)
     if not destinations:
         await send_to.reply_text(
             "⚠️ No hay destinos activos. Usa `/destinations` para configurarlos.\n\n"
@@ -310,105 +667,521 @@ async def find(update: Update, context: ContextTypes.DEFAULT_TYPE, from_callback
     if len(active_countries) > 3:
         countries_text += f" y {len(active_countries) - 3} más"
 
-    await send_to.reply_text(
-        f"🔍 Buscando vuelos desde *viernes a domingo* para *{month_name.title()} {year}* por menos de 150€...\n"
-        f"📊 {len(weekends)} fines de semana encontrados\n"
-        f"🎯 Destinos: {countries_text}", 
-        parse_mode="Markdown"
+    search_header = (
+        f"🔍 Buscando vuelos de *{shape.description}* para *{month_name.title()} {year}* por menos de 150€...\n"
+        f"📊 {trips_label(len(weekends), shape)}\n"
+        f"🛫 Origen: {get_source_name(source)}\n"
+        f"🎯 Destinos: {countries_text}"
+    )
+    # Cabecera del resumen final, que sustituye al mensaje de progreso
+    month_title = f"{month_name.title()} {year}"
+    results_header = (
+        f"✈️ *{month_title}* · de {shape.description} por menos de 150€\n"
+        f"🛫 Origen: {get_source_name(source)}\n🎯 Destinos: {countries_text}"
     )
 
-    total_found = 0
-    
-    for i, (outbound_date, inbound_date) in enumerate(weekends, 1):
+    # La búsqueda más reciente de cada chat gana: cancelar la anterior sin terminar
+    chat_id = send_to.chat_id
+    previous = ACTIVE_SEARCHES.get(chat_id)
+    if previous is not None and not previous.done():
+        logging.info(f"Cancelando búsqueda anterior del chat {chat_id}")
+        previous.cancel()
+
+    token = shared_state.claim_search(chat_id)
+    search = asyncio.create_task(
+        run_search(send_to, chat_id, search_header, results_header, month_title, weekends, destinations, source, shape)
+    )
+    ACTIVE_SEARCHES[chat_id] = search
+    superseded = False
+    try:
+        # Una búsqueda más reciente puede haber llegado a otro worker
+        while not search.done():
+            try:
+                await asyncio.wait({search}, timeout=ACTIVE_SEARCH_POLL)
+            except asyncio.CancelledError:
+                search.cancel()
+                raise
+            if not search.done() and not shared_state.is_current_search(chat_id, token):
+                logging.info(f"Cancelando búsqueda del chat {chat_id}: hay otra más reciente en otro worker")
+                superseded = True
+                search.cancel()
+        await search
+    except asyncio.CancelledError:
+        if search.cancelled() and (superseded or ACTIVE_SEARCHES.get(chat_id) is not search):
+            return
+        raise
+    finally:
+        if ACTIVE_SEARCHES.get(chat_id) is search:
+            del ACTIVE_SEARCHES[chat_id]
+        shared_state.release_search(chat_id, token)
+
+def trips_label(count, shape):
+    """"N fines de semana" para las formas de fin de semana y "N viajes" para puentes o N noches"""
+    if shape.departure_weekdays:
+        return f"{count} {'fin de semana' if count == 1 else 'fines de semana'}"
+    return f"{count} {'viaje' if count == 1 else 'viajes'}"
+
+def summary_line(weekend):
+    """Línea del resumen de un fin de semana: el vuelo más barato y cuántos hay"""
+    dates = f"{weekend.outbound_date.strftime('%d/%m')} - {weekend.inbound_date.strftime('%d/%m')}"
+    if weekend.error:
+        return f"🗓️ {dates}: ⚠️ error al buscar"
+    cheapest = weekend.cheapest
+    if cheapest is None:
+        return f"🗓️ {dates}: sin vuelos"
+    count = len(weekend.itineraries)
+    return f"🗓️ {dates}: desde *{cheapest.price:.2f}€* · {cheapest.destination} ({count} {'vuelo' if count == 1 else 'vuelos'})"
+
+def render_results_summary(session_id, results):
+    """Resumen de la búsqueda con el botón para ver el detalle del primer fin de semana con vuelos"""
+    lines = [results.header, ""] + [summary_line(weekend) for weekend in results.weekends]
+    found = [i for i, weekend in enumerate(results.weekends) if weekend.itineraries]
+    if not found:
+        lines.append("\n❌ No se encontraron vuelos válidos para ninguna de las fechas.")
+        return "\n".join(lines), None
+    lines.append(f"\n✅ Vuelos para {len(found)} de {len(results.weekends)} fechas.")
+    markup = InlineKeyboardMarkup([[InlineKeyboardButton("🔎 Ver más", callback_data=f"res:{session_id}:{found[0]}:0")]])
+    return "\n".join(lines), markup
+
+def render_results_page(session_id, results, index, page):
+    """Una página de itinerarios de un fin de semana, con botones para seguir paginando"""
+    weekend = results.weekends[index]
+    pages = max(1, -(-len(weekend.itineraries) // RESULTS_PAGE_SIZE))
+    page = min(page, pages - 1)
+    shown = weekend.itineraries[page * RESULTS_PAGE_SIZE:(page + 1) * RESULTS_PAGE_SIZE]
+
+    header = (
+        f"🗓️ *Fin de semana del {weekend.outbound_date.strftime('%d/%m')} - {weekend.inbound_date.strftime('%d/%m')}* "
+        f"({results.title}) · página {page + 1}/{pages}"
+    )
+    text = "\n\n".join([header] + [itinerary.to_markdown() for itinerary in shown])
+
+    buttons = []
+    if page > 0:
+        buttons.append([InlineKeyboardButton("⬅️ Anteriores", callback_data=f"res:{session_id}:{index}:{page - 1}")])
+    if page + 1 < pages:
+        buttons.append([InlineKeyboardButton("🔎 Ver más", callback_data=f"res:{session_id}:{index}:{page + 1}")])
+    following = next((i for i in range(index + 1, len(results.weekends)) if results.weekends[i].itineraries), None)
+    if following is not None:
+        buttons.append([InlineKeyboardButton("➡️ Siguiente fin de semana", callback_data=f"res:{session_id}:{following}:0")])
+    buttons.append([InlineKeyboardButton("📋 Resumen", callback_data=f"res:{session_id}:s")])
+    return text, InlineKeyboardMarkup(buttons)
+
+async def run_search(send_to, chat_id, search_header, results_header, month_title, weekends, destinations, source,
+                     shape=DEFAULT_SHAPE):
+    """Ejecuta una búsqueda ya validada y resume los resultados en un único mensaje paginable"""
+    # Un único mensaje que muestra el progreso y acaba convertido en el resumen
+    status = StatusMessage(outbox, chat_id, min_interval=STATUS_EDIT_INTERVAL)
+    await status.start(send_to, f"{search_header}\n⏳ Procesados 0 de {trips_label(len(weekends), shape)}", parse_mode="Markdown")
+
+    # Planificar y lanzar las consultas; los resultados se recogen en orden de fin de semana
+    tasks, all_tasks = launch_weekend_searches(destinations, weekends, source, shape)
+    logging.info(f"Búsqueda {month_title}: {len(all_tasks) - len(tasks)} llamadas para {trips_label(len(weekends), shape)}")
+
+    collected = []
+    try:
+        for i, ((outbound_date, inbound_date), task) in enumerate(zip(weekends, tasks), 1):
+            try:
+                with tracer.span("wait_results", weekend=outbound_date.date()):
+                    flights = await task
+                collected.append(WeekendResults(outbound_date, inbound_date, flights))
+
+            except KiwiAPIError as e:
+                logging.error(f"Error de API para {outbound_date.date()}–{inbound_date.date()}: {e}")
+                collected.append(WeekendResults(outbound_date, inbound_date, error=True))
+
+            except Exception as e:
+                logging.error(f"Error inesperado para {outbound_date.date()}–{inbound_date.date()}: {e}")
+                collected.append(WeekendResults(outbound_date, inbound_date, error=True))
+
+            # Progreso con el resumen parcial (las ediciones demasiado seguidas se omiten)
+            if i < len(weekends):
+                progress = "\n".join(summary_line(weekend) for weekend in collected)
+                await status.update(f"{search_header}\n⏳ Procesados {i} de {trips_label(len(weekends), shape)}\n\n{progress}")
+    except asyncio.CancelledError:
+        # Sustituida por otra búsqueda del mismo chat (o apagado del bot)
         try:
-            # Horarios de búsqueda
-            outbound_start = outbound_date.replace(hour=17)
-            outbound_end = outbound_date.replace(hour=23, minute=59)
-            inbound_start = inbound_date.replace(hour=11)
-            inbound_end = inbound_date.replace(hour=23, minute=59)
-
-            params = {
-                "source": "Airport:ALC,Airport:RMU",
-                "destination": ",".join(destinations),
-                "currency": "eur",
-                "locale": "es",
-                "adults": "1",
-                "children": "0",
-                "infants": "0",
-                "handbags": "1",
-                "holdbags": "0",
-                "cabinClass": "ECONOMY",
-                "applyMixedClasses": "false",
-                "enableThrowAwayTicketing": "false",
-                "allowReturnFromDifferentCity": "false",
-                "allowChangeInboundDestination": "false",
-                "allowChangeInboundSource": "false",
-                "allowOvernightStopover": "false",
-                "enableTrueHiddenCity": "false",
-                "enableSelfTransfer": "true",
-                "allowDifferentStationConnection": "true",
-                "sortBy": "PRICE",
-                "sortOrder": "ASCENDING",
-                "outboundDepartureDateStart": outbound_start.strftime("%Y-%m-%dT%H:%M:%S"),
-                "outboundDepartureDateEnd": outbound_end.strftime("%Y-%m-%dT%H:%M:%S"),
-                "inboundDepartureDateStart": inbound_start.strftime("%Y-%m-%dT%H:%M:%S"),
-                "inboundDepartureDateEnd": inbound_end.strftime("%Y-%m-%dT%H:%M:%S"),
-                "transportTypes": "FLIGHT",
-                "limit": "5",
-                "priceStart": "0",
-                "priceEnd":"150"
-            }
-
-            headers = {
-                "X-RapidAPI-Key": RAPIDAPI_KEY,
-                "X-RapidAPI-Host": "kiwi-com-cheap-flights.p.rapidapi.com"
-            }
-
-            # Enviar mensaje de progreso
-            progress_msg = f"⏳ Procesando fin de semana {i}/{len(weekends)} ({outbound_date.strftime('%d/%m')} - {inbound_date.strftime('%d/%m')})..."
-            if from_callback:
-                await send_to.reply_text(progress_msg)
-            else:
-                await update.message.reply_text(progress_msg)
+            await status.update(f"{search_header}\n🚫 Búsqueda cancelada", force=True)
+        except Exception:
+            pass
+        raise
+    finally:
+        # Si la búsqueda se interrumpe, no dejar consultas ni envíos huérfanos
+        for task in all_tasks:
+            task.cancel()
 
-            response = requests.get(
-                "https://kiwi-com-cheap-flights.p.rapidapi.com/round-trip", 
-                headers=headers, 
-                params=params,
-                timeout=30
-            )
-            response.raise_for_status()
-            
-            flights = parse_and_filter_flights(response.json())
-
-            if flights:
-                weekend_header = f"🗓️ *Fin de semana del {outbound_date.strftime('%d/%m')} - {inbound_date.strftime('%d/%m')}*:"
-                await send_to.reply_text(weekend_header, parse_mode="Markdown")
-                
-                for msg in flights:
-                    await send_to.reply_markdown(msg)
-                    
-                total_found += 1
-
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Error de API para {outbound_date.date()}–{inbound_date.date()}: {e}")
-            await send_to.reply_text(f"⚠️ Error buscando vuelos para {outbound_date.strftime('%d/%m')} - {inbound_date.strftime('%d/%m')}")
-            
-        except Exception as e:
-            logging.error(f"Error inesperado para {outbound_date.date()}–{inbound_date.date()}: {e}")
+    # Resumen final; el detalle se pagina desde la sesión sin nuevas llamadas a la API
+    with tracer.span("format", weekends=len(collected)):
+        results = SearchResults(month_title, results_header, collected)
+        session_id = result_sessions.create(results) if any(w.itineraries for w in collected) else None
+        text, markup = render_results_summary(session_id, results)
+    await status.update(text, force=True, reply_markup=markup)
+
+@instrument_handler
+async def handle_results(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Pagina los resultados guardados de una búsqueda editando el mismo mensaje"""
+    query = update.callback_query
+    _, session_id, *position = query.data.split(":")
+    results = result_sessions.get(session_id)
+    # Un botón de una versión anterior o con datos manipulados se trata como caducado
+    valid = position == ["s"] or (
+        len(position) == 2 and all(part.isdigit() for part in position)
+        and results is not None and int(position[0]) < len(results.weekends)
+    )
+    if results is None or not valid:
+        await query.answer("⌛ Estos resultados han caducado. Repite la búsqueda con /find.", show_alert=True)
+        return
+    await query.answer()
 
-    # Mensaje final
-    if total_found == 0:
-        await send_to.reply_text("❌ No se encontraron vuelos válidos para ningún fin de semana.")
+    if position == ["s"]:
+        text, markup = render_results_summary(session_id, results)
     else:
-        await send_to.reply_text(f"✅ Búsqueda completada. Se encontraron vuelos para {total_found}/{len(weekends)} fines de semana.")
+        text, markup = render_results_page(session_id, results, int(position[0]), int(position[1]))
+    try:
+        await outbox.send(
+            query.message.chat_id, query.edit_message_text, text,
+            parse_mode="Markdown", reply_markup=markup, link_preview_options=NO_LINK_PREVIEW
+        )
+    except BadRequest as e:
+        # Pulsaciones repetidas sobre la misma página: "Message is not modified"
+        logging.warning(f"No se pudo mostrar la página de resultados: {e}")
+
+def parse_day(text, default_year):
+    """Fecha "dd/mm" o "dd/mm/aaaa"; sin año, la próxima vez que llegue ese día"""
+    parts = text.split("/")
+    if len(parts) not in (2, 3) or not all(part.isdigit() for part in parts):
+        return None
+    try:
+        if len(parts) == 3:
+            return datetime(int(parts[2]), int(parts[1]), int(parts[0]))
+        day = datetime(default_year, int(parts[1]), int(parts[0]))
+    except ValueError:
+        return None
+    return day if day.date() >= datetime.now().date() else day.replace(year=day.year + 1)
+
+def parse_date_range(args):
+    """Rango de /matrix: "noviembre", "noviembre 2026", "noviembre-diciembre" o "06/11-20/11[/aaaa]".
+    Devuelve (primer día, último día, título) o None si no se reconoce.
+    """
+    first, _, last = args[0].lower().partition("-")
+    if first in MONTHS:
+        last = last or first
+        if last not in MONTHS:
+            return None
+        year = resolve_year(MONTHS[first], args)
+        end_year = year + 1 if MONTHS[last] < MONTHS[first] else year
+        _, last_day = calendar.monthrange(end_year, MONTHS[last])
+        title = f"{first.title()} {year}" if first == last else f"{first.title()} - {last.title()} {end_year}"
+        return datetime(year, MONTHS[first], 1), datetime(end_year, MONTHS[last], last_day), title
 
+    end = parse_day(last, datetime.now().year) if last else None
+    start = parse_day(first, end.year if end else datetime.now().year)
+    if start is None or end is None:
+        return None
+    if start > end:
+        start = start.replace(year=start.year - 1)
+    return start, end, f"{start.strftime('%d/%m/%Y')} - {end.strftime('%d/%m/%Y')}"
+
+def render_matrix(title, header, cells):
+    """Tabla de precios mínimos: una fila por salida y una columna por noches.
+    `cells` va de (salida, noches) al itinerario más barato, False si no hay vuelos,
+    MATRIX_UNKNOWN si la llamada se llenó antes de llegar a esa celda o None si falló.
+    """
+    departures = sorted({outbound for outbound, _ in cells})
+    nights = sorted({n for _, n in cells})
+    lines = ["Salida    " + "".join(f"{n:>4}n" for n in nights)]
+    for outbound in departures:
+        mark = "*" if get_trip_calendar().holiday_name(outbound) else " "
+        row = f"{WEEKDAY_SHORT[outbound.weekday()]} {outbound.strftime('%d/%m')}{mark} "
+        for n in nights:
+            if (outbound, n) not in cells:
+                row += "     "
+                continue
+            cell = cells[(outbound, n)]
+            if cell is None:
+                row += "    ×"
+            elif cell is MATRIX_UNKNOWN:
+                row += "    ?"
+            else:
+                row += f"{cell.price:>5.0f}" if cell else "    ·"
+        lines.append(row)
+    lines.append("· sin vuelos por menos de 150€  ? sin datos  × error  * festivo")
+
+    text = f"{header}\n\n```\n" + "\n".join(lines) + "\n```"
+    found = [(it, outbound, n) for (outbound, n), it in cells.items() if it and it is not MATRIX_UNKNOWN]
+    if found:
+        cheapest, outbound, n = min(found, key=lambda item: item[0].price)
+        inbound = outbound + timedelta(days=n)
+        text += (
+            f"\n\n💰 Más barato: *{cheapest.price:.2f}€* · {cheapest.destination} · "
+            f"{WEEKDAY_SHORT[outbound.weekday()]} {outbound.strftime('%d/%m')} → "
+            f"{WEEKDAY_SHORT[inbound.weekday()]} {inbound.strftime('%d/%m')}"
+        )
+    else:
+        text += f"\n\n❌ No se encontraron vuelos válidos para {title}."
+    return text
+
+@instrument_handler
 @require_authentication
-async def destinations(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Comando para configurar destinos"""
-    # Validar configuración antes de mostrar
-    config = validate_destinations_config()
-    
+async def matrix(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Matriz de precios mínimos (salida × noches) de un rango de fechas en un único mensaje"""
+    usage = (
+        "📊 Usa el comando así: `/matrix noviembre` [opcional: año] [opcional: forma]\n\n"
+        "**Rangos:** `noviembre`, `noviembre-diciembre`, `06/11-20/11`\n"
+        f"**Formas:** {', '.join(SHAPES)} o noches (`3n`, `2-4n`; por defecto {MATRIX_NIGHTS})"
+    )
+    date_range = parse_date_range(context.args) if context.args else None
+    if date_range is None:
+        await update.effective_message.reply_text(usage, parse_mode="Markdown")
+        return
+    start, end, title = date_range
+
+    shape_args = [arg for arg in context.args[1:] if not arg.isdigit()]
+    shape = parse_shape(shape_args[0] if shape_args else f"{MATRIX_NIGHTS}n")
+    if shape is None or len(shape.nights) > MATRIX_MAX_NIGHTS:
+        await update.effective_message.reply_text(
+            f"❌ Forma de viaje no reconocida (como mucho {MATRIX_MAX_NIGHTS} columnas de noches).\n\n{usage}",
+            parse_mode="Markdown"
+        )
+        return
+
+    # Solo salidas desde hoy y como mucho MATRIX_MAX_DAYS días
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    start = max(start, today)
+    end = min(end, start + timedelta(days=MATRIX_MAX_DAYS - 1))
+    pairs = shape.pairs(get_trip_calendar(), start, end)
+    if not pairs:
+        await update.effective_message.reply_text(f"❌ No hay viajes de {shape.description} en {title}")
+        return
+
+    user_id = update.effective_user.id
+    destinations = get_selected_destinations(user_id)
+    if not destinations:
+        await update.effective_message.reply_text(
+            "⚠️ No hay destinos activos. Usa `/destinations` para configurarlos.", parse_mode="Markdown"
+        )
+        return
+    source = get_search_source(user_id)
+    header = (
+        f"📊 *{title}* · {shape.description} · más barato por salida y noches\n"
+        f"🛫 Origen: {get_source_name(source)}\n🎯 Destinos: {len(destinations)} activos"
+    )
+
+    chat_id = update.effective_chat.id
+    status = StatusMessage(outbox, chat_id, min_interval=STATUS_EDIT_INTERVAL)
+    await status.start(update.effective_message, f"{header}\n⏳ Buscando {len(pairs)} combinaciones...", parse_mode="Markdown")
+
+    # Todas las combinaciones en el mínimo de llamadas; cada celda se queda con el vuelo más barato
+    tasks, all_tasks = launch_matrix_searches(destinations, pairs, source, shape)
+    logging.info(f"Matriz {title}: {len(all_tasks) - len(tasks)} llamadas para {len(pairs)} combinaciones")
+    try:
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        for task in all_tasks:
+            task.cancel()
+
+    cells = {}
+    for (outbound, inbound), result in zip(pairs, results):
+        if isinstance(result, BaseException):
+            logging.error(f"Matriz {title}: error para {outbound.date()}–{inbound.date()}: {result}")
+            cells[(outbound, (inbound - outbound).days)] = None
+        else:
+            cells[(outbound, (inbound - outbound).days)] = result
+    with tracer.span("format", cells=len(cells)):
+        text = render_matrix(title, header, cells)
+    await status.update(text, force=True)
+
+@instrument_handler
+@require_authentication
+async def watch(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Suscribe el chat a la vigilancia de precios de un mes (sin argumentos, lista las suscripciones)"""
+    chat_id = update.effective_chat.id
+
+    if not context.args:
+        watched = watch_store.for_chat(chat_id)
+        if not watched:
+            await update.effective_message.reply_text("👀 Usa el comando así: `/watch agosto` [opcional: año]", parse_mode="Markdown")
+            return
+        months_text = "\n".join(f"• {MONTH_NAMES[month].title()} {year}" for month, year in watched)
+        await update.effective_message.reply_text(f"👀 **Meses vigilados:**\n{months_text}", parse_mode="Markdown")
+        return
+
+    month_name = context.args[0].lower()
+    if month_name not in MONTHS:
+        valid_months = ", ".join(MONTHS.keys())
+        await update.effective_message.reply_text(f"❌ Mes no reconocido.\n\n**Meses válidos:** {valid_months}", parse_mode="Markdown")
+        return
+
+    month = MONTHS[month_name]
+    year = resolve_year(month, context.args)
+    if not watch_store.add(chat_id, month, year, update.effective_user.id):
+        await update.effective_message.reply_text(f"ℹ️ Ya estás vigilando {month_name.title()} {year}.")
+        return
+
+    await update.effective_message.reply_text(
+        f"👀 Vigilando *{month_name.title()} {year}*.\n"
+        f"Te avisaré de vuelos nuevos o bajadas de precio de al menos un {WATCH_DROP_PERCENT:.0f}% "
+        f"(revisión cada {WATCH_INTERVAL // 3600} h).\n\n"
+        f"💡 Usa `/unwatch {month_name}` para dejar de vigilarlo.",
+        parse_mode="Markdown"
+    )
+
+@instrument_handler
+@require_authentication
+async def unwatch(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Cancela la vigilancia de precios de un mes"""
+    if not context.args or context.args[0].lower() not in MONTHS:
+        await update.effective_message.reply_text("🔕 Usa el comando así: `/unwatch agosto` [opcional: año]", parse_mode="Markdown")
+        return
+
+    month_name = context.args[0].lower()
+    month = MONTHS[month_name]
+    year = resolve_year(month, context.args)
+    if watch_store.remove(update.effective_chat.id, month, year):
+        await update.effective_message.reply_text(f"🔕 Has dejado de vigilar {month_name.title()} {year}.")
+    else:
+        await update.effective_message.reply_text(f"ℹ️ No estabas vigilando {month_name.title()} {year}.")
+
+async def watch_cycle(context: ContextTypes.DEFAULT_TYPE):
+    """Programa la revisión de cada mes vigilado, repartidas a lo largo del intervalo"""
+    # Con varios workers solo uno revisa; si cae, otro toma el turno al caducar
+    if not shared_state.acquire_lease("watch_cycle", WATCH_INTERVAL * 1.5):
+        return
+    groups = watch_store.grouped()
+    if not groups:
+        return
+
+    # Una revisión por mes, no por suscriptor; espaciadas para no concentrar llamadas
+    spacing = WATCH_INTERVAL / len(groups) / 2
+    for i, (month, year) in enumerate(groups):
+        context.job_queue.run_once(check_watched_month, when=i * spacing, data=(month, year), name=f"watch_{year}_{month}")
+    logging.info(f"Vigilancia: {len(groups)} meses programados para {sum(len(v) for v in groups.values())} suscripciones")
+
+async def check_watched_month(context: ContextTypes.DEFAULT_TYPE):
+    """Repite la búsqueda de un mes una vez por selección de destinos y avisa a cada suscriptor de las novedades"""
+    month, year = context.job.data
+    subscribers = watch_store.grouped().get((month, year))
+    if not subscribers:
+        return
+    month_title = f"{MONTH_NAMES[month].title()} {year}"
+
+    # Solo fines de semana que aún no han pasado
+    today = datetime.now().date()
+    weekends = [(o, i) for o, i in get_weekends(month, year) if o.date() >= today]
+    if not weekends:
+        for chat_id, _, _ in subscribers:
+            watch_store.remove(chat_id, month, year)
+            await outbox.send(chat_id, context.bot.send_message, chat_id, f"⌛ {month_title} ya ha pasado: vigilancia finalizada.")
+        return
+
+    # Suscriptores con el mismo origen y los mismos destinos activos comparten la búsqueda
+    by_selection = {}
+    for chat_id, user_id, initialized in subscribers:
+        selection = tuple(sorted(get_selected_destinations(user_id)))
+        if selection:
+            by_selection.setdefault((get_search_source(user_id), selection), []).append((chat_id, initialized))
+
+    for (source, selection), chats in by_selection.items():
+        current = await fetch_watched_itineraries(list(selection), weekends, month_title, source)
+        if current is not None:
+            await notify_watchers(context, chats, month, year, month_title, current)
+
+async def fetch_watched_itineraries(destinations, weekends, month_title, source=DEFAULT_SOURCE):
+    """Itinerarios actuales de todos los fines de semana, o None si alguno ha fallado"""
+    tasks, all_tasks = launch_weekend_searches(destinations, weekends, source)
+    try:
+        current = []
+        for (outbound_date, inbound_date), task in zip(weekends, tasks):
+            try:
+                current.extend(await task)
+            except Exception as e:
+                # Sin la foto completa, los vuelos que faltan parecerían nuevos en el próximo ciclo
+                logging.error(f"Vigilancia {month_title}: error para {outbound_date.date()}–{inbound_date.date()}: {e}")
+                return None
+        return current
+    finally:
+        # Al primer error (o si se cancela la revisión) no seguir gastando llamadas
+        for task in all_tasks:
+            task.cancel()
+
+async def notify_watchers(context, chats, month, year, month_title, current):
+    """Compara con lo ya visto (hasta WATCH_SEEN_TTL atrás) y avisa a cada chat de las novedades"""
+    for chat_id, initialized in chats:
+        if not initialized:
+            # Primera revisión: solo se toma la foto de partida
+            watch_store.merge_seen(chat_id, month, year, current, WATCH_SEEN_TTL)
+            continue
+
+        new, drops = diff_itineraries(watch_store.seen(chat_id, month, year), current, WATCH_DROP_PERCENT)
+        watch_store.merge_seen(chat_id, month, year, current, WATCH_SEEN_TTL)
+        if not new and not drops:
+            continue
+
+        blocks = [f"🔔 *Novedades para {month_title}*:"]
+        blocks += [f"🆕 *Nuevo*\n{itinerary.to_markdown()}" for itinerary in new]
+        blocks += [
+            f"📉 *Bajada de precio* (antes {old_price:.2f} €)\n{itinerary.to_markdown()}"
+            for itinerary, old_price in drops
+        ]
+        for text in pack_messages(blocks):
+            await outbox.send(
+                chat_id, context.bot.send_message, chat_id, text,
+                parse_mode="Markdown", link_preview_options=NO_LINK_PREVIEW
+            )
+
+async def prewarm_cache(context: ContextTypes.DEFAULT_TYPE):
+    """Precarga en horas valle la caché de los meses más buscados y de los próximos meses"""
+    now = datetime.now()
+    if response_cache is None or now.hour not in PREWARM_HOURS:
+        return
+    if not shared_state.acquire_lease("prewarm_cache", PREWARM_INTERVAL * 1.5):
+        return
+
+    budget = api_budget.stats()
+    allowance = prewarm_budget.allowance(budget['limit'], budget['remaining'])
+    if allowance <= 0:
+        logging.info("Precarga: sin presupuesto disponible hoy")
+        return
+
+    selections = [
+        (source or DEFAULT_SOURCE, list(selection))
+        for (source, selection), _ in preferences_store.selection_counts().most_common(PREWARM_SELECTIONS)
+    ]
+    if not selections:
+        return
+
+    watched = list(watch_store.grouped()) if watch_store is not None else []
+    months = prioritize_months(now, PREWARM_MONTHS, search_history.popularity(), watched)
+
+    fetched = 0
+    for month, year in months:
+        # Las mismas llamadas que haría /find, para que las claves de caché coincidan;
+        # solo se omiten las que ya no cubren ningún viaje por salir
+        _, calls = plan_weekend_calls(get_weekends(month, year))
+        calls = [call for call in calls if call.outbound_end.date() >= now.date()]
+        if not calls:
+            continue
+        for source, destinations in selections:
+            for call in calls:
+                for _, params in planned_shard_params(destinations, call, source):
+                    if response_cache.remaining_ttl(params) > PREWARM_TTL / 2:
+                        continue
+                    if fetched >= allowance:
+                        logging.info(f"Precarga: presupuesto diario agotado tras {fetched} llamadas")
+                        return
+                    try:
+                        await fetch_flights(params, cache_ttl=PREWARM_TTL, refresh=True)
+                    except KiwiAPIError as e:
+                        logging.error(f"Precarga interrumpida en {month}/{year}: {e}")
+                        return
+                    finally:
+                        fetched += 1
+                        prewarm_budget.spend(1)
+
+    logging.info(f"Precarga completada: {fetched} llamadas para {len(months)} meses y {len(selections)} selecciones de destinos")
+
+def build_destinations_menu(config):
+    """Texto y teclado de /destinations para una configuración de destinos"""
     # Ordenar: activos primero, luego por nombre
     sorted_items = sorted(
         config.items(), 
@@ -462,6 +1235,20 @@ async def destinations(update: Update, context: ContextTypes.DEFAULT_TYPE):
             status_text += f"🎯 Activos: {', '.join(active_names[:3])} y {active_count - 3} más\n\n"
     
     status_text += "💡 Toca para activar/desactivar:"
+    return status_text, markup
+
+def render_destinations_menu(user_id):
+    """Texto y teclado de /destinations del usuario, reutilizados mientras no cambie su configuración"""
+    return render_cache.get(
+        ("destinations", user_id), get_destinations_version(user_id),
+        lambda: build_destinations_menu(load_destinations(user_id))
+    )
+
+@instrument_handler
+@require_authentication
+async def destinations(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando para configurar los destinos del usuario"""
+    status_text, markup = render_destinations_menu(update.effective_user.id)
     
     await update.effective_message.reply_text(
         status_text,
@@ -469,65 +1256,159 @@ async def destinations(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode="Markdown"
     )
 
+@instrument_handler
 async def handle_toggle(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Maneja el toggle de destinos y acciones de control"""
+    """Maneja el toggle de destinos y acciones de control, actualizando el menú en el mismo mensaje"""
     query = update.callback_query
-    await query.answer()
-    
-    config = load_destinations()
+    user_id = update.effective_user.id
+    previous_text, _ = render_destinations_menu(user_id)
     
     if query.data.startswith("toggle_"):
         action = query.data.replace("toggle_", "")
         
         if action == "all_on":
             # Activar todos los destinos
-            for key in config:
-                config[key] = True
-            save_destinations(config)
+            with DESTINATIONS_SECONDS.time(operation="save"):
+                preferences_store.set_all(user_id, True)
             await query.answer("✅ Todos los destinos activados", show_alert=True)
             
         elif action == "all_off":
             # Desactivar todos los destinos
-            for key in config:
-                config[key] = False
-            save_destinations(config)
+            with DESTINATIONS_SECONDS.time(operation="save"):
+                preferences_store.set_all(user_id, False)
             await query.answer("❌ Todos los destinos desactivados", show_alert=True)
             
         elif action == "defaults":
             # Restablecer configuración por defecto
-            default_config = get_default_destinations()
-            save_destinations(default_config)
+            with DESTINATIONS_SECONDS.time(operation="save"):
+                preferences_store.reset(user_id)
             await query.answer("🔄 Configuración restablecida", show_alert=True)
             
         else:
-            # Toggle individual
+            # Toggle individual: una sola fila en la base de datos
             key = action
-            if key in config:
-                config[key] = not config[key]
-                save_destinations(config)
+            with DESTINATIONS_SECONDS.time(operation="toggle"):
+                active = preferences_store.toggle(user_id, key)
+            if active is not None:
                 country_name = get_country_name(key)
-                status = "activado" if config[key] else "desactivado"
+                status = "activado" if active else "desactivado"
                 await query.answer(f"{country_name} {status}", show_alert=False)
             else:
                 await query.answer("❌ Destino no encontrado", show_alert=True)
                 return
-        
-        # Actualizar el mensaje con la nueva configuración
-        await destinations(update, context)
     
     elif query.data == "reset_defaults":
         # Restablecer configuración por defecto
-        default_config = get_default_destinations()
-        save_destinations(default_config)
+        with DESTINATIONS_SECONDS.time(operation="save"):
+            preferences_store.reset(user_id)
         await query.answer("🔄 Configuración restablecida a valores por defecto", show_alert=True)
-        await destinations(update, context)
 
+    # Editar el menú en lugar de enviar otro: solo el teclado si el texto no cambia
+    status_text, markup = render_destinations_menu(user_id)
+    chat_id = query.message.chat_id
+    try:
+        if status_text == previous_text:
+            await outbox.send(chat_id, query.edit_message_reply_markup, reply_markup=markup)
+        else:
+            await outbox.send(chat_id, query.edit_message_text, status_text, reply_markup=markup, parse_mode="Markdown")
+    except BadRequest as e:
+        # Sin cambios (p. ej. "Activar Todos" con todo ya activo): "Message is not modified"
+        logging.warning(f"No se pudo actualizar el menú de destinos: {e}")
+
+def apply_place(user_id, target, place):
+    """Añade el lugar a los destinos ("dst") o lo fija como origen ("org"); devuelve el texto de respuesta"""
+    if target == "org":
+        if not preferences_store.set_origin(user_id, place.id):
+            return "❌ No se pudo guardar el origen. Inténtalo de nuevo."
+        return f"🛫 Origen: *{place_label(place)}*\n\n💡 Vuelve al predeterminado con `/origen predeterminado`."
+    if not preferences_store.add(user_id, place.id):
+        return "❌ No se pudo añadir el destino. Inténtalo de nuevo."
+    return f"✅ *{place_label(place)}* añadido a tus destinos activos.\n\n💡 Gestiónalos con `/destinations`."
+
+async def choose_place(update: Update, context: ContextTypes.DEFAULT_TYPE, target):
+    """Resuelve el lugar de /destino u /origen: id exacto, única coincidencia o botones para elegir"""
+    command = "/origen" if target == "org" else "/destino"
+    text = " ".join(context.args).strip()
+    if not text:
+        await update.message.reply_text(
+            f"🔎 Usa el comando así: `{command} bergamo` (aeropuerto, ciudad o país)\n\n"
+            f"💡 También puedes escribir `@{context.bot.username} {'origen ' if target == 'org' else ''}berg` en el chat.",
+            parse_mode="Markdown"
+        )
+        return
+
+    place = places.get(text) if is_place_id(text) else None
+    matches = [place] if place else places.search(text, limit=PLACE_CHOICES)
+    if not matches:
+        await update.message.reply_text(f"❌ No encuentro ningún aeropuerto, ciudad o país que empiece por «{text}».")
+        return
+    if len(matches) == 1:
+        await update.message.reply_text(apply_place(update.effective_user.id, target, matches[0]), parse_mode="Markdown")
+        return
+
+    buttons = [
+        [InlineKeyboardButton(f"{place_label(match)} · {match.detail}", callback_data=f"place_{target}:{match.id}")]
+        for match in matches
+    ]
+    await update.message.reply_text("🤔 ¿Cuál de estos?", reply_markup=InlineKeyboardMarkup(buttons))
+
+@instrument_handler
 @require_authentication
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Comando de inicio con botones de meses en grid"""
-    # Validar configuración al inicio
-    validate_destinations_config()
-    
+async def destino_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Añade cualquier aeropuerto, ciudad o país a los destinos del usuario"""
+    await choose_place(update, context, "dst")
+
+@instrument_handler
+@require_authentication
+async def origen_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Cambia el origen de las búsquedas del usuario (o vuelve al predeterminado)"""
+    if context.args and context.args[0].lower() in ("predeterminado", "defecto"):
+        preferences_store.set_origin(update.effective_user.id, None)
+        await update.message.reply_text(f"🛫 Origen predeterminado: *{get_source_name(DEFAULT_SOURCE)}*", parse_mode="Markdown")
+        return
+    await choose_place(update, context, "org")
+
+@instrument_handler
+@require_authentication
+async def handle_place_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Aplica el lugar elegido entre las opciones de /destino u /origen"""
+    query = update.callback_query
+    target, place_id = query.data[len("place_"):].split(":", 1)
+    place = places.get(place_id)
+    if place is None:
+        await query.answer("❌ Lugar no encontrado", show_alert=True)
+        return
+    await query.answer()
+    await outbox.send(
+        query.message.chat_id, query.edit_message_text,
+        apply_place(update.effective_user.id, target, place), parse_mode="Markdown"
+    )
+
+@instrument_handler
+async def inline_places(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Autocompletado inline: `@bot berg` propone lugares y envía `/destino <id>` (o `/origen` con `@bot origen ...`)"""
+    query = update.inline_query
+    # Sin require_authentication: a una consulta inline no se le puede responder con un mensaje
+    if not shared_state.is_authorized(update.effective_user.id):
+        await query.answer([], cache_time=0, is_personal=True)
+        return
+
+    command, text = "/destino", query.query.strip()
+    words = text.split(maxsplit=1)
+    if words and words[0].lower() == "origen":
+        command, text = "/origen", words[1] if len(words) > 1 else ""
+
+    results = [
+        InlineQueryResultArticle(
+            id=place.id, title=place_label(place), description=place.detail,
+            input_message_content=InputTextMessageContent(f"{command} {place.id}")
+        )
+        for place in places.search(text, limit=INLINE_RESULTS)
+    ]
+    await query.answer(results, cache_time=300, is_personal=True)
+
+def build_months_keyboard():
+    """Teclado de /start: meses en grid de 3 columnas y acceso a la configuración"""
     month_buttons = []
     row = []
     
@@ -548,13 +1429,22 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Botón adicional para configurar destinos
     month_buttons.append([InlineKeyboardButton("⚙️ Configurar Destinos", callback_data="config_destinos")])
     
-    markup = InlineKeyboardMarkup(month_buttons)
-    
+    return InlineKeyboardMarkup(month_buttons)
+
+def render_start_menu():
+    """Texto y teclado de /start; no dependen del usuario, se generan una vez"""
     welcome_text = (
         "🤖 **Bot de Vuelos - Fines de Semana**\n\n"
         "✈️ Busca automáticamente vuelos por menos de 150€ desde Alicante y Murcia para todos los fines de semana de un mes\n\n"
         "📅 **Selecciona un mes:**"
     )
+    return welcome_text, build_months_keyboard()
+
+@instrument_handler
+@require_authentication
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando de inicio con botones de meses en grid"""
+    welcome_text, markup = render_cache.get(("start",), 0, render_start_menu)
     
     await update.effective_message.reply_text(
         welcome_text,
@@ -562,6 +1452,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode="Markdown"
     )
 
+@instrument_handler
 async def handle_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Maneja todos los botones inline"""
     query = update.callback_query
@@ -576,34 +1467,310 @@ async def handle_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Mostrar configuración de destinos
         await destinations(update, context)
 
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Comando de ayuda"""
-    config = load_destinations()
+def render_help_text(user_id, bot_username, source):
+    """Texto de /help con la configuración actual del usuario"""
+    config = load_destinations(user_id)
     active_count = sum(1 for v in config.values() if v)
-    total_available = len(get_available_destinations())
+    total_available = len(config)
     
-    help_text = (
+    return (
         "🆘 **Ayuda - Bot de Vuelos**\n\n"
         "**Comandos disponibles:**\n"
         "• `/start` - Menú principal\n"
         "• `/find agosto` - Buscar vuelos para un mes\n"
+        "• `/find agosto puente` - Otra forma de viaje: jue-dom, vie-lun o puente\n"
+        "• `/matrix agosto 2-4n` - Precio mínimo por día de salida y noches\n"
         "• `/destinations` - Configurar destinos\n"
+        "• `/destino bergamo` - Añadir un aeropuerto, ciudad o país\n"
+        "• `/origen valencia` - Cambiar el aeropuerto o ciudad de salida\n"
+        "• `/watch agosto` - Avisarme de vuelos nuevos o más baratos\n"
+        "• `/unwatch agosto` - Dejar de vigilar un mes\n"
+        "• `/stats` - Precios históricos por destino y fin de semana\n"
+        "• `/trend italia` - Evolución del precio de un país\n"
+        "• `/status` - Estado interno del bot\n"
         "• `/help` - Mostrar esta ayuda\n\n"
         "**¿Cómo funciona?**\n"
         "1. Selecciona un mes con `/start`\n"
         "2. El bot busca automáticamente todos los viernes-domingos\n"
-        "3. Te muestra los vuelos más baratos disponibles con un precio máximo de 150€\n\n"
+        "3. Te resume el vuelo más barato de cada fin de semana (máximo 150€)\n"
+        "4. Con *Ver más* y *Siguiente fin de semana* recorres el resto sin nuevas búsquedas\n\n"
         "**Configuración actual:**\n"
         f"• Destinos activos: {active_count}/{total_available}\n"
-        "• Origen: Alicante (ALC) + Murcia(RMU)\n"
+        f"• Origen: {get_source_name(source)}\n"
         "• Vuelos: Viernes 17:00-23:59 → Domingo 11:00-23:59\n"
         "• Orden: Por precio (más barato primero), con un precio máximo de 150€\n"
-        "• Límite: 5 vuelos por fin de semana\n\n"
-        "💡 **Tip:** Configura tus destinos preferidos con `/destinations` para personalizar las búsquedas."
+        f"• Resultados: hasta {SEARCH_LIMIT} vuelos por fin de semana, {RESULTS_PAGE_SIZE} por página\n\n"
+        "💡 **Tip:** Configura tus destinos preferidos con `/destinations` para personalizar las búsquedas.\n"
+        f"🔎 Escribe aquí `@{bot_username} berg` para autocompletar aeropuertos, ciudades y países."
+    )
+
+@instrument_handler
+async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando de ayuda"""
+    user_id = update.effective_user.id
+    source = get_search_source(user_id)
+    help_text = render_cache.get(
+        ("help", user_id), (get_destinations_version(user_id), source),
+        lambda: render_help_text(user_id, context.bot.username, source)
     )
     
     await update.message.reply_text(help_text, parse_mode="Markdown")
 
+@instrument_handler
+@require_authentication
+async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Muestra el estado interno del bot (caché, API, presupuesto, envíos y persistencia)"""
+    status_text = "📈 **Estado del bot**\n\n"
+
+    if response_cache is None:
+        status_text += "🗄️ Caché: desactivada\n"
+    else:
+        stats = response_cache.stats()
+        status_text += (
+            "🗄️ **Caché de vuelos**\n"
+            f"• Aciertos: {stats['hits']} / Fallos: {stats['misses']} ({stats['hit_ratio']:.0%})\n"
+            f"• Entradas: {stats['entries']}/{stats['max_entries']}\n"
+            f"• Caducadas: {stats['expired']} / Expulsadas: {stats['evictions']}\n"
+            f"• TTL: {stats['ttl'] // 60} min (precarga: {PREWARM_TTL // 3600} h)\n"
+            f"• Precarga: {prewarm_budget.spent_today} llamadas hoy, {prewarm_budget.total_calls} en total\n"
+        )
+
+    api = kiwi_client.stats()
+    status_text += (
+        "\n🌐 **API de Kiwi**\n"
+        f"• Llamadas: {api['requests']} / Compartidas con otra en curso: {api['coalesced']}\n"
+        f"• En curso: {api['in_flight']} / Búsquedas activas: {len(ACTIVE_SEARCHES)}\n"
+        f"• Parseo ({api['parse_mode']}): {api['parse_ms']:.1f} ms por respuesta / "
+        f"pico retenido {api['parse_peak_bytes'] / 1024:.0f} KiB\n"
+    )
+
+    budget = api_budget.stats()
+    remaining = "desconocida" if budget['remaining'] is None else f"{budget['remaining']}/{budget['limit']}"
+    status_text += (
+        "\n💳 **Presupuesto de RapidAPI**\n"
+        f"• Cuota restante: {remaining} (usadas este mes: {budget['used_this_month']})\n"
+        f"• Circuito: {budget['circuit']} (fallos seguidos: {budget['consecutive_failures']})\n"
+        f"• Reintentos: {budget['retries']} / Rechazadas: {budget['rejected']}\n"
+    )
+
+    status_text += (
+        "\n📨 **Envíos a Telegram**\n"
+        f"• Mensajes: {outbox.sent} / Esperas por flood: {outbox.flood_waits}\n"
+    )
+
+    sessions = result_sessions.stats()
+    status_text += (
+        "\n📑 **Sesiones de resultados**\n"
+        f"• En memoria: {sessions['in_memory']}/{RESULT_SESSION_MAX} / Creadas: {sessions['created']} / Caducadas: {sessions['expired']}\n"
+    )
+
+    plan = query_planner.stats()
+    matrix_plan = matrix_planner.stats()
+    shards = destination_sharder.stats()
+    status_text += (
+        "\n🧮 **Planificador de consultas**\n"
+        f"• Llamadas: {plan['planned_calls']} de {plan['naive_calls']} ingenuas (ahorro {plan['saved_ratio']:.0%})\n"
+        f"• Matrices: {matrix_plan['planned_calls']} llamadas para {matrix_plan['naive_calls']} combinaciones\n"
+        f"• Shards por consulta: {shards['shards_per_query']:.1f} (máx. {shards['max_shards']}) / "
+        f"Destinos medidos: {shards['destinations']} ({shards['dense']} llenan su cupo)\n"
+    )
+
+    prefs = preferences_store.stats()
+    status_text += (
+        "\n💾 **Destinos por usuario**\n"
+        f"• Usuarios con destinos propios: {prefs['users']} / Cambios: {prefs['changes']}\n"
+        f"• En memoria: {prefs['cached']} usuarios / Lecturas desde memoria: {prefs['hits']} "
+        f"/ De la base de datos: {prefs['loads']} (recargas por otro proceso: {prefs['reloads']})\n"
+        f"• Escrituras: {prefs['flushes']} (agrupadas: {prefs['coalesced']}) / "
+        f"Última: {prefs['last_flush_ms']:.1f} ms (media {prefs['avg_flush_ms']:.1f} ms) / "
+        f"Pendiente: {'sí' if prefs['pending'] else 'no'}\n"
+    )
+
+    render = render_cache.stats()
+    status_text += (
+        "\n🎨 **Menús renderizados**\n"
+        f"• Aciertos: {render['hits']} / Fallos: {render['misses']} ({render['hit_ratio']:.0%})\n"
+        f"• Entradas: {render['entries']}/{render['max_entries']} / Invalidadas: {render['invalidated']}\n"
+    )
+
+    if fare_history is not None:
+        history = fare_history.stats()
+        since = history['since'].strftime('%d/%m/%Y') if history['since'] else "-"
+        status_text += (
+            "\n📚 **Histórico de precios**\n"
+            f"• Observaciones: {history['rows']} (desde {since}) / Nuevas: {history['recorded']} / Pendientes: {history['pending']}\n"
+        )
+
+    status_text += (
+        "\n🖥️ **Worker**\n"
+        f"• Proceso: `{shared_state.owner}` ({'webhook' if WEBHOOK_URL else 'polling'})\n"
+        f"• Usuarios autenticados: {shared_state.authorized_count()}\n"
+    )
+
+    await update.effective_message.reply_text(status_text, parse_mode="Markdown")
+
+def sparkline(values):
+    """Mini gráfico de barras con caracteres de bloque"""
+    bars = "▁▂▃▄▅▆▇█"
+    low, high = min(values), max(values)
+    if high == low:
+        return bars[0] * len(values)
+    return "".join(bars[int((v - low) / (high - low) * (len(bars) - 1))] for v in values)
+
+@instrument_handler
+@require_authentication
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Resumen del histórico de precios: percentiles por destino y el más barato por fin de semana"""
+    if fare_history is None:
+        await update.message.reply_text("ℹ️ El histórico de precios está desactivado.")
+        return
+
+    summary = fare_history.summary(days=FARE_STATS_DAYS, since_outbound=datetime.now(), max_destinations=10)
+    if not summary["observations"]:
+        await update.message.reply_text(f"📭 No hay precios guardados de los últimos {FARE_STATS_DAYS} días. Haz alguna búsqueda con `/find`.", parse_mode="Markdown")
+        return
+
+    lines = [f"📊 *Precios de los últimos {FARE_STATS_DAYS} días* ({summary['observations']} observaciones)\n"]
+    lines.append("🎯 *Por destino* (mín · mediana · p25–p75):")
+    for d in summary["destinations"]:
+        lines.append(
+            f"• {d['destination']}: {d['min']:.0f}€ · {d['median']:.0f}€ · {d['p25']:.0f}–{d['p75']:.0f}€ ({d['observations']})"
+        )
+    if summary["weekends"]:
+        lines.append("\n🗓️ *Más barato por fin de semana:*")
+        for w in summary["weekends"][:8]:
+            lines.append(f"• {w['date'].strftime('%d/%m')}: {w['price']:.2f}€ ({w['destination']})")
+
+    await update.message.reply_text("\n".join(lines), parse_mode="Markdown")
+
+@instrument_handler
+@require_authentication
+async def trend_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Evolución del precio más bajo observado para un país"""
+    if fare_history is None:
+        await update.message.reply_text("ℹ️ El histórico de precios está desactivado.")
+        return
+
+    code = find_country(" ".join(context.args)) if context.args else None
+    if code is None:
+        await update.message.reply_text("🌍 Usa el comando así: `/trend italia` (o `/trend IT`)", parse_mode="Markdown")
+        return
+
+    country_name = get_country_name(code)
+    trend = fare_history.trend(code.split(":")[1], days=FARE_STATS_DAYS)
+    if trend is None:
+        await update.message.reply_text(f"📭 No hay precios guardados para {country_name} en los últimos {FARE_STATS_DAYS} días.")
+        return
+
+    slope = trend["slope_per_week"]
+    direction = "📉 bajando" if slope < -0.5 else "📈 subiendo" if slope > 0.5 else "➡️ estable"
+    recent = trend["days"][-14:]
+    lines = [
+        f"{country_name}: *tendencia de precios* ({trend['observations']} observaciones)\n",
+        f"{direction} ({slope:+.2f} €/semana en el mínimo diario)",
+        f"• Mediana: {trend['median']:.2f}€ (p10 {trend['p10']:.2f}€ · p90 {trend['p90']:.2f}€)",
+        f"• Mínimo diario: `{sparkline([d['min'] for d in recent])}`\n"
+    ]
+    for d in recent[-7:]:
+        lines.append(f"• {d['date'].strftime('%d/%m')}: mín {d['min']:.2f}€ · mediana {d['median']:.2f}€")
+
+    await update.message.reply_text("\n".join(lines), parse_mode="Markdown")
+
+async def on_startup(application):
+    """Abre los recursos compartidos al arrancar la Application"""
+    global response_cache, watch_store, search_history, preferences_store, metrics_server, shared_state, fare_history
+    global result_sessions, destination_sharder
+    shared_state = SharedState(STATE_DB_FILE)
+    preferences_store = PreferencesStore(STATE_DB_FILE, DESTINATIONS_MASTER, flush_delay=DESTINATIONS_FLUSH_DELAY)
+    migrate_destinations_file()
+    watch_store = WatchStore(STATE_DB_FILE)
+    result_sessions = ResultSessions(STATE_DB_FILE, ttl=RESULT_SESSION_TTL, max_sessions=RESULT_SESSION_MAX)
+    search_history = SearchHistory(STATE_DB_FILE)
+    destination_sharder = DestinationSharder(
+        STATE_DB_FILE, max_shards=SEARCH_SHARDS, top_k=SEARCH_LIMIT, destination_cap=DESTINATION_CAP
+    )
+    if CACHE_TTL > 0:
+        response_cache = ResponseCache(CACHE_FILE, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES)
+        kiwi_client.cache = response_cache
+    if FARE_HISTORY_FILE:
+        fare_history = FareHistory(FARE_HISTORY_FILE, flush_delay=FARE_HISTORY_FLUSH_DELAY)
+        # Cargar las columnas al arrancar para que el primer /stats no espere
+        logging.info(f"Histórico de precios: {len(fare_history.load())} observaciones")
+    await kiwi_client.start()
+    if METRICS_PORT:
+        metrics_server = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+
+async def on_shutdown(application):
+    """Libera los recursos compartidos al detener la Application"""
+    tracer.flush()
+    if metrics_server is not None:
+        metrics_server.close()
+    await kiwi_client.close()
+    if response_cache is not None:
+        response_cache.close()
+    if watch_store is not None:
+        watch_store.close()
+    if search_history is not None:
+        search_history.close()
+    if preferences_store is not None:
+        preferences_store.close()
+    if result_sessions is not None:
+        result_sessions.close()
+    if destination_sharder is not None:
+        destination_sharder.close()
+    if fare_history is not None:
+        fare_history.close()
+    places.close()
+    if shared_state is not None:
+        # Ceder los turnos para que otro worker no tenga que esperar a que caduquen
+        shared_state.release_lease("watch_cycle")
+        shared_state.release_lease("prewarm_cache")
+        shared_state.close()
+
+def build_application(token, base_url=None):
+    """Crea la Application con todos los handlers y tareas periódicas.
+    `base_url` sustituye a la API de Telegram (p. ej. por una falsa en pruebas de carga).
+    """
+    builder = (
+        ApplicationBuilder()
+        .token(token)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if base_url:
+        builder = builder.base_url(base_url)
+    app = builder.build()
+    
+    # Agregar handlers
+    app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("find", find))
+    app.add_handler(CommandHandler("matrix", matrix))
+    app.add_handler(CommandHandler("destinations", destinations))
+    app.add_handler(CommandHandler("destino", destino_command))
+    app.add_handler(CommandHandler("origen", origen_command))
+    app.add_handler(CommandHandler("help", help_command))
+    app.add_handler(CommandHandler("status", status_command))
+    app.add_handler(CommandHandler("stats", stats_command))
+    app.add_handler(CommandHandler("trend", trend_command))
+    app.add_handler(CommandHandler("watch", watch))
+    app.add_handler(CommandHandler("unwatch", unwatch))
+    app.add_handler(CallbackQueryHandler(handle_toggle, pattern="^toggle_"))
+    app.add_handler(CallbackQueryHandler(handle_toggle, pattern="^reset_defaults$"))
+    app.add_handler(CallbackQueryHandler(handle_results, pattern="^res:"))
+    app.add_handler(CallbackQueryHandler(handle_place_choice, pattern="^place_(dst|org):"))
+    app.add_handler(InlineQueryHandler(inline_places))
+    app.add_handler(CallbackQueryHandler(handle_button))
+    app.add_handler(CommandHandler("login", login))
+
+    # Tareas periódicas (requiere python-telegram-bot[job-queue])
+    if app.job_queue is not None:
+        app.job_queue.run_repeating(watch_cycle, interval=WATCH_INTERVAL, first=60, name="watch_cycle")
+        app.job_queue.run_repeating(prewarm_cache, interval=PREWARM_INTERVAL, first=300, name="prewarm_cache")
+    else:
+        logging.warning("JobQueue no disponible: /watch y la precarga no funcionarán. Instala python-telegram-bot[job-queue]")
+    return app
+
 #####################################
 
 if __name__ == "__main__":
@@ -618,22 +1785,27 @@ if __name__ == "__main__":
         print("💡 Crea un archivo .env con: RAPIDAPI_KEY=tu_clave_aqui")
         exit(1)
 
-    # Validar configuración al iniciar el bot
+    if WEBHOOK_URL and not WEBHOOK_SECRET:
+        print("❌ Error: WEBHOOK_SECRET es obligatorio en modo webhook")
+        print("💡 Añade al .env: WEBHOOK_SECRET=una_cadena_aleatoria (letras, números, _ y -)")
+        exit(1)
+
     logging.info("🚀 Iniciando bot...")
-    logging.info("🔧 Validando configuración de destinos...")
-    validate_destinations_config()
-    
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
-    
-    # Agregar handlers
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("find", find))
-    app.add_handler(CommandHandler("destinations", destinations))
-    app.add_handler(CommandHandler("help", help_command))
-    app.add_handler(CallbackQueryHandler(handle_toggle, pattern="^toggle_"))
-    app.add_handler(CallbackQueryHandler(handle_toggle, pattern="^reset_defaults$"))
-    app.add_handler(CallbackQueryHandler(handle_button))
-    app.add_handler(CommandHandler("login", login))
+    app = build_application(BOT_TOKEN)
 
-    print("🤖 Bot iniciado ✅ Usa /start")
-    app.run_polling()
+    if WEBHOOK_URL:
+        # Telegram entrega cada actualización por HTTPS; se responde al momento y
+        # el handler se ejecuta como tarea (CONCURRENT_UPDATES), así que una
+        # búsqueda larga no retiene la conexión
+        print(f"🤖 Bot iniciado en modo webhook (puerto {WEBHOOK_PORT}) ✅ Usa /start")
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=urlsplit(WEBHOOK_URL).path.lstrip("/"),
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS
+        )
+    else:
+        print("🤖 Bot iniciado ✅ Usa /start")
+        app.run_polling()
@@ -0,0 +1,173 @@
+"""Caché TTL + LRU de respuestas de la API de Kiwi, persistida en SQLite"""
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+
+# Parámetros con listas separadas por comas cuyo orden no altera el resultado
+LIST_PARAMS = ("source", "destination")
+
+
+def make_cache_key(params):
+    """Genera una clave estable a partir de los parámetros normalizados de la consulta.
+
+    Orígenes y destinos se ordenan, de modo que la misma búsqueda con los
+    países en otro orden reutiliza la misma entrada.
+    """
+    normalized = {}
+    for name, value in params.items():
+        value = str(value)
+        if name in LIST_PARAMS:
+            value = ",".join(sorted(filter(None, value.split(","))))
+        normalized[name] = value
+    raw = json.dumps(normalized, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Caché de respuestas con caducidad (TTL) y tamaño máximo (LRU).
+
+    Las lecturas se sirven desde memoria; cada escritura se persiste en SQLite
+    para que la caché sobreviva a reinicios del bot. Si una clave no está en
+    memoria se busca en SQLite, donde puede haberla escrito otro worker. Cada
+    entrada puede llevar su propio TTL (p. ej. las precargadas fuera de horas punta).
+    """
+
+    def __init__(self, path, ttl=1800, max_entries=1000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (expires_at, data)
+        self._db = sqlite3.connect(path, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, created_at REAL NOT NULL, payload TEXT NOT NULL, expires_at REAL)"
+        )
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(responses)")]
+        if "expires_at" not in columns:
+            self._db.execute("ALTER TABLE responses ADD COLUMN expires_at REAL")
+            self._db.execute("UPDATE responses SET expires_at = created_at + ?", (ttl,))
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_responses_created ON responses(created_at)")
+        self._db.commit()
+        self._load()
+
+    def _load(self):
+        """Carga en memoria las entradas vigentes más recientes"""
+        self._db.execute("DELETE FROM responses WHERE expires_at < ?", (time.time(),))
+        rows = self._db.execute(
+            "SELECT key, expires_at, payload FROM responses ORDER BY created_at DESC LIMIT ?",
+            (self.max_entries,)
+        ).fetchall()
+        # Las más antiguas primero para respetar el orden LRU
+        for key, expires_at, payload in reversed(rows):
+            try:
+                self._entries[key] = (expires_at, json.loads(payload))
+            except ValueError:
+                continue
+        self._db.execute(
+            "DELETE FROM responses WHERE key NOT IN (SELECT key FROM responses ORDER BY created_at DESC LIMIT ?)",
+            (self.max_entries,)
+        )
+        self._db.commit()
+        logging.info(f"Caché de vuelos cargada: {len(self._entries)} entradas ({self.path})")
+
+    def get(self, params):
+        """Devuelve la respuesta cacheada para los parámetros o None si no existe o ha caducado"""
+        key = make_cache_key(params)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._load_entry(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, data = entry
+        if time.time() > expires_at:
+            self._delete(key)
+            self.expired += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return data
+
+    def _load_entry(self, key):
+        """Trae a memoria una entrada escrita en SQLite por otro worker"""
+        try:
+            row = self._db.execute("SELECT expires_at, payload FROM responses WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            logging.error(f"Error leyendo la caché de vuelos: {e}")
+            return None
+        if row is None or row[0] < time.time():
+            return None
+        try:
+            entry = (row[0], json.loads(row[1]))
+        except ValueError:
+            return None
+        self._entries[key] = entry
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return entry
+
+    def set(self, params, data, ttl=None):
+        """Guarda una respuesta y expulsa las menos usadas si se supera el tamaño máximo.
+        `ttl` sustituye al TTL por defecto solo para esta entrada.
+        """
+        key = make_cache_key(params)
+        created_at = time.time()
+        expires_at = created_at + (self.ttl if ttl is None else ttl)
+        self._entries[key] = (expires_at, data)
+        self._entries.move_to_end(key)
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, created_at, expires_at, payload) VALUES (?, ?, ?, ?)",
+                (key, created_at, expires_at, json.dumps(data, ensure_ascii=False, separators=(",", ":")))
+            )
+            while len(self._entries) > self.max_entries:
+                old_key, _ = self._entries.popitem(last=False)
+                self._db.execute("DELETE FROM responses WHERE key = ?", (old_key,))
+                self.evictions += 1
+            self._db.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Error al persistir la caché de vuelos: {e}")
+
+    def remaining_ttl(self, params):
+        """Segundos de vigencia que le quedan a la entrada, o 0 si no existe"""
+        entry = self._entries.get(make_cache_key(params))
+        return max(0.0, entry[0] - time.time()) if entry else 0.0
+
+    def _delete(self, key):
+        self._entries.pop(key, None)
+        try:
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._db.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Error al eliminar entrada de la caché de vuelos: {e}")
+
+    def stats(self):
+        """Contadores de uso para ajustar el TTL frente a la frescura de los precios"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "ttl": self.ttl,
+            "max_entries": self.max_entries
+        }
+
+    def close(self):
+        """Cierra la base de datos"""
+        self._db.close()
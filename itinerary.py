@@ -0,0 +1,106 @@
+"""Modelo de itinerario de ida y vuelta devuelto por la API de Kiwi"""
+from datetime import datetime
+
+KIWI_BASE = "https://www.kiwi.com"
+
+
+def parse_local_time(value):
+    """Convierte un `localTime` ISO de la API (`2025-08-01T18:30:00.000`) a datetime.
+
+    `fromisoformat` sobre el prefijo fijo `YYYY-MM-DDTHH:MM` es bastante más
+    rápido que `strptime` y evita interpretar la cadena de formato en cada llamada.
+    """
+    return datetime.fromisoformat(value[:16])
+
+
+def station_country(station):
+    """Código ISO del país de una estación, si la respuesta lo incluye"""
+    country = station.get("country") or (station.get("city") or {}).get("country") or {}
+    return country.get("code", "")
+
+
+class Itinerary:
+    """Itinerario ya parseado: precio numérico, horarios, aerolíneas, estaciones y enlace.
+
+    El texto Markdown no se genera hasta que se va a enviar (`to_markdown`).
+    """
+
+    __slots__ = (
+        "price", "outbound_time", "inbound_time",
+        "origin", "destination", "origin_code", "destination_code", "destination_country",
+        "outbound_carrier", "inbound_carrier", "booking_url"
+    )
+
+    def __init__(self, price, outbound_time, inbound_time, origin, destination,
+                 outbound_carrier, inbound_carrier, booking_url, origin_code="", destination_code="", destination_country=""):
+        self.price = price
+        self.outbound_time = outbound_time
+        self.inbound_time = inbound_time
+        self.origin = origin
+        self.destination = destination
+        self.origin_code = origin_code
+        self.destination_code = destination_code
+        self.destination_country = destination_country
+        self.outbound_carrier = outbound_carrier
+        self.inbound_carrier = inbound_carrier
+        self.booking_url = booking_url
+
+    @classmethod
+    def from_api(cls, itinerary):
+        """Construye el itinerario a partir de un elemento de `itineraries` de la respuesta"""
+        outbound_seg = itinerary["outbound"]["sectorSegments"][0]["segment"]
+        inbound_seg = itinerary["inbound"]["sectorSegments"][0]["segment"]
+        origin_station = outbound_seg["source"]["station"]
+        destination_station = outbound_seg["destination"]["station"]
+
+        # Link de booking
+        booking = itinerary.get("bookingOptions", {}).get("edges", [])
+        link = KIWI_BASE + booking[0]["node"]["bookingUrl"] if booking else KIWI_BASE
+
+        return cls(
+            price=float(itinerary["price"]["amount"]),
+            outbound_time=parse_local_time(outbound_seg["source"]["localTime"]),
+            inbound_time=parse_local_time(inbound_seg["source"]["localTime"]),
+            origin=origin_station["name"],
+            destination=destination_station["name"],
+            origin_code=origin_station.get("code", ""),
+            destination_code=destination_station.get("code", ""),
+            destination_country=station_country(destination_station),
+            outbound_carrier=outbound_seg["carrier"]["name"],
+            inbound_carrier=inbound_seg["carrier"]["name"],
+            booking_url=link
+        )
+
+    def to_dict(self):
+        """Forma serializable en JSON (fechas en ISO)"""
+        data = {name: getattr(self, name) for name in self.__slots__}
+        data["outbound_time"] = self.outbound_time.isoformat()
+        data["inbound_time"] = self.inbound_time.isoformat()
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data)
+        data["outbound_time"] = datetime.fromisoformat(data["outbound_time"])
+        data["inbound_time"] = datetime.fromisoformat(data["inbound_time"])
+        return cls(**data)
+
+    @property
+    def key(self):
+        """Identifica el mismo viaje entre respuestas (para deduplicar o comparar precios)"""
+        return (self.origin, self.destination, self.outbound_time, self.inbound_time,
+                self.outbound_carrier, self.inbound_carrier)
+
+    def to_markdown(self):
+        """Mensaje en Markdown para Telegram"""
+        return (
+            f"✈️ *{self.origin} → {self.destination}*\n"
+            f"🛫 Ida: `{self.outbound_time.strftime('%d/%m %H:%M')}` ({self.outbound_carrier})\n"
+            f"🛬 Vuelta: `{self.inbound_time.strftime('%d/%m %H:%M')}` ({self.inbound_carrier})\n"
+            f"💰 Precio: *{self.price:.2f} €*\n"
+            f"[🔗 Reservar]({self.booking_url})"
+        )
+
+    def __repr__(self):
+        return (f"Itinerary({self.origin}→{self.destination}, {self.price:.2f}€, "
+                f"{self.outbound_time:%Y-%m-%d %H:%M}→{self.inbound_time:%Y-%m-%d %H:%M})")
@@ -0,0 +1,275 @@
+"""Cliente HTTP asíncrono para la API Kiwi.com Cheap Flights (vía RapidAPI)"""
+import asyncio
+import logging
+import time
+
+import httpx
+
+from flight_cache import make_cache_key
+from metrics import Counter, Histogram
+from response_parser import ParserPool
+from tracing import tracer
+
+KIWI_HOST = "kiwi-com-cheap-flights.p.rapidapi.com"
+KIWI_BASE_URL = f"https://{KIWI_HOST}"
+
+KIWI_REQUEST_SECONDS = Histogram("kiwi_request_seconds", "Duración de cada petición HTTP a /round-trip")
+KIWI_RESPONSES = Counter("kiwi_responses_total", "Respuestas de /round-trip por código de estado", labels=("status",))
+KIWI_PARSE_SECONDS = Histogram("kiwi_parse_seconds", "Tiempo de decodificación y extracción de cada respuesta")
+KIWI_PARSE_PEAK = Histogram(
+    "kiwi_parse_peak_bytes", "Texto máximo retenido a la vez al decodificar cada respuesta",
+    buckets=(4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+)
+API_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+class KiwiAPIError(Exception):
+    """Error al consultar la API de Kiwi (red, timeout, HTTP o JSON no válido)"""
+
+
+def build_round_trip_params(destinations, outbound_start, outbound_end, inbound_start, inbound_end,
+                            source="Airport:ALC,Airport:RMU", limit=5, price_start=0, price_end=150):
+    """Construye los parámetros de una búsqueda de ida y vuelta en /round-trip"""
+    return {
+        "source": source,
+        "destination": ",".join(destinations),
+        "currency": "eur",
+        "locale": "es",
+        "adults": "1",
+        "children": "0",
+        "infants": "0",
+        "handbags": "1",
+        "holdbags": "0",
+        "cabinClass": "ECONOMY",
+        "applyMixedClasses": "false",
+        "enableThrowAwayTicketing": "false",
+        "allowReturnFromDifferentCity": "false",
+        "allowChangeInboundDestination": "false",
+        "allowChangeInboundSource": "false",
+        "allowOvernightStopover": "false",
+        "enableTrueHiddenCity": "false",
+        "enableSelfTransfer": "true",
+        "allowDifferentStationConnection": "true",
+        "sortBy": "PRICE",
+        "sortOrder": "ASCENDING",
+        "outboundDepartureDateStart": outbound_start.strftime(API_DATE_FORMAT),
+        "outboundDepartureDateEnd": outbound_end.strftime(API_DATE_FORMAT),
+        "inboundDepartureDateStart": inbound_start.strftime(API_DATE_FORMAT),
+        "inboundDepartureDateEnd": inbound_end.strftime(API_DATE_FORMAT),
+        "transportTypes": "FLIGHT",
+        "limit": str(limit),
+        "priceStart": str(price_start),
+        "priceEnd": str(price_end)
+    }
+
+
+class KiwiClient:
+    """Cliente compartido con un pool de conexiones keep-alive hacia RapidAPI.
+
+    Se abre una sola vez al arrancar la Application y se cierra al apagarla,
+    de modo que las búsquedas concurrentes reutilizan conexiones TLS ya abiertas
+    y nunca bloquean el event loop. `max_concurrency` limita las consultas
+    simultáneas de todo el proceso, sumando todas las búsquedas en curso.
+    Si se indica una `cache`, las respuestas vigentes se sirven sin llamar a la API.
+    Las consultas idénticas en curso se comparten: quien llega después espera
+    la misma respuesta en lugar de lanzar otra llamada. Con un `budget`
+    (ver api_budget.ApiBudget) se aplican ritmo, cuota, reintentos y circuit breaker.
+    `base_url` permite apuntar a otro servidor (p. ej. uno falso en pruebas de carga).
+    El cuerpo de cada respuesta se decodifica a medida que llega con `parser`
+    (ver response_parser.ParserPool), que solo conserva los campos que usa el bot.
+    """
+
+    def __init__(self, api_key, pool_size=10, keepalive_connections=5,
+                 connect_timeout=10.0, read_timeout=30.0, keepalive_expiry=60.0,
+                 max_concurrency=10, cache=None, budget=None, base_url=KIWI_BASE_URL, parser=None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.pool_size = pool_size
+        self.keepalive_connections = min(keepalive_connections, pool_size)
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.keepalive_expiry = keepalive_expiry
+        self.max_concurrency = max_concurrency
+        self.cache = cache
+        self.budget = budget
+        self.parser = parser or ParserPool("inline")
+        self.requests = 0
+        self.coalesced = 0
+        self.parsed = 0
+        self.parse_seconds = 0.0
+        self.parse_peak = 0
+        self._client = None
+        self._semaphore = None
+        self._inflight = {}
+
+    async def start(self):
+        """Abre el pool de conexiones (idempotente)"""
+        if self._client is not None:
+            return
+        # El semáforo se crea aquí para quedar ligado al event loop de la Application
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers={
+                "X-RapidAPI-Key": self.api_key or "",
+                "X-RapidAPI-Host": KIWI_HOST
+            },
+            limits=httpx.Limits(
+                max_connections=self.pool_size,
+                max_keepalive_connections=self.keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry
+            ),
+            timeout=httpx.Timeout(
+                self.read_timeout,
+                connect=self.connect_timeout,
+                pool=self.read_timeout
+            )
+        )
+        logging.info(
+            f"Cliente Kiwi iniciado (pool={self.pool_size}, keep-alive={self.keepalive_connections}, "
+            f"concurrencia={self.max_concurrency})"
+        )
+
+    async def close(self):
+        """Cierra el pool de conexiones"""
+        if self._client is None:
+            return
+        for pending in list(self._inflight.values()):
+            pending.cancel()
+        await self._client.aclose()
+        self._client = None
+        self.parser.close()
+        logging.info("Cliente Kiwi cerrado")
+
+    async def round_trip(self, params, cache_ttl=None, refresh=False):
+        """Consulta /round-trip y devuelve la respuesta decodificada, reducida a los campos que usa el bot.
+
+        `refresh` ignora la entrada cacheada y `cache_ttl` fija la vigencia de la
+        nueva (lo usa la precarga de la caché).
+        """
+        data, _ = await self.round_trip_fresh(params, cache_ttl, refresh)
+        return data
+
+    async def round_trip_fresh(self, params, cache_ttl=None, refresh=False):
+        """Como `round_trip`, pero devuelve (respuesta, nueva).
+
+        Solo es nueva para la consulta que la ha pedido a la API; las servidas
+        desde la caché o compartidas con una llamada en curso no lo son, así que
+        cada respuesta de la API se procesa una vez (p. ej. para el histórico de precios).
+        """
+        if self.cache is not None and not refresh:
+            cached = self.cache.get(params)
+            if cached is not None:
+                return cached, False
+
+        key = make_cache_key(params)
+        pending = self._inflight.get(key)
+        fresh = pending is None
+        if fresh:
+            pending = asyncio.ensure_future(self._fetch_round_trip(params, cache_ttl))
+            self._inflight[key] = pending
+            pending.add_done_callback(lambda future: self._forget_inflight(key, future))
+        else:
+            self.coalesced += 1
+
+        # shield: si un solicitante se cancela, la consulta sigue para los demás
+        return await asyncio.shield(pending), fresh
+
+    def _forget_inflight(self, key, future):
+        self._inflight.pop(key, None)
+        # Marcar la excepción como consultada aunque todos los solicitantes se hayan cancelado
+        if not future.cancelled():
+            future.exception()
+
+    async def _fetch_round_trip(self, params, cache_ttl=None):
+        if self._client is None:
+            await self.start()
+
+        attempt = 0
+        while True:
+            if self.budget is not None:
+                self.budget.check(retrying=attempt > 0)
+                await self.budget.acquire()
+            try:
+                async with self._semaphore:
+                    self.requests += 1
+                    started = time.perf_counter()
+                    with tracer.span("kiwi_request", attempt=attempt) as span:
+                        try:
+                            async with self._client.stream("GET", "/round-trip", params=params) as response:
+                                span.set(status=response.status_code)
+                                KIWI_RESPONSES.inc(status=response.status_code)
+                                if self.budget is not None:
+                                    self.budget.update_from_headers(response.headers)
+                                response.raise_for_status()
+                                # El cuerpo se decodifica según llega, sin construir el árbol completo
+                                with tracer.span("json_decode", mode=self.parser.mode) as parse_span:
+                                    data, parsed = await self.parser.parse(response.aiter_bytes())
+                                    parse_span.set(**parsed)
+                        finally:
+                            KIWI_REQUEST_SECONDS.observe(time.perf_counter() - started)
+                        span.set(bytes=parsed["bytes"])
+                self._record_parse(parsed)
+                break
+
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                status_code = e.response.status_code if isinstance(e, httpx.HTTPStatusError) else None
+                if status_code is None:
+                    KIWI_RESPONSES.inc(status="transport_error")
+                # Red, timeouts, 429 y 5xx merecen reintento; el resto de 4xx no
+                transient = status_code is None or status_code == 429 or status_code >= 500
+                if self.budget is not None and transient:
+                    if attempt < self.budget.max_retries:
+                        delay = self.budget.backoff_delay(attempt, self._retry_after(e))
+                        logging.warning(f"Error transitorio de la API ({type(e).__name__}), reintento {attempt + 1} en {delay:.1f}s")
+                        attempt += 1
+                        await asyncio.sleep(delay)
+                        continue
+                    self.budget.record_failure()
+                elif self.budget is not None:
+                    # Un 4xx es un fallo de la consulta, no de la API: ni abre ni cierra el circuito
+                    self.budget.release_probe()
+                raise KiwiAPIError(f"{type(e).__name__}: {e}") from e
+            except httpx.HTTPError as e:
+                if self.budget is not None:
+                    self.budget.record_failure()
+                raise KiwiAPIError(f"{type(e).__name__}: {e}") from e
+            except ValueError as e:
+                if self.budget is not None:
+                    self.budget.record_failure()
+                raise KiwiAPIError(f"Respuesta JSON no válida: {e}") from e
+
+        if self.budget is not None:
+            self.budget.record_success()
+        if self.cache is not None:
+            self.cache.set(params, data, ttl=cache_ttl)
+        return data
+
+    def _record_parse(self, parsed):
+        self.parsed += 1
+        self.parse_seconds += parsed["seconds"]
+        self.parse_peak = max(self.parse_peak, parsed["peak_buffer"])
+        KIWI_PARSE_SECONDS.observe(parsed["seconds"])
+        KIWI_PARSE_PEAK.observe(parsed["peak_buffer"])
+
+    @staticmethod
+    def _retry_after(error):
+        """Segundos indicados por la cabecera Retry-After de un 429/503, si existe"""
+        if not isinstance(error, httpx.HTTPStatusError):
+            return None
+        value = error.response.headers.get("retry-after")
+        try:
+            return float(value) if value is not None else None
+        except ValueError:
+            return None
+
+    def stats(self):
+        """Llamadas reales a la API y consultas resueltas por una llamada ya en curso"""
+        return {
+            "requests": self.requests,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._inflight),
+            "parse_mode": self.parser.mode,
+            "parse_ms": self.parse_seconds / self.parsed * 1000 if self.parsed else 0.0,
+            "parse_peak_bytes": self.parse_peak
+        }
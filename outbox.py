@@ -0,0 +1,171 @@
+"""Envío de mensajes a Telegram con límites de ritmo, reintentos y agrupación"""
+import asyncio
+import logging
+import time
+from datetime import timedelta
+
+from telegram.error import BadRequest, RetryAfter
+
+from metrics import Counter, Histogram
+from tracing import tracer
+
+# Longitud máxima de un mensaje de texto en Telegram
+MAX_MESSAGE_LENGTH = 4096
+
+TELEGRAM_SEND_SECONDS = Histogram("telegram_send_seconds", "Duración de las llamadas a la API de Telegram")
+TELEGRAM_QUEUE_SECONDS = Histogram(
+    "telegram_queue_seconds", "Tiempo desde que se pide un envío hasta que se completa (límites de ritmo incluidos)")
+TELEGRAM_FLOOD_WAITS = Counter("telegram_flood_waits_total", "Reintentos tras un RetryAfter de Telegram")
+
+
+def pack_messages(blocks, limit=MAX_MESSAGE_LENGTH, separator="\n\n"):
+    """Agrupa bloques de texto en el menor número de mensajes que quepan en `limit`.
+
+    Los bloques nunca se parten salvo que uno solo supere el límite.
+    """
+    messages = []
+    current = ""
+    for block in blocks:
+        if len(block) > limit:
+            block = block[:limit]
+        if not current:
+            current = block
+        elif len(current) + len(separator) + len(block) <= limit:
+            current += separator + block
+        else:
+            messages.append(current)
+            current = block
+    if current:
+        messages.append(current)
+    return messages
+
+
+def _retry_after_seconds(error):
+    wait = error.retry_after
+    if isinstance(wait, timedelta):
+        wait = wait.total_seconds()
+    return float(wait)
+
+
+class _ChatState:
+    __slots__ = ("lock", "next_allowed")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.next_allowed = 0.0
+
+
+class MessageOutbox:
+    """Cola de salida hacia la Bot API.
+
+    Aplica un token bucket global (mensajes por segundo de todo el bot) y un
+    intervalo mínimo por chat, más largo en grupos. Los envíos de un mismo chat
+    salen en orden y, ante un `RetryAfter`, se espera lo indicado y se reintenta.
+    """
+
+    def __init__(self, global_rate=30.0, private_interval=1.0, group_interval=3.0,
+                 max_retries=3, max_idle_chats=1000):
+        self.global_rate = global_rate
+        self.private_interval = private_interval
+        self.group_interval = group_interval
+        self.max_retries = max_retries
+        self.max_idle_chats = max_idle_chats
+        self.sent = 0
+        self.flood_waits = 0
+        self._chats = {}
+        self._tokens = global_rate
+        self._last_refill = time.monotonic()
+        self._global_lock = None
+
+    def _chat_state(self, chat_id):
+        state = self._chats.get(chat_id)
+        if state is None:
+            if len(self._chats) >= self.max_idle_chats:
+                self._prune()
+            state = self._chats[chat_id] = _ChatState()
+        return state
+
+    def _prune(self):
+        """Olvida los chats sin envíos en curso ni esperas pendientes"""
+        now = time.monotonic()
+        for chat_id in [c for c, s in self._chats.items() if not s.lock.locked() and s.next_allowed <= now]:
+            del self._chats[chat_id]
+
+    async def _acquire_global(self):
+        if self._global_lock is None:
+            self._global_lock = asyncio.Lock()
+        async with self._global_lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.global_rate, self._tokens + (now - self._last_refill) * self.global_rate)
+                self._last_refill = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.global_rate)
+
+    async def send(self, chat_id, send_func, *args, **kwargs):
+        """Ejecuta `send_func(*args, **kwargs)` respetando los límites del chat y globales"""
+        state = self._chat_state(chat_id)
+        interval = self.group_interval if chat_id < 0 else self.private_interval
+        queued = time.perf_counter()
+
+        async with state.lock:
+            for attempt in range(self.max_retries + 1):
+                delay = state.next_allowed - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await self._acquire_global()
+                state.next_allowed = time.monotonic() + interval
+                started = time.perf_counter()
+                try:
+                    with tracer.span("telegram_send", method=getattr(send_func, "__name__", "send"), attempt=attempt):
+                        result = await send_func(*args, **kwargs)
+                    self.sent += 1
+                    TELEGRAM_QUEUE_SECONDS.observe(time.perf_counter() - queued)
+                    return result
+                except RetryAfter as e:
+                    wait = _retry_after_seconds(e)
+                    self.flood_waits += 1
+                    TELEGRAM_FLOOD_WAITS.inc()
+                    logging.warning(f"Flood control en chat {chat_id}: esperando {wait:.0f}s (intento {attempt + 1})")
+                    state.next_allowed = time.monotonic() + wait
+                    if attempt == self.max_retries:
+                        raise
+                finally:
+                    TELEGRAM_SEND_SECONDS.observe(time.perf_counter() - started)
+
+
+class StatusMessage:
+    """Mensaje de estado único que se edita in situ como mucho cada `min_interval` segundos"""
+
+    def __init__(self, outbox, chat_id, min_interval=2.0):
+        self.outbox = outbox
+        self.chat_id = chat_id
+        self.min_interval = min_interval
+        self.message = None
+        self._text = None
+        self._last_edit = 0.0
+
+    async def start(self, send_to, text, **kwargs):
+        """Envía el mensaje de estado inicial"""
+        self._kwargs = kwargs
+        self._text = text
+        self.message = await self.outbox.send(self.chat_id, send_to.reply_text, text, **kwargs)
+        self._last_edit = time.monotonic()
+
+    async def update(self, text, force=False, reply_markup=None):
+        """Edita el mensaje; las actualizaciones demasiado seguidas se descartan salvo `force`"""
+        if self.message is None or (text == self._text and reply_markup is None):
+            return
+        if not force and time.monotonic() - self._last_edit < self.min_interval:
+            return
+        try:
+            await self.outbox.send(
+                self.chat_id, self.message.edit_text, text, reply_markup=reply_markup, **self._kwargs
+            )
+            self._text = text
+            self._last_edit = time.monotonic()
+        except BadRequest as e:
+            # "Message is not modified" u otros errores al editar: el estado no es crítico
+            logging.warning(f"No se pudo actualizar el mensaje de estado: {e}")
@@ -0,0 +1,262 @@
+"""Registro de aeropuertos, ciudades y países con un índice de prefijos en un fichero mapeado en memoria.
+
+El índice se genera a partir de CSV y se abre con mmap la primera vez que se
+consulta: arrancar el bot no lee el fichero y la memoria residente son solo
+las páginas que tocan las búsquedas, sea cual sea el tamaño del conjunto.
+
+    python places.py data/places.idx data/places.csv [airports.csv de OurAirports]
+
+Formato (enteros little-endian):
+    cabecera   8s magic, I registros, I claves, I offset registros, I offset claves, I offset textos
+    registros  I id, I nombre, I detalle, H orden, B tipo, x   (offsets en la zona de textos)
+    claves     I clave, I registro                              (ordenadas por los bytes de la clave)
+    textos     H longitud + UTF-8
+"""
+import csv
+import logging
+import mmap
+import os
+import struct
+import sys
+import unicodedata
+from collections import namedtuple
+
+MAGIC = b"PLACES01"
+HEADER = struct.Struct("<8sIIIII")
+RECORD = struct.Struct("<IIIHBx")
+KEY = struct.Struct("<II")
+LENGTH = struct.Struct("<H")
+
+KINDS = ("country", "city", "airport")
+KIND_PREFIX = {"country": "Country", "city": "City", "airport": "Airport"}
+KIND_ICON = {"city": "🏙️", "airport": "✈️"}
+# Claves de búsqueda exacta por id de Kiwi; "#" no aparece en los textos normalizados
+ID_KEY_PREFIX = "#"
+# Claves que se recorren como mucho por búsqueda (prefijos muy cortos)
+MAX_SCANNED_KEYS = 500
+
+Place = namedtuple("Place", "id name detail kind")
+
+
+def normalize(text):
+    """Minúsculas sin acentos ni signos: "Málaga-Costa del Sol" -> "malaga costa del sol\""""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c if c.isalnum() else " " for c in text if not unicodedata.combining(c))
+    return " ".join(text.split())
+
+
+def country_flag(code):
+    """Bandera emoji a partir del código ISO de dos letras"""
+    return "".join(chr(0x1F1E6 + ord(c) - ord("A")) for c in code.upper()) if len(code) == 2 else "🌍"
+
+
+def place_label(place):
+    """Texto corto para botones y mensajes: icono, nombre y código"""
+    code = place.id.split(":", 1)[1]
+    if place.kind == "country":
+        return f"{country_flag(code)} {place.name}"
+    if place.kind == "airport":
+        return f"{KIND_ICON['airport']} {place.name} ({code})"
+    return f"{KIND_ICON['city']} {place.name}"
+
+
+class PlaceIndex:
+    """Búsqueda por prefijo de nombre, ciudad o código IATA sobre el índice mapeado en memoria"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._map = None
+
+    @property
+    def available(self):
+        return self._map is not None or os.path.exists(self.path)
+
+    def _open(self):
+        if self._map is None:
+            self._file = open(self.path, "rb")
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, self.records, self.keys, self._records_at, self._keys_at, self._strings_at = \
+                HEADER.unpack_from(self._map, 0)
+            if magic != MAGIC:
+                raise ValueError(f"{self.path} no es un índice de lugares")
+            logging.info(f"Índice de lugares abierto: {self.records} lugares, {self.keys} claves")
+        return self._map
+
+    def _string(self, offset):
+        data = self._map
+        start = self._strings_at + offset
+        (length,) = LENGTH.unpack_from(data, start)
+        return data[start + LENGTH.size:start + LENGTH.size + length]
+
+    def _key(self, i):
+        key_offset, record = KEY.unpack_from(self._map, self._keys_at + i * KEY.size)
+        return self._string(key_offset), record
+
+    def _record(self, i):
+        id_offset, name_offset, detail_offset, order, kind = RECORD.unpack_from(
+            self._map, self._records_at + i * RECORD.size
+        )
+        place = Place(
+            self._string(id_offset).decode("utf-8"), self._string(name_offset).decode("utf-8"),
+            self._string(detail_offset).decode("utf-8"), KINDS[kind]
+        )
+        return place, order
+
+    def _lower_bound(self, prefix):
+        low, high = 0, self.keys
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle)[0] < prefix:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def get(self, place_id):
+        """Lugar con ese id de Kiwi ("Airport:BGY", "City:milan_it", "Country:IT") o None"""
+        if not self.available:
+            return None
+        self._open()
+        wanted = (ID_KEY_PREFIX + place_id.lower()).encode("utf-8")
+        i = self._lower_bound(wanted)
+        if i < self.keys:
+            key, record = self._key(i)
+            if key == wanted:
+                return self._record(record)[0]
+        return None
+
+    def search(self, text, limit=10, kinds=KINDS):
+        """Lugares cuyo nombre, ciudad o código empieza por `text`.
+
+        Primero las coincidencias exactas, después países, ciudades y
+        aeropuertos, y dentro de cada tipo en el orden del CSV (los más
+        relevantes primero).
+        """
+        prefix = normalize(text)
+        if not prefix or not self.available:
+            return []
+        self._open()
+        wanted = prefix.encode("utf-8")
+        candidates = {}
+        i = self._lower_bound(wanted)
+        end = min(self.keys, i + MAX_SCANNED_KEYS)
+        while i < end:
+            key, record = self._key(i)
+            if not key.startswith(wanted):
+                break
+            exact = key == wanted
+            candidates[record] = candidates.get(record, False) or exact
+            i += 1
+
+        ranked = []
+        for record, exact in candidates.items():
+            place, order = self._record(record)
+            if place.kind in kinds:
+                ranked.append((not exact, KINDS.index(place.kind), order, place))
+        ranked.sort(key=lambda item: item[:3])
+        return [place for *_, place in ranked[:limit]]
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._map = None
+
+
+def read_places_csv(path):
+    """Filas del CSV propio: kind, code, name, city, country, aliases (separados por "|")"""
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        return [row for row in csv.DictReader(f) if row.get("kind") in KINDS]
+
+
+def read_ourairports_csv(path):
+    """Aeropuertos con vuelos regulares y código IATA del airports.csv de OurAirports"""
+    sizes = {"large_airport": 0, "medium_airport": 1, "small_airport": 2}
+    rows = []
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            if row["iata_code"] and row["scheduled_service"] == "yes" and row["type"] in sizes:
+                rows.append((sizes[row["type"]], {
+                    "kind": "airport", "code": row["iata_code"], "name": row["name"],
+                    "city": row["municipality"], "country": row["iso_country"], "aliases": ""
+                }))
+    # Los aeropuertos grandes primero: el orden decide la relevancia
+    return [row for _, row in sorted(rows, key=lambda item: item[0])]
+
+
+def build_index(rows, path):
+    """Escribe el índice binario a partir de filas de lugares (las repetidas por id se ignoran)"""
+    countries = {row["code"].upper(): row["name"] for row in rows if row["kind"] == "country"}
+    strings = bytearray()
+    string_offsets = {}
+
+    def add_string(value):
+        data = value.encode("utf-8")[:0xFFFF]
+        offset = string_offsets.get(data)
+        if offset is None:
+            offset = string_offsets[data] = len(strings)
+            strings.extend(LENGTH.pack(len(data)) + data)
+        return offset
+
+    records, keys, seen = [], [], set()
+    for row in rows:
+        kind = row["kind"]
+        code = row["code"].strip()
+        if kind != "city":
+            code = code.upper()
+        place_id = f"{KIND_PREFIX[kind]}:{code}"
+        if place_id in seen:
+            continue
+        seen.add(place_id)
+
+        country_name = countries.get(row["country"].upper(), row["country"].upper())
+        if kind == "airport":
+            detail = f"{row['city']} · {country_name}" if row["city"] else country_name
+        elif kind == "city":
+            detail = country_name
+        else:
+            detail = "País"
+
+        index = len(records)
+        records.append(RECORD.pack(
+            add_string(place_id), add_string(row["name"]), add_string(detail),
+            min(index, 0xFFFF), KINDS.index(kind)
+        ))
+
+        # Cada palabra del nombre, la ciudad y los alias es un punto de entrada ("bergamo" en "Milan Bergamo")
+        terms = {ID_KEY_PREFIX + place_id.lower()}
+        if kind != "city":
+            terms.add(normalize(code))
+        for text in [row["name"], row.get("city", "")] + (row.get("aliases") or "").split("|"):
+            words = normalize(text).split()
+            terms.update(" ".join(words[i:]) for i in range(len(words)))
+        keys.extend((term.encode("utf-8"), index) for term in terms if term)
+
+    keys.sort()
+    key_table = b"".join(KEY.pack(add_string(term.decode("utf-8")), index) for term, index in keys)
+    record_table = b"".join(records)
+
+    records_at = HEADER.size
+    keys_at = records_at + len(record_table)
+    strings_at = keys_at + len(key_table)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(records), len(keys), records_at, keys_at, strings_at))
+        f.write(record_table)
+        f.write(key_table)
+        f.write(strings)
+    os.replace(tmp_path, path)
+    return len(records), len(keys)
+
+
+if __name__ == "__main__":
+    # Construye el índice a partir del CSV propio y, opcionalmente, del airports.csv de OurAirports
+    output, sources = sys.argv[1], sys.argv[2:]
+    rows = []
+    for source in sources:
+        with open(source, "r", encoding="utf-8") as f:
+            header = f.readline()
+        rows.extend(read_ourairports_csv(source) if "iata_code" in header else read_places_csv(source))
+    places, keys = build_index(rows, output)
+    print(f"{output}: {places} lugares, {keys} claves, {os.path.getsize(output) / 1024:.0f} KiB")
@@ -0,0 +1,381 @@
+"""Preferencias de destinos por usuario en SQLite"""
+import asyncio
+import logging
+import sqlite3
+import time
+from collections import Counter
+
+# Perfil común que guardaban versiones anteriores: se reparte entre los usuarios que ya existían
+LEGACY_SHARED_PROFILE = 0
+# Ids de lugar de Kiwi que un usuario puede añadir además de la configuración maestra
+PLACE_ID_PREFIXES = ("Country:", "City:", "Airport:")
+
+
+def is_place_id(code):
+    return isinstance(code, str) and code.startswith(PLACE_ID_PREFIXES) and len(code.split(":", 1)[1]) > 0
+
+
+class PreferencesStore:
+    """Destinos activos de cada usuario en una tabla indexada por (user_id, destination).
+
+    Todos los usuarios parten de los valores por defecto de la configuración
+    maestra y solo se guardan las filas que cambian, así que cada toggle es
+    una sola fila. Los usuarios que ya existían al migrar destinations.json
+    reciben esa configuración como propia. Cada usuario tiene un número de
+    versión que cambia con cada modificación.
+
+    La configuración y la versión de cada usuario se sirven desde memoria una
+    vez leídas. Solo se vuelven a leer cuando otro proceso cambia alguna
+    preferencia: si `PRAGMA data_version` indica que alguien ha escrito en la
+    base de datos (que comparten otros almacenes), se compara además el
+    contador `generation` que sube con cada escritura de preferencias.
+
+    Las escrituras son diferidas: cada cambio actualiza la memoria al instante y
+    programa un volcado tras `flush_delay` segundos sin cambios, de modo que una
+    ráfaga de toggles produce una sola transacción. Hasta entonces los demás
+    procesos ven la configuración anterior. `flush` vuelca lo pendiente al
+    momento (al apagar) y sin event loop en marcha se escribe siempre al momento.
+
+    Además de los países de la configuración maestra, cada usuario puede añadir
+    cualquier aeropuerto, ciudad o país (`add`) y elegir su propio origen.
+    """
+
+    def __init__(self, path, master, flush_delay=0.0):
+        self.path = path
+        self.master = master
+        self.flush_delay = flush_delay
+        self.changes = 0
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS destination_prefs ("
+            " user_id INTEGER NOT NULL, destination TEXT NOT NULL, active INTEGER NOT NULL,"
+            " PRIMARY KEY (user_id, destination)) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS preference_versions ("
+            " user_id INTEGER PRIMARY KEY, version INTEGER NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);"
+            "CREATE TABLE IF NOT EXISTS user_origins ("
+            " user_id INTEGER PRIMARY KEY, source TEXT NOT NULL);"
+        )
+        self._db.commit()
+        # user_id -> (versión, configuración)
+        self._entries = {}
+        self._data_version = self._db.execute("PRAGMA data_version").fetchone()[0]
+        self._generation = self._read_generation()
+        self.hits = 0
+        self.loads = 0
+        self.reloads = 0
+
+        # Cambios pendientes de volcar: user_id -> (restablecer, {código: activo})
+        self._pending = {}
+        self._pending_changes = 0
+        self._flush_handle = None
+        self.flushes = 0
+        self.coalesced = 0
+        self.last_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    def defaults(self):
+        """Configuración por defecto según la configuración maestra"""
+        return {code: config["default"] for code, config in self.master.items()}
+
+    def migrate_from_json(self, legacy_config, user_ids):
+        """Importa una sola vez la configuración común de destinations.json para los usuarios `user_ids`.
+
+        Solo la reciben los usuarios que ya existían y aún no tienen preferencias
+        propias; los que lleguen después parten de los valores por defecto.
+        `legacy_config` puede ser None si no hay archivo que migrar.
+        """
+        user_ids = [user_id for user_id in user_ids if user_id != LEGACY_SHARED_PROFILE]
+        with self._db:
+            # Perfil común guardado por versiones anteriores del almacén
+            shared = dict(self._db.execute(
+                "SELECT destination, active FROM destination_prefs WHERE user_id = ?", (LEGACY_SHARED_PROFILE,)
+            ))
+            if shared:
+                self._adopt(user_ids, {code: bool(active) for code, active in shared.items() if code in self.master})
+                self._db.execute("DELETE FROM destination_prefs WHERE user_id = ?", (LEGACY_SHARED_PROFILE,))
+                self._db.execute("DELETE FROM preference_versions WHERE user_id = ?", (LEGACY_SHARED_PROFILE,))
+            if legacy_config is None or self._db.execute(
+                "SELECT 1 FROM meta WHERE key = 'destinations_json_migrated'"
+            ).fetchone():
+                return False
+            adopted = self._adopt(user_ids, legacy_config)
+            self._db.execute("INSERT INTO meta (key, value) VALUES ('destinations_json_migrated', '1')")
+        logging.info(
+            f"destinations.json migrado a {self.path}: {sum(1 for active in legacy_config.values() if active)} "
+            f"destinos activos para {adopted} usuarios"
+        )
+        return True
+
+    def _adopt(self, user_ids, config):
+        """Guarda `config` como preferencias de los usuarios que aún no tienen propias"""
+        adopted = 0
+        for user_id in user_ids:
+            if not self._has_own(user_id):
+                self._write_config(user_id, config)
+                self._bump_version(user_id)
+                adopted += 1
+        return adopted
+
+    def _has_own(self, user_id):
+        return self._db.execute(
+            "SELECT 1 FROM preference_versions WHERE user_id = ?", (user_id,)
+        ).fetchone() is not None
+
+    def _entry(self, user_id):
+        """Versión y configuración del usuario, desde memoria salvo que otro proceso haya escrito"""
+        data_version = self._db.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self._data_version:
+            self._data_version = data_version
+            generation = self._read_generation()
+            if generation != self._generation:
+                self._generation = generation
+                self._forget_entries()
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            self.hits += 1
+            return entry
+
+        self.loads += 1
+        config = self.defaults()
+        for code, active in self._db.execute(
+            "SELECT destination, active FROM destination_prefs WHERE user_id = ?", (user_id,)
+        ):
+            if code in config or is_place_id(code):
+                config[code] = bool(active)
+        row = self._db.execute("SELECT version FROM preference_versions WHERE user_id = ?", (user_id,)).fetchone()
+        entry = self._entries[user_id] = (row[0] if row else 0, config)
+        return entry
+
+    def get(self, user_id):
+        """Configuración efectiva del usuario (código -> activo): la maestra en su orden y después los lugares añadidos"""
+        return dict(self._entry(user_id)[1])
+
+    def version(self, user_id):
+        """Versión de las preferencias del usuario (0 si nunca las ha cambiado)"""
+        return self._entry(user_id)[0]
+
+    def _read_generation(self):
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'preferences_generation'").fetchone()
+        return int(row[0]) if row else 0
+
+    def _forget_entries(self):
+        """Descarta lo leído por cambios de otro proceso; los cambios propios aún sin volcar mandan"""
+        self._entries = {user_id: entry for user_id, entry in self._entries.items() if user_id in self._pending}
+        self.reloads += 1
+
+    def _bump_generation(self):
+        row = self._db.execute(
+            "INSERT INTO meta (key, value) VALUES ('preferences_generation', '1') "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1 RETURNING value"
+        ).fetchone()
+        generation = int(row[0])
+        if generation != self._generation + 1:
+            # Otro proceso cambió preferencias desde la última comprobación
+            self._forget_entries()
+        self._generation = generation
+
+    def _bump_version(self, user_id):
+        # Se vuelve a leer tras la escritura (que no cambia el data_version de esta conexión)
+        self._entries.pop(user_id, None)
+        self._bump_generation()
+        self._db.execute(
+            "INSERT INTO preference_versions (user_id, version) VALUES (?, 1) "
+            "ON CONFLICT(user_id) DO UPDATE SET version = version + 1",
+            (user_id,)
+        )
+
+    def _write_config(self, user_id, config):
+        rows = []
+        for code, active in config.items():
+            if code not in self.master and not is_place_id(code):
+                logging.warning(f"Ignorando destino no válido: {code}")
+                continue
+            if not isinstance(active, bool):
+                logging.warning(f"Convirtiendo valor no booleano a False para {code}")
+                active = False
+            rows.append((user_id, code, int(active)))
+        self._db.executemany(
+            "INSERT INTO destination_prefs (user_id, destination, active) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_id, destination) DO UPDATE SET active = excluded.active",
+            rows
+        )
+
+    def _change(self, user_id, codes, reset=False):
+        """Aplica un cambio en memoria y programa su volcado; con `reset` se parte de los valores por defecto"""
+        version, config = self._entry(user_id)
+        config = self.defaults() if reset else dict(config)
+        config.update(codes)
+        self._entries[user_id] = (version + 1, config)
+        pending_reset, pending_codes = self._pending.get(user_id, (False, {}))
+        if reset:
+            pending_reset, pending_codes = True, {}
+        self._pending[user_id] = (pending_reset, {**pending_codes, **codes})
+        self._pending_changes += 1
+        self.changes += 1
+        return self._schedule_flush()
+
+    def save(self, user_id, config):
+        """Guarda la configuración completa del usuario"""
+        if not isinstance(config, dict):
+            logging.error(f"Intento de guardar preferencias no válidas para el usuario {user_id}")
+            return False
+        codes = {}
+        for code, active in config.items():
+            if code not in self.master and not is_place_id(code):
+                logging.warning(f"Ignorando destino no válido: {code}")
+                continue
+            if not isinstance(active, bool):
+                logging.warning(f"Convirtiendo valor no booleano a False para {code}")
+                active = False
+            codes[code] = active
+        return self._change(user_id, codes)
+
+    def toggle(self, user_id, code):
+        """Activa o desactiva un destino y devuelve su nuevo estado (None si no existe)"""
+        config = self.get(user_id)
+        if code not in config:
+            return None
+        active = not config[code]
+        self._change(user_id, {code: active})
+        return active
+
+    def add(self, user_id, code):
+        """Añade (o reactiva) un lugar como destino activo del usuario"""
+        if code not in self.master and not is_place_id(code):
+            return False
+        return self._change(user_id, {code: True})
+
+    def set_all(self, user_id, active):
+        """Activa o desactiva todos los destinos del usuario"""
+        return self.save(user_id, {code: active for code in self.get(user_id)})
+
+    def reset(self, user_id):
+        """Vuelve a los valores por defecto de la configuración maestra (el mismo punto de partida
+        que `get`) y quita los lugares añadidos; se vuelca en una sola transacción
+        """
+        return self._change(user_id, {}, reset=True)
+
+    @property
+    def dirty(self):
+        """Indica si hay cambios en memoria pendientes de escribir"""
+        return bool(self._pending)
+
+    def _schedule_flush(self):
+        """Reprograma el volcado; sin event loop en marcha se escribe al momento"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+
+        if loop is None or self.flush_delay <= 0:
+            return self.flush()
+
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        self._flush_handle = loop.call_later(self.flush_delay, self.flush)
+        return True
+
+    def flush(self):
+        """Escribe ya los cambios pendientes de todos los usuarios en una sola transacción"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending:
+            return True
+
+        start = time.perf_counter()
+        pending = self._pending
+        try:
+            with self._db:
+                for user_id, (reset, codes) in pending.items():
+                    if reset:
+                        self._db.execute("DELETE FROM destination_prefs WHERE user_id = ?", (user_id,))
+                    self._write_config(user_id, codes)
+                    # La versión guardada es la que ya se ha servido desde memoria
+                    self._db.execute(
+                        "INSERT INTO preference_versions (user_id, version) VALUES (?, ?) "
+                        "ON CONFLICT(user_id) DO UPDATE SET version = MAX(excluded.version, version + 1)",
+                        (user_id, self._entries[user_id][0])
+                    )
+                self._bump_generation()
+        except sqlite3.Error as e:
+            # Los cambios siguen pendientes: se reintentan en el próximo volcado
+            logging.error(f"Error al guardar las preferencias de {len(pending)} usuarios: {e}")
+            return False
+
+        self._pending = {}
+        for user_id in pending:
+            self._entries.pop(user_id, None)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.coalesced += self._pending_changes - 1
+        self._pending_changes = 0
+        self.flushes += 1
+        self.last_flush_ms = elapsed_ms
+        self.total_flush_ms += elapsed_ms
+        logging.info(f"Preferencias guardadas: {len(pending)} usuarios ({elapsed_ms:.1f} ms)")
+        return True
+
+    def get_origin(self, user_id):
+        """Origen propio del usuario (p. ej. "Airport:VLC") o None si usa el predeterminado"""
+        row = self._db.execute("SELECT source FROM user_origins WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def set_origin(self, user_id, source):
+        """Fija el origen del usuario; None vuelve al predeterminado"""
+        try:
+            with self._db:
+                if source is None:
+                    self._db.execute("DELETE FROM user_origins WHERE user_id = ?", (user_id,))
+                else:
+                    self._db.execute(
+                        "INSERT INTO user_origins (user_id, source) VALUES (?, ?) "
+                        "ON CONFLICT(user_id) DO UPDATE SET source = excluded.source",
+                        (user_id, source)
+                    )
+            self.changes += 1
+            return True
+        except sqlite3.Error as e:
+            logging.error(f"Error al guardar el origen del usuario {user_id}: {e}")
+            return False
+
+    def selection_counts(self):
+        """Cuántos usuarios comparten cada (origen, selección de destinos activos), para la precarga.
+
+        El origen es None para quien usa el predeterminado.
+        """
+        origins = dict(self._db.execute("SELECT user_id, source FROM user_origins"))
+        configs = {}
+        for user_id, code, active in self._db.execute("SELECT user_id, destination, active FROM destination_prefs"):
+            if code in self.master or is_place_id(code):
+                configs.setdefault(user_id, self.defaults())[code] = bool(active)
+        counts = Counter(
+            (origins.get(user_id), tuple(sorted(code for code, active in config.items() if active)))
+            for user_id, config in configs.items()
+        )
+        # La configuración por defecto cuenta como un usuario más (el de todos los que no la han
+        # cambiado), y también por cada origen propio de usuarios sin destinos propios
+        default = tuple(sorted(code for code, active in self.defaults().items() if active))
+        if default:
+            counts[(None, default)] += 1
+            for user_id, source in origins.items():
+                if user_id not in configs:
+                    counts[(source, default)] += 1
+        return counts
+
+    def stats(self):
+        """Usuarios con preferencias propias y cambios realizados desde el arranque"""
+        users = self._db.execute("SELECT COUNT(*) FROM preference_versions").fetchone()[0]
+        return {
+            "users": users, "changes": self.changes, "cached": len(self._entries),
+            "hits": self.hits, "loads": self.loads, "reloads": self.reloads,
+            "flushes": self.flushes, "coalesced": self.coalesced, "pending": self.dirty,
+            "last_flush_ms": self.last_flush_ms,
+            "avg_flush_ms": self.total_flush_ms / self.flushes if self.flushes else 0.0
+        }
+
+    def close(self):
+        self.flush()
+        self._db.close()
@@ -0,0 +1,122 @@
+"""Precarga de la caché en horas valle según el historial de búsquedas"""
+import logging
+import sqlite3
+import time
+from datetime import datetime
+
+
+def parse_hours(value):
+    """Convierte rangos de horas como "2-6" o "1,3-5" en un conjunto {2, 3, 4, 5, 6}"""
+    hours = set()
+    for part in filter(None, (p.strip() for p in value.split(","))):
+        start, _, end = part.partition("-")
+        end = end or start
+        start, end = int(start), int(end)
+        # Rangos que cruzan la medianoche, p. ej. "23-4"
+        span = range(start, end + 1) if start <= end else list(range(start, 24)) + list(range(0, end + 1))
+        hours.update(h % 24 for h in span)
+    return hours
+
+
+def upcoming_months(today, count):
+    """Los próximos `count` meses, incluido el actual, como pares (mes, año)"""
+    months = []
+    month, year = today.month, today.year
+    for _ in range(count):
+        months.append((month, year))
+        month += 1
+        if month > 12:
+            month, year = 1, year + 1
+    return months
+
+
+class SearchHistory:
+    """Historial de meses buscados, usado para priorizar qué precargar"""
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS search_history ("
+            " month INTEGER NOT NULL, year INTEGER NOT NULL, searched_at REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS idx_search_history_time ON search_history(searched_at);"
+        )
+        self._db.commit()
+
+    def record(self, month, year):
+        """Registra una búsqueda interactiva de un mes"""
+        try:
+            self._db.execute(
+                "INSERT INTO search_history (month, year, searched_at) VALUES (?, ?, ?)",
+                (month, year, time.time())
+            )
+            self._db.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Error registrando la búsqueda {month}/{year}: {e}")
+
+    def popularity(self, days=30):
+        """Búsquedas por (mes, año) en los últimos `days` días"""
+        cutoff = time.time() - days * 86400
+        # El historial antiguo ya no aporta nada
+        self._db.execute("DELETE FROM search_history WHERE searched_at < ?", (cutoff,))
+        self._db.commit()
+        return {
+            (month, year): count
+            for month, year, count in self._db.execute(
+                "SELECT month, year, COUNT(*) FROM search_history GROUP BY year, month"
+            )
+        }
+
+    def close(self):
+        self._db.close()
+
+
+def prioritize_months(today, months_ahead, popularity, watched=()):
+    """Ordena los meses a precargar: primero los más buscados o vigilados, después los más próximos.
+
+    Incluye los próximos `months_ahead` meses y cualquier mes futuro con demanda.
+    """
+    current = (today.year, today.month)
+    candidates = set(upcoming_months(today, months_ahead))
+    candidates.update(m for m in popularity if (m[1], m[0]) >= current)
+    candidates.update(m for m in watched if (m[1], m[0]) >= current)
+
+    def score(month_year):
+        demand = popularity.get(month_year, 0) + sum(1 for w in watched if w == month_year)
+        distance = (month_year[1] - today.year) * 12 + month_year[0] - today.month
+        return (-demand, distance)
+
+    return sorted(candidates, key=score)
+
+
+class PrewarmBudget:
+    """Llamadas diarias que la precarga puede gastar: una fracción de la cuota mensual
+    repartida por días o, si la cuota no se conoce, un máximo fijo"""
+
+    def __init__(self, share=0.2, max_calls_per_day=50):
+        self.share = share
+        self.max_calls_per_day = max_calls_per_day
+        self._day = None
+        self.spent_today = 0
+        self.total_calls = 0
+
+    def allowance(self, monthly_limit, remaining):
+        """Llamadas que aún se pueden hacer hoy"""
+        today = datetime.now().date()
+        if today != self._day:
+            self._day = today
+            self.spent_today = 0
+
+        if monthly_limit:
+            daily = int(monthly_limit * self.share / 30)
+        else:
+            daily = self.max_calls_per_day
+        allowance = daily - self.spent_today
+        if remaining is not None:
+            # Nunca más de la fracción configurada de lo que queda este mes
+            allowance = min(allowance, int(remaining * self.share))
+        return max(0, allowance)
+
+    def spend(self, calls):
+        self.spent_today += calls
+        self.total_calls += calls
@@ -0,0 +1,134 @@
+"""Suscripciones /watch: vigilancia periódica de precios con avisos incrementales"""
+import logging
+import sqlite3
+import time
+
+
+def itinerary_key(itinerary):
+    """Clave de texto estable de un itinerario para guardarlo entre ciclos"""
+    return "|".join((
+        itinerary.origin, itinerary.destination,
+        itinerary.outbound_time.strftime("%Y-%m-%dT%H:%M"),
+        itinerary.inbound_time.strftime("%Y-%m-%dT%H:%M"),
+        itinerary.outbound_carrier, itinerary.inbound_carrier
+    ))
+
+
+def diff_itineraries(previous, current, drop_percent):
+    """Compara los itinerarios actuales con los ya vistos.
+
+    `previous` es un diccionario clave -> precio. Devuelve los itinerarios
+    nuevos y las bajadas de precio de al menos `drop_percent` %, estas como
+    pares (itinerario, precio anterior).
+    """
+    new, drops = [], []
+    for itinerary in current:
+        old_price = previous.get(itinerary_key(itinerary))
+        if old_price is None:
+            new.append(itinerary)
+        elif itinerary.price <= old_price * (1 - drop_percent / 100):
+            drops.append((itinerary, old_price))
+    return new, drops
+
+
+class WatchStore:
+    """Suscripciones y últimos itinerarios vistos, persistidos en SQLite"""
+
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS watches ("
+            " chat_id INTEGER NOT NULL, month INTEGER NOT NULL, year INTEGER NOT NULL,"
+            " created_at REAL NOT NULL, initialized INTEGER NOT NULL DEFAULT 0, user_id INTEGER,"
+            " PRIMARY KEY (chat_id, month, year));"
+            "CREATE INDEX IF NOT EXISTS idx_watches_month ON watches(year, month);"
+            "CREATE TABLE IF NOT EXISTS watch_seen ("
+            " chat_id INTEGER NOT NULL, month INTEGER NOT NULL, year INTEGER NOT NULL,"
+            " itinerary_key TEXT NOT NULL, price REAL NOT NULL, seen_at REAL NOT NULL DEFAULT 0,"
+            " PRIMARY KEY (chat_id, month, year, itinerary_key));"
+        )
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(watches)")]
+        if "user_id" not in columns:
+            # Suscripciones anteriores a las preferencias por usuario: en privado chat_id == user_id
+            self._db.execute("ALTER TABLE watches ADD COLUMN user_id INTEGER")
+            self._db.execute("UPDATE watches SET user_id = chat_id")
+        seen_columns = [row[1] for row in self._db.execute("PRAGMA table_info(watch_seen)")]
+        if "seen_at" not in seen_columns:
+            # Vistos antes de que caducaran: cuentan como vistos ahora
+            self._db.execute("ALTER TABLE watch_seen ADD COLUMN seen_at REAL NOT NULL DEFAULT 0")
+            self._db.execute("UPDATE watch_seen SET seen_at = ?", (time.time(),))
+        self._db.commit()
+
+    def add(self, chat_id, month, year, user_id):
+        """Crea la suscripción con los destinos de `user_id`; devuelve False si ya existía"""
+        cursor = self._db.execute(
+            "INSERT OR IGNORE INTO watches (chat_id, month, year, created_at, user_id) VALUES (?, ?, ?, ?, ?)",
+            (chat_id, month, year, time.time(), user_id)
+        )
+        self._db.commit()
+        return cursor.rowcount > 0
+
+    def remove(self, chat_id, month, year):
+        """Elimina la suscripción y su estado; devuelve False si no existía"""
+        cursor = self._db.execute(
+            "DELETE FROM watches WHERE chat_id = ? AND month = ? AND year = ?", (chat_id, month, year)
+        )
+        self._db.execute(
+            "DELETE FROM watch_seen WHERE chat_id = ? AND month = ? AND year = ?", (chat_id, month, year)
+        )
+        self._db.commit()
+        return cursor.rowcount > 0
+
+    def for_chat(self, chat_id):
+        """Meses vigilados por un chat como pares (mes, año)"""
+        return self._db.execute(
+            "SELECT month, year FROM watches WHERE chat_id = ? ORDER BY year, month", (chat_id,)
+        ).fetchall()
+
+    def grouped(self):
+        """Suscripciones agrupadas por (mes, año): {(mes, año): [(chat_id, user_id, initialized), ...]}"""
+        groups = {}
+        for chat_id, user_id, month, year, initialized in self._db.execute(
+            "SELECT chat_id, user_id, month, year, initialized FROM watches ORDER BY year, month"
+        ):
+            groups.setdefault((month, year), []).append((chat_id, user_id, bool(initialized)))
+        return groups
+
+    def seen(self, chat_id, month, year):
+        """Itinerarios vistos y aún no caducados: {clave: último precio visto}"""
+        return dict(self._db.execute(
+            "SELECT itinerary_key, price FROM watch_seen WHERE chat_id = ? AND month = ? AND year = ?",
+            (chat_id, month, year)
+        ))
+
+    def merge_seen(self, chat_id, month, year, itineraries, ttl):
+        """Añade los itinerarios del ciclo actual a los vistos y marca la suscripción como iniciada.
+
+        Los que ya estaban actualizan su precio y su momento; los que llevan
+        más de `ttl` segundos sin aparecer se olvidan. Así un itinerario que
+        sale del top y vuelve a entrar no se avisa otra vez como nuevo.
+        """
+        now = time.time()
+        try:
+            with self._db:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO watch_seen (chat_id, month, year, itinerary_key, price, seen_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(chat_id, month, year, itinerary_key(it), it.price, now) for it in itineraries]
+                )
+                self._db.execute(
+                    "DELETE FROM watch_seen WHERE chat_id = ? AND month = ? AND year = ? AND seen_at < ?",
+                    (chat_id, month, year, now - ttl)
+                )
+                self._db.execute(
+                    "UPDATE watches SET initialized = 1 WHERE chat_id = ? AND month = ? AND year = ?",
+                    (chat_id, month, year)
+                )
+        except sqlite3.Error as e:
+            logging.error(f"Error guardando el estado de la vigilancia {month}/{year} del chat {chat_id}: {e}")
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,114 @@
+"""Planificador de consultas: agrupa ventanas de fechas en el mínimo de llamadas a la API"""
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+
+@dataclass(frozen=True)
+class SearchWindow:
+    """Ventana de salida y de vuelta de un viaje (p. ej. un fin de semana)"""
+    outbound_start: object
+    outbound_end: object
+    inbound_start: object
+    inbound_end: object
+
+
+@dataclass
+class PlannedCall:
+    """Una llamada a /round-trip que cubre una o varias ventanas"""
+    windows: list = field(default_factory=list)
+    limit: int = 5
+
+    @property
+    def outbound_start(self):
+        return min(w.outbound_start for w in self.windows)
+
+    @property
+    def outbound_end(self):
+        return max(w.outbound_end for w in self.windows)
+
+    @property
+    def inbound_start(self):
+        return min(w.inbound_start for w in self.windows)
+
+    @property
+    def inbound_end(self):
+        return max(w.inbound_end for w in self.windows)
+
+    def split(self, itineraries, window_limit):
+        """Reparte los itinerarios ya parseados de la respuesta entre las ventanas según sus horas.
+
+        Devuelve un diccionario ventana -> lista de itinerarios, como mucho
+        `window_limit` por ventana y en el orden de la respuesta.
+        """
+        buckets = {w: [] for w in self.windows}
+        for itinerary in itineraries:
+            # Con ventanas solapadas un itinerario puede servir a varias
+            for window, items in buckets.items():
+                if (window.outbound_start <= itinerary.outbound_time <= window.outbound_end
+                        and window.inbound_start <= itinerary.inbound_time <= window.inbound_end):
+                    if len(items) < window_limit:
+                        items.append(itinerary)
+        return buckets
+
+
+class QueryPlanner:
+    """Calcula el mínimo de llamadas para cubrir un conjunto de ventanas.
+
+    Las ventanas repetidas o solapadas (varios meses, varios usuarios) siempre
+    se agrupan. Con `max_gap_days` > 0 también se unen ventanas separadas por
+    huecos de hasta ese número de días, siempre que la llamada resultante no
+    abarque más de `max_span_days` ni más de `max_windows` ventanas (0 = sin
+    límite). Una ventana más ancha devuelve también itinerarios fuera de los
+    horarios pedidos, que se descartan al repartir; por eso su `limit` se
+    multiplica por `oversample`.
+    """
+
+    def __init__(self, window_limit=5, max_gap_days=0, max_span_days=31, oversample=3, max_limit=100, max_windows=0):
+        self.window_limit = window_limit
+        self.max_windows = max_windows
+        self.max_gap = timedelta(days=max_gap_days)
+        self.max_span = timedelta(days=max_span_days)
+        self.oversample = oversample
+        self.max_limit = max_limit
+        self.naive_calls = 0
+        self.planned_calls = 0
+
+    def _fits(self, call, window):
+        if self.max_windows and len(call.windows) >= self.max_windows:
+            return False
+        if window.outbound_start - call.outbound_end > self.max_gap:
+            return False
+        if window.inbound_start - call.inbound_end > self.max_gap:
+            return False
+        span = max(call.inbound_end, window.inbound_end) - min(call.outbound_start, window.outbound_start)
+        return span <= self.max_span
+
+    def plan(self, windows):
+        """Devuelve la lista de llamadas que cubre todas las ventanas"""
+        unique = sorted(set(windows), key=lambda w: (w.outbound_start, w.inbound_start))
+        calls = []
+        for window in unique:
+            if calls and self._fits(calls[-1], window):
+                calls[-1].windows.append(window)
+            else:
+                calls.append(PlannedCall(windows=[window]))
+
+        for call in calls:
+            if len(call.windows) > 1:
+                call.limit = min(self.max_limit, self.window_limit * len(call.windows) * self.oversample)
+            else:
+                call.limit = self.window_limit
+
+        self.naive_calls += len(windows)
+        self.planned_calls += len(calls)
+        return calls
+
+    def stats(self):
+        """Llamadas planificadas frente a una llamada por ventana"""
+        saved = self.naive_calls - self.planned_calls
+        return {
+            "naive_calls": self.naive_calls,
+            "planned_calls": self.planned_calls,
+            "saved_calls": saved,
+            "saved_ratio": saved / self.naive_calls if self.naive_calls else 0.0
+        }
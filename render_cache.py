@@ -0,0 +1,45 @@
+"""Caché de textos y teclados ya renderizados, invalidada por versión"""
+from collections import OrderedDict
+
+
+class RenderCache:
+    """Memoriza el resultado de una función de renderizado por clave y versión.
+
+    Cada clave (p. ej. ("destinations", user_id)) guarda una sola versión: si
+    se pide con otra (el usuario ha cambiado sus destinos) la entrada anterior
+    se descarta y se vuelve a renderizar. Al superar `max_entries` se expulsan
+    las claves usadas hace más tiempo.
+    """
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self._entries = OrderedDict()
+
+    def get(self, key, version, render):
+        """Valor renderizado para `key` en `version`; llama a `render()` solo si no está en caché"""
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == version:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[1]
+
+        if entry is not None:
+            self.invalidated += 1
+        self.misses += 1
+        value = render()
+        self._entries[key] = (version, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return value
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries), "max_entries": self.max_entries,
+            "hits": self.hits, "misses": self.misses, "invalidated": self.invalidated,
+            "hit_ratio": self.hits / total if total else 0.0
+        }
@@ -0,0 +1,229 @@
+"""Decodificación incremental de las respuestas de /round-trip, fuera del event loop.
+
+La respuesta de Kiwi trae por cada itinerario árboles enteros de segmentos,
+estaciones y opciones de reserva de los que el bot solo usa unos pocos campos.
+`ItineraryStream` recibe los bytes a medida que llegan, decodifica los
+itinerarios de uno en uno y se queda solo con esos campos (con la misma forma
+que en la API, para que `Itinerary.from_api`, la caché y el planificador no
+cambien). Nunca existe en memoria el árbol completo de la respuesta; a cambio
+cuesta algo más de CPU que `json.loads` (un 20-45 % con 500 itinerarios).
+
+`ParserPool` ejecuta ese trabajo en un pool de hilos (cada trozo según llega,
+sin bloquear el event loop) o de procesos (el cuerpo completo en otro
+intérprete, sin competir por el GIL con el bot).
+"""
+import asyncio
+import codecs
+import json
+import logging
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+PARSER_MODES = ("inline", "thread", "process")
+# Texto que se conserva mientras se busca el array de itinerarios
+KEY_TAIL = 64
+ITINERARIES_KEY = re.compile(r'"itineraries"\s*:\s*\[')
+SEPARATORS = re.compile(r"[\s,]*")
+CHUNK_SIZE = 65536
+
+
+def slim_station(station):
+    """Nombre, código y país de una estación"""
+    slim = {"name": station["name"], "code": station.get("code", "")}
+    country = station.get("country") or (station.get("city") or {}).get("country")
+    if country:
+        slim["country"] = {"code": country.get("code", "")}
+    return slim
+
+
+def slim_itinerary(itinerary):
+    """Itinerario de la API reducido a los campos que leen `Itinerary.from_api` y el planificador.
+
+    De cada trayecto solo se usa el primer segmento; de la vuelta, su hora y su aerolínea.
+    """
+    outbound = itinerary["outbound"]["sectorSegments"][0]["segment"]
+    inbound = itinerary["inbound"]["sectorSegments"][0]["segment"]
+    edges = (itinerary.get("bookingOptions") or {}).get("edges") or []
+    return {
+        "price": {"amount": itinerary["price"]["amount"]},
+        "outbound": {"sectorSegments": [{"segment": {
+            "source": {"localTime": outbound["source"]["localTime"], "station": slim_station(outbound["source"]["station"])},
+            "destination": {"station": slim_station(outbound["destination"]["station"])},
+            "carrier": {"name": outbound["carrier"]["name"]}
+        }}]},
+        "inbound": {"sectorSegments": [{"segment": {
+            "source": {"localTime": inbound["source"]["localTime"]},
+            "carrier": {"name": inbound["carrier"]["name"]}
+        }}]},
+        "bookingOptions": {"edges": [{"node": {"bookingUrl": edges[0]["node"]["bookingUrl"]}}] if edges else []}
+    }
+
+
+class ItineraryStream:
+    """Extrae los itinerarios de una respuesta de /round-trip a partir de sus bytes, trozo a trozo.
+
+    `feed` devuelve los itinerarios (ya reducidos) que se han completado con
+    ese trozo y `close` los que queden, o ValueError si la respuesta está
+    truncada o no es JSON válido. Solo se guarda el texto del itinerario a
+    medio llegar: `peak_buffer` es el máximo de caracteres retenidos a la vez.
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self._buffer = ""
+        self._position = 0
+        self._started = False
+        self._in_array = False
+        self.done = False
+        self.items = 0
+        self.skipped = 0
+        self.bytes = 0
+        self.peak_buffer = 0
+        self.seconds = 0.0
+
+    def feed(self, chunk, final=False):
+        started = time.perf_counter()
+        self.bytes += len(chunk)
+        text = self._decoder.decode(chunk, final)
+        if not self._started and text.strip():
+            if not text.lstrip().startswith("{"):
+                raise ValueError("la respuesta no es un objeto JSON")
+            self._started = True
+        self._buffer = self._buffer[self._position:] + text
+        self._position = 0
+        self.peak_buffer = max(self.peak_buffer, len(self._buffer))
+        itineraries = self._extract()
+        self.seconds += time.perf_counter() - started
+        return itineraries
+
+    def close(self):
+        """Procesa lo pendiente; la respuesta tiene que haber terminado su array de itinerarios"""
+        itineraries = self.feed(b"", final=True)
+        if not self._started:
+            raise ValueError("respuesta vacía")
+        # Sin array de itinerarios (p. ej. "itineraries": null) no hay resultados, como antes
+        if self._in_array and not self.done:
+            raise ValueError(f"respuesta truncada tras {self.items} itinerarios")
+        if self.skipped:
+            logging.warning(f"Respuesta de la API: {self.skipped} itinerarios descartados por campos que faltan")
+        return itineraries
+
+    def _extract(self):
+        itineraries = []
+        if self.done:
+            return itineraries
+        if not self._in_array:
+            match = ITINERARIES_KEY.search(self._buffer)
+            if match is None:
+                # La clave puede estar partida entre dos trozos
+                self._buffer = self._buffer[-KEY_TAIL:]
+                self._position = 0
+                return itineraries
+            self._in_array = True
+            self._buffer = self._buffer[match.end():]
+            self._position = 0
+
+        buffer = self._buffer
+        position = self._position
+        while True:
+            position = SEPARATORS.match(buffer, position).end()
+            if position >= len(buffer):
+                break
+            if buffer[position] == "]":
+                self.done = True
+                position += 1
+                break
+            try:
+                itinerary, end = self._json.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # Lo normal es que el itinerario aún no haya llegado entero
+                break
+            position = end
+            self.items += 1
+            try:
+                itineraries.append(slim_itinerary(itinerary))
+            except (KeyError, IndexError, TypeError, AttributeError):
+                self.skipped += 1
+        self._position = position
+        return itineraries
+
+    def stats(self):
+        return {
+            "bytes": self.bytes, "itineraries": self.items, "skipped": self.skipped,
+            "peak_buffer": self.peak_buffer, "seconds": self.seconds
+        }
+
+
+def parse_response(body, chunk_size=CHUNK_SIZE):
+    """Respuesta reducida ({"itineraries": [...]}) y estadísticas a partir del cuerpo completo"""
+    stream = ItineraryStream()
+    itineraries = []
+    view = memoryview(body)
+    for start in range(0, len(view), chunk_size):
+        itineraries.extend(stream.feed(bytes(view[start:start + chunk_size])))
+    itineraries.extend(stream.close())
+    return {"itineraries": itineraries}, stream.stats()
+
+
+class ParserPool:
+    """Ejecuta la decodificación de las respuestas fuera del event loop.
+
+    - "thread": cada trozo recibido se procesa en un hilo del pool
+    - "process": el cuerpo completo se procesa en otro proceso (evita el GIL)
+    - "inline": en el event loop, pero igualmente de forma incremental
+    """
+
+    def __init__(self, mode="thread", workers=2):
+        if mode not in PARSER_MODES:
+            raise ValueError(f"Modo de parseo no válido: {mode} (opciones: {', '.join(PARSER_MODES)})")
+        self.mode = mode if workers > 0 else "inline"
+        self.workers = workers
+        self._executor = None
+
+    def _pool(self):
+        if self._executor is None and self.mode != "inline":
+            if self.mode == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="kiwi-parse")
+        return self._executor
+
+    async def iter_itineraries(self, chunks, stats=None):
+        """Itinerarios reducidos a medida que se completan a partir de un iterador asíncrono de bytes.
+        Si se pasa `stats` (dict), al terminar se rellena con las estadísticas del parseo.
+        """
+        loop = asyncio.get_running_loop()
+        if self.mode == "process":
+            body = bytearray()
+            async for chunk in chunks:
+                body.extend(chunk)
+            data, result = await loop.run_in_executor(self._pool(), parse_response, bytes(body))
+            for itinerary in data["itineraries"]:
+                yield itinerary
+        else:
+            stream = ItineraryStream()
+            async for chunk in chunks:
+                if self.mode == "thread":
+                    itineraries = await loop.run_in_executor(self._pool(), stream.feed, chunk)
+                else:
+                    itineraries = stream.feed(chunk)
+                for itinerary in itineraries:
+                    yield itinerary
+            for itinerary in stream.close():
+                yield itinerary
+            result = stream.stats()
+        if stats is not None:
+            stats.update(result)
+
+    async def parse(self, chunks):
+        """Respuesta reducida completa y estadísticas del parseo"""
+        stats = {}
+        itineraries = [itinerary async for itinerary in self.iter_itineraries(chunks, stats)]
+        return {"itineraries": itineraries}, stats
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,158 @@
+"""Sesiones de resultados de búsqueda para paginarlos sin repetir llamadas a la API"""
+import json
+import logging
+import secrets
+import sqlite3
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from itinerary import Itinerary
+
+
+class WeekendResults:
+    """Itinerarios encontrados para un fin de semana, ordenados por precio"""
+
+    __slots__ = ("outbound_date", "inbound_date", "itineraries", "error")
+
+    def __init__(self, outbound_date, inbound_date, itineraries=(), error=False):
+        self.outbound_date = outbound_date
+        self.inbound_date = inbound_date
+        self.itineraries = sorted(itineraries, key=lambda it: it.price)
+        self.error = error
+
+    @property
+    def cheapest(self):
+        return self.itineraries[0] if self.itineraries else None
+
+    def to_dict(self):
+        return {
+            "outbound_date": self.outbound_date.isoformat(),
+            "inbound_date": self.inbound_date.isoformat(),
+            "itineraries": [it.to_dict() for it in self.itineraries],
+            "error": self.error
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            datetime.fromisoformat(data["outbound_date"]), datetime.fromisoformat(data["inbound_date"]),
+            [Itinerary.from_dict(it) for it in data["itineraries"]], data["error"]
+        )
+
+
+class SearchResults:
+    """Resultado completo de una búsqueda: título, cabecera y fines de semana"""
+
+    __slots__ = ("title", "header", "weekends")
+
+    def __init__(self, title, header, weekends):
+        self.title = title
+        self.header = header
+        self.weekends = weekends
+
+    def to_json(self):
+        return json.dumps({
+            "title": self.title, "header": self.header,
+            "weekends": [weekend.to_dict() for weekend in self.weekends]
+        }, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, payload):
+        data = json.loads(payload)
+        return cls(data["title"], data["header"], [WeekendResults.from_dict(w) for w in data["weekends"]])
+
+
+class ResultSessions:
+    """Resultados de búsqueda por identificador corto, con TTL y memoria acotada.
+
+    Las sesiones más recientes (`max_sessions`) se guardan en memoria; todas se
+    escriben además en SQLite, de donde se recuperan si se expulsaron de la
+    memoria o si el botón lo pulsa un chat atendido por otro worker.
+    """
+
+    def __init__(self, path, ttl=86400, max_sessions=200):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.created = 0
+        self.expired = 0
+        self._sessions = OrderedDict()
+        self._last_purge = 0.0
+        self._db = sqlite3.connect(path, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS result_sessions ("
+            " id TEXT PRIMARY KEY, expires_at REAL NOT NULL, payload TEXT NOT NULL)"
+        )
+        self._db.commit()
+
+    def create(self, results):
+        """Guarda los resultados y devuelve su identificador (8 caracteres, cabe en `callback_data`)"""
+        session_id = secrets.token_urlsafe(6)
+        expires_at = time.time() + self.ttl
+        self._remember(session_id, expires_at, results)
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO result_sessions (id, expires_at, payload) VALUES (?, ?, ?)",
+                (session_id, expires_at, results.to_json())
+            )
+            self._db.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Error guardando la sesión de resultados {session_id}: {e}")
+        self.created += 1
+        self._purge()
+        return session_id
+
+    def get(self, session_id):
+        """Resultados de la sesión, o None si no existe o ha caducado"""
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            entry = self._load(session_id)
+        if entry is None:
+            return None
+        expires_at, results = entry
+        if expires_at < time.time():
+            self._sessions.pop(session_id, None)
+            self.expired += 1
+            return None
+        self._sessions.move_to_end(session_id)
+        return results
+
+    def _remember(self, session_id, expires_at, results):
+        self._sessions[session_id] = (expires_at, results)
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def _load(self, session_id):
+        try:
+            row = self._db.execute(
+                "SELECT expires_at, payload FROM result_sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            results = SearchResults.from_json(row[1])
+        except (sqlite3.Error, ValueError, KeyError) as e:
+            logging.error(f"Error leyendo la sesión de resultados {session_id}: {e}")
+            return None
+        self._remember(session_id, row[0], results)
+        return row[0], results
+
+    def _purge(self):
+        """Borra de SQLite las sesiones caducadas (como mucho una vez por minuto)"""
+        now = time.time()
+        if now - self._last_purge < 60:
+            return
+        self._last_purge = now
+        try:
+            self._db.execute("DELETE FROM result_sessions WHERE expires_at < ?", (now,))
+            self._db.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Error purgando sesiones de resultados: {e}")
+
+    def stats(self):
+        return {"in_memory": len(self._sessions), "created": self.created, "expired": self.expired}
+
+    def close(self):
+        self._db.close()
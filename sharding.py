@@ -0,0 +1,173 @@
+"""Reparto de los destinos de una búsqueda en grupos (shards) y fusión de sus resultados"""
+import heapq
+import logging
+import sqlite3
+from collections import Counter
+
+
+def destination_key(itinerary, shard):
+    """Destino pedido al que pertenece un itinerario dentro de su shard (None si no se puede saber)"""
+    if len(shard) == 1:
+        return shard[0]
+    for code in (f"Country:{itinerary.destination_country}", f"Airport:{itinerary.destination_code}"):
+        if code in shard:
+            return code
+    return None
+
+
+def merge_shard_results(shard_results, top_k, destination_cap=0):
+    """Fusiona los itinerarios de cada shard en un top-K global por precio.
+
+    `shard_results` son pares (shard, itinerarios ordenados por precio). Un
+    heap con un elemento por shard recorre los itinerarios en orden de precio
+    sin ordenar la unión; con `destination_cap` cada destino aporta como
+    mucho ese número, para que uno muy barato no ocupe todos los puestos.
+    """
+    def stream(index, shard, itineraries):
+        # El índice del shard y la posición desempatan precios iguales sin comparar itinerarios
+        for position, itinerary in enumerate(itineraries):
+            yield itinerary.price, index, position, itinerary, shard
+
+    merged = []
+    per_destination = Counter()
+    streams = [stream(index, shard, itineraries) for index, (shard, itineraries) in enumerate(shard_results)]
+    for _, _, _, itinerary, shard in heapq.merge(*streams):
+        if destination_cap:
+            # Sin destino conocido, el cupo se aplica por aeropuerto de llegada
+            key = destination_key(itinerary, shard) or itinerary.destination_code or itinerary.destination
+            if per_destination[key] >= destination_cap:
+                continue
+            per_destination[key] += 1
+        merged.append(itinerary)
+        if len(merged) >= top_k:
+            break
+    return merged
+
+
+class DestinationSharder:
+    """Decide cómo repartir los destinos activos entre varias llamadas a la API.
+
+    Cada destino tiene un rendimiento esperado: itinerarios por ventana bajo el
+    precio máximo, media móvil de lo observado y guardada en SQLite. Los
+    destinos que llenan su cupo (`destination_cap`) van solos, porque en un
+    grupo ordenado por precio dejarían sin sitio al resto; los demás se
+    agrupan (first-fit decreasing) hasta sumar `top_k` itinerarios esperados.
+    Si salen más de `max_shards` grupos se unen los de menor rendimiento. Así
+    los destinos con pocos vuelos comparten llamada y los `limit` de cada una
+    se ajustan a lo que de verdad devuelve.
+
+    Con `max_shards` = 1 todos los destinos van en una sola llamada, como
+    antes de existir el reparto.
+    """
+
+    def __init__(self, path, max_shards=1, top_k=20, destination_cap=0, smoothing=0.3):
+        self.max_shards = max_shards
+        self.top_k = top_k
+        self.destination_cap = destination_cap
+        self.smoothing = smoothing
+        self.queries = 0
+        self.shards = 0
+        self._db = sqlite3.connect(path, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS destination_yields ("
+            " destination TEXT PRIMARY KEY, yield REAL NOT NULL, observations INTEGER NOT NULL)"
+        )
+        self._db.commit()
+        self._yields = {
+            destination: (value, observations)
+            for destination, value, observations in self._db.execute(
+                "SELECT destination, yield, observations FROM destination_yields"
+            )
+        }
+
+    @property
+    def cap(self):
+        """Itinerarios por destino que interesan como mucho"""
+        return self.destination_cap or self.top_k
+
+    def expected_yield(self, destination):
+        """Itinerarios por ventana esperados; sin historial se supone que llena su cupo"""
+        known = self._yields.get(destination)
+        return min(self.cap, known[0]) if known else self.cap
+
+    def plan(self, destinations):
+        """Lista de shards (tuplas de destinos ordenadas, para que las claves de caché sean estables)"""
+        destinations = sorted(destinations)
+        self.queries += 1
+        if self.max_shards <= 1 or len(destinations) <= 1:
+            self.shards += 1
+            return [tuple(destinations)]
+
+        expected = {d: self.expected_yield(d) for d in destinations}
+        ordered = sorted(destinations, key=lambda d: -expected[d])
+        bins = [[d] for d in ordered if expected[d] >= self.cap]
+        grouped = []
+        for destination in ordered:
+            if expected[destination] >= self.cap:
+                continue
+            for group in grouped:
+                if sum(expected[d] for d in group) + expected[destination] <= self.top_k:
+                    group.append(destination)
+                    break
+            else:
+                grouped.append([destination])
+        bins += grouped
+
+        while len(bins) > self.max_shards:
+            bins.sort(key=lambda group: sum(expected[d] for d in group))
+            bins[1] = bins[0] + bins[1]
+            del bins[0]
+
+        shards = sorted(tuple(sorted(group)) for group in bins)
+        self.shards += len(shards)
+        return shards
+
+    def window_limit(self, shard):
+        """Itinerarios por ventana que se piden a un shard: su cupo conjunto, sin pasar del top-K"""
+        if not self.destination_cap:
+            return self.top_k
+        return min(self.top_k, self.destination_cap * len(shard))
+
+    def observe(self, shard, itineraries, call_saturated=False):
+        """Actualiza el rendimiento de los destinos del shard con los itinerarios de una ventana.
+        `call_saturated` indica que la llamada entera devolvió tantos itinerarios como su `limit`.
+        """
+        counts = Counter(destination_key(it, shard) for it in itineraries)
+        unattributed = counts.pop(None, 0) / len(shard)
+        # Si la ventana llenó su cupo o la llamada su `limit`, un destino con pocos resultados
+        # pudo quedar desplazado: ese dato solo es una cota inferior y no se usa
+        saturated = call_saturated or len(itineraries) >= self.window_limit(shard)
+        updates = []
+        for destination in shard:
+            sample = counts[destination] + unattributed
+            if saturated and sample < self.cap:
+                continue
+            value, observations = self._yields.get(destination, (sample, 0))
+            value += self.smoothing * (sample - value)
+            self._yields[destination] = (value, observations + 1)
+            updates.append((destination, value, observations + 1))
+        if not updates:
+            return
+        try:
+            self._db.executemany(
+                "INSERT INTO destination_yields (destination, yield, observations) VALUES (?, ?, ?) "
+                "ON CONFLICT(destination) DO UPDATE SET yield = excluded.yield, observations = excluded.observations",
+                updates
+            )
+            self._db.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Error guardando el rendimiento de los destinos: {e}")
+
+    def stats(self):
+        return {
+            "max_shards": self.max_shards,
+            "queries": self.queries,
+            "shards_per_query": self.shards / self.queries if self.queries else 0.0,
+            "destinations": len(self._yields),
+            "dense": sum(1 for value, _ in self._yields.values() if value >= self.cap)
+        }
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,128 @@
+"""Estado compartido entre procesos del bot (usuarios autenticados, turnos de tareas periódicas y búsquedas en curso)"""
+import itertools
+import logging
+import os
+import socket
+import sqlite3
+import time
+
+
+def worker_id():
+    """Identificador de este proceso, único entre workers y máquinas"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class SharedState:
+    """Estado que varios workers deben ver igual, en la base de datos SQLite común.
+
+    Los usuarios autenticados se cachean en memoria una vez vistos en la base de
+    datos (no hay forma de revocar un acceso, así que la caché nunca queda
+    obsoleta). Los `lease` permiten que solo un worker ejecute cada tarea
+    periódica: quien lo tiene lo renueva y, si deja de hacerlo, otro lo toma
+    cuando caduca. La búsqueda vigente de cada chat se registra con un token
+    para que un worker sepa que otro ha empezado una más reciente.
+    """
+
+    def __init__(self, path, owner=None):
+        self.path = path
+        self.owner = owner or worker_id()
+        self._authorized = set()
+        self._search_ids = itertools.count(1)
+        # Con varios procesos escribiendo a la vez, esperar al bloqueo en lugar de fallar
+        self._db = sqlite3.connect(path, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS authorized_users ("
+            " user_id INTEGER PRIMARY KEY, authorized_at REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS leases ("
+            " name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS active_searches ("
+            " chat_id INTEGER PRIMARY KEY, token TEXT NOT NULL, started_at REAL NOT NULL);"
+        )
+        self._db.commit()
+
+    def is_authorized(self, user_id):
+        if user_id in self._authorized:
+            return True
+        row = self._db.execute("SELECT 1 FROM authorized_users WHERE user_id = ?", (user_id,)).fetchone()
+        if row is not None:
+            self._authorized.add(user_id)
+        return row is not None
+
+    def authorize(self, user_id):
+        """Registra al usuario como autenticado para todos los workers"""
+        try:
+            self._db.execute(
+                "INSERT OR IGNORE INTO authorized_users (user_id, authorized_at) VALUES (?, ?)",
+                (user_id, time.time())
+            )
+            self._db.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Error guardando el usuario autenticado {user_id}: {e}")
+        self._authorized.add(user_id)
+
+    def authorized_users(self):
+        """Ids de todos los usuarios autenticados"""
+        return [user_id for user_id, in self._db.execute("SELECT user_id FROM authorized_users")]
+
+    def authorized_count(self):
+        return self._db.execute("SELECT COUNT(*) FROM authorized_users").fetchone()[0]
+
+    def acquire_lease(self, name, ttl):
+        """Toma o renueva el turno `name` durante `ttl` segundos; False si lo tiene otro worker"""
+        now = time.time()
+        try:
+            with self._db:
+                cursor = self._db.execute(
+                    "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                    "WHERE leases.owner = excluded.owner OR leases.expires_at < ?",
+                    (name, self.owner, now + ttl, now)
+                )
+            return cursor.rowcount > 0
+        except sqlite3.Error as e:
+            logging.error(f"Error tomando el turno {name}: {e}")
+            return False
+
+    def release_lease(self, name):
+        """Libera el turno si es nuestro (al apagar, para que otro worker lo tome sin esperar)"""
+        try:
+            with self._db:
+                self._db.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, self.owner))
+        except sqlite3.Error as e:
+            logging.error(f"Error liberando el turno {name}: {e}")
+
+    def claim_search(self, chat_id):
+        """Registra una búsqueda nueva como la vigente del chat en todos los workers; devuelve su token"""
+        token = f"{self.owner}:{next(self._search_ids)}"
+        try:
+            with self._db:
+                self._db.execute(
+                    "INSERT INTO active_searches (chat_id, token, started_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(chat_id) DO UPDATE SET token = excluded.token, started_at = excluded.started_at",
+                    (chat_id, token, time.time())
+                )
+        except sqlite3.Error as e:
+            logging.error(f"Error registrando la búsqueda del chat {chat_id}: {e}")
+        return token
+
+    def is_current_search(self, chat_id, token):
+        """False si otro worker (o este) ha empezado después otra búsqueda en el chat"""
+        try:
+            row = self._db.execute("SELECT token FROM active_searches WHERE chat_id = ?", (chat_id,)).fetchone()
+        except sqlite3.Error as e:
+            logging.error(f"Error consultando la búsqueda del chat {chat_id}: {e}")
+            return True
+        return row is None or row[0] == token
+
+    def release_search(self, chat_id, token):
+        """Olvida la búsqueda al terminar, salvo que ya la haya sustituido otra"""
+        try:
+            with self._db:
+                self._db.execute("DELETE FROM active_searches WHERE chat_id = ? AND token = ?", (chat_id, token))
+        except sqlite3.Error as e:
+            logging.error(f"Error liberando la búsqueda del chat {chat_id}: {e}")
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,45 @@
+"""Configuración común de las pruebas: los módulos del bot están en la raíz del repositorio"""
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from itinerary import Itinerary  # noqa: E402
+
+
+class FakeClock:
+    """Sustituye al módulo `time` de un módulo: el tiempo solo avanza con `advance`"""
+
+    def __init__(self, start=1_000_000.0):
+        self.now = start
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def perf_counter(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def make_itinerary(price=100.0, destination="Roma", outbound=datetime(2027, 8, 6, 18, 30),
+                   inbound=datetime(2027, 8, 8, 19, 0), carrier="Ryanair"):
+    """Itinerario mínimo para las pruebas"""
+    return Itinerary(
+        price=price, outbound_time=outbound, inbound_time=inbound,
+        origin="Alicante", destination=destination, outbound_carrier=carrier, inbound_carrier=carrier,
+        booking_url="https://www.kiwi.com", origin_code="ALC", destination_code="FCO", destination_country="IT"
+    )
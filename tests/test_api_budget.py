@@ -0,0 +1,101 @@
+import pytest
+
+import api_budget
+from api_budget import ApiBudget, BudgetExhaustedError, CircuitOpenError
+
+
+@pytest.fixture
+def budget(clock, monkeypatch):
+    monkeypatch.setattr(api_budget, "time", clock)
+    return ApiBudget(failure_threshold=3, open_seconds=60)
+
+
+def open_circuit(budget):
+    for _ in range(budget.failure_threshold):
+        budget.check()
+        budget.record_failure()
+
+
+def test_circuit_opens_after_consecutive_failures(budget):
+    budget.check()
+    budget.record_failure()
+    budget.record_success()
+    assert budget.state == "closed"
+
+    open_circuit(budget)
+    assert budget.state == "open"
+    with pytest.raises(CircuitOpenError):
+        budget.check()
+    assert budget.rejected == 1
+
+
+def test_half_open_lets_a_single_probe_through(budget, clock):
+    open_circuit(budget)
+    clock.advance(60)
+    assert budget.state == "half-open"
+
+    budget.check()
+    with pytest.raises(CircuitOpenError):
+        budget.check()
+    # Los reintentos de la propia llamada de prueba no son llamadas nuevas
+    budget.check(retrying=True)
+
+    budget.record_success()
+    assert budget.state == "closed"
+    budget.check()
+
+
+def test_failed_probe_reopens_the_circuit(budget, clock):
+    open_circuit(budget)
+    clock.advance(60)
+    budget.check()
+    budget.record_failure()
+    assert budget.state == "open"
+    with pytest.raises(CircuitOpenError):
+        budget.check()
+
+
+def test_released_or_lost_probe_lets_another_one_through(budget, clock):
+    open_circuit(budget)
+    clock.advance(60)
+    budget.check()
+    # Un 4xx no dice nada del estado de la API
+    budget.release_probe()
+    budget.check()
+
+    # Una prueba que nunca termina se da por perdida tras open_seconds
+    with pytest.raises(CircuitOpenError):
+        budget.check()
+    clock.advance(60)
+    budget.check()
+
+
+def test_quota_rejection_releases_the_probe(budget, clock):
+    open_circuit(budget)
+    clock.advance(60)
+    budget.header_remaining = 0
+    with pytest.raises(BudgetExhaustedError):
+        budget.check()
+    budget.header_remaining = 10
+    budget.check()
+
+
+def test_quota_from_headers_and_reserve(budget):
+    budget.reserve = 2
+    budget.update_from_headers({
+        "x-ratelimit-requests-limit": "100", "x-ratelimit-requests-remaining": "3",
+        "x-ratelimit-requests-reset": "3600"
+    })
+    assert budget.remaining() == 3
+    budget.check()
+    budget.header_remaining = 2
+    with pytest.raises(BudgetExhaustedError):
+        budget.check()
+    assert budget.stats()["limit"] == 100
+
+
+def test_backoff_respects_retry_after_and_cap(budget):
+    assert budget.backoff_delay(0, retry_after=5) == 5
+    assert budget.backoff_delay(0, retry_after=500) == budget.backoff_cap
+    assert 0 <= budget.backoff_delay(10) <= budget.backoff_cap
+    assert budget.retries == 3
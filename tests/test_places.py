@@ -0,0 +1,61 @@
+import pytest
+
+from places import PlaceIndex, build_index, normalize, place_label
+
+ROWS = [
+    {"kind": "country", "code": "IT", "name": "Italia", "city": "", "country": "IT", "aliases": "Italy"},
+    {"kind": "country", "code": "ES", "name": "España", "city": "", "country": "ES", "aliases": "Spain"},
+    {"kind": "city", "code": "milan_it", "name": "Milán", "city": "", "country": "IT", "aliases": "Milano|Milan"},
+    {"kind": "airport", "code": "MXP", "name": "Milán Malpensa", "city": "Milán", "country": "IT", "aliases": ""},
+    {"kind": "airport", "code": "BGY", "name": "Milán Bérgamo", "city": "Milán", "country": "IT", "aliases": ""},
+    {"kind": "airport", "code": "AGP", "name": "Málaga-Costa del Sol", "city": "Málaga", "country": "ES", "aliases": ""},
+    # Repetido por id: se ignora
+    {"kind": "airport", "code": "mxp", "name": "Duplicado", "city": "", "country": "IT", "aliases": ""},
+]
+
+
+@pytest.fixture
+def index(tmp_path):
+    path = tmp_path / "places.idx"
+    build_index(ROWS, str(path))
+    index = PlaceIndex(str(path))
+    yield index
+    index.close()
+
+
+def ids(places):
+    return [place.id for place in places]
+
+
+def test_normalize():
+    assert normalize("Málaga-Costa del Sol") == "malaga costa del sol"
+
+
+def test_search_by_prefix_ranks_exact_then_kind_then_csv_order(index):
+    assert ids(index.search("mil")) == ["City:milan_it", "Airport:MXP", "Airport:BGY"]
+    # "milan" es el nombre de la ciudad sin acento: coincidencia exacta
+    assert ids(index.search("Milán", limit=2)) == ["City:milan_it", "Airport:MXP"]
+    assert ids(index.search("ital")) == ["Country:IT"]
+
+
+def test_search_by_code_word_or_alias(index):
+    assert ids(index.search("bgy")) == ["Airport:BGY"]
+    assert ids(index.search("bergamo")) == ["Airport:BGY"]
+    assert ids(index.search("costa del")) == ["Airport:AGP"]
+    assert ids(index.search("spain")) == ["Country:ES"]
+    assert ids(index.search("milano", kinds=("airport",))) == []
+
+
+def test_search_without_matches_or_index(index, tmp_path):
+    assert index.search("zz") == []
+    assert index.search("  ") == []
+    assert PlaceIndex(str(tmp_path / "no_existe.idx")).search("mil") == []
+
+
+def test_get_by_id_and_label(index):
+    airport = index.get("Airport:MXP")
+    assert airport.name == "Milán Malpensa" and airport.detail == "Milán · Italia"
+    assert index.get("airport:mxp") == airport
+    assert index.get("Airport:XXX") is None
+    assert place_label(airport) == "✈️ Milán Malpensa (MXP)"
+    assert place_label(index.get("Country:IT")) == "🇮🇹 Italia"
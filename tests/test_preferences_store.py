@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from preferences_store import PreferencesStore
+
+MASTER = {
+    "Country:FR": {"name": "Francia", "default": True},
+    "Country:IT": {"name": "Italia", "default": True},
+    "Country:GB": {"name": "Reino Unido", "default": False},
+}
+DEFAULTS = {"Country:FR": True, "Country:IT": True, "Country:GB": False}
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "state.sqlite3")
+
+
+@pytest.fixture
+def store(path):
+    store = PreferencesStore(path, MASTER)
+    yield store
+    store.close()
+
+
+def test_new_users_start_from_the_master_defaults(store):
+    assert store.get(1) == DEFAULTS
+    assert store.version(1) == 0
+    assert store.toggle(1, "Country:GB") is True
+    assert store.toggle(1, "Country:XX") is None
+    assert store.get(1) == {**DEFAULTS, "Country:GB": True}
+    assert store.version(1) == 1
+    assert store.get(2) == DEFAULTS
+
+
+def test_legacy_json_only_applies_to_the_migrated_users(store):
+    legacy = {"Country:FR": False, "Country:IT": True, "Country:GB": True}
+    assert store.migrate_from_json(legacy, [1, 2])
+    # Solo una vez
+    assert not store.migrate_from_json({"Country:FR": True}, [3])
+    assert store.get(1) == legacy
+    assert store.get(2) == legacy
+    assert store.get(3) == DEFAULTS
+
+
+def test_reset_goes_back_to_defaults_and_drops_added_places(store):
+    store.add(1, "Airport:BGY")
+    store.toggle(1, "Country:FR")
+    assert not store.add(1, "Marte")
+    store.reset(1)
+    assert store.get(1) == DEFAULTS
+    # Sin filas propias vuelve a contar dentro de la selección por defecto
+    assert store.selection_counts() == {(None, ("Country:FR", "Country:IT")): 1}
+
+
+def test_changes_are_visible_from_another_connection(path, store):
+    other = PreferencesStore(path, MASTER)
+    assert other.get(1) == DEFAULTS
+    store.toggle(1, "Country:IT")
+    assert other.get(1) == {**DEFAULTS, "Country:IT": False}
+    assert other.version(1) == store.version(1)
+    assert other.stats()["reloads"] >= 1
+    other.close()
+
+
+def test_a_burst_of_toggles_is_a_single_flush(path):
+    async def burst():
+        store = PreferencesStore(path, MASTER, flush_delay=0.05)
+        for _ in range(5):
+            store.toggle(1, "Country:GB")
+        assert store.dirty
+        assert PreferencesStore(path, MASTER).get(1) == DEFAULTS
+        await asyncio.sleep(0.1)
+        assert not store.dirty
+        return store
+
+    store = asyncio.run(burst())
+    assert store.stats()["flushes"] == 1
+    assert store.stats()["coalesced"] == 4
+    assert PreferencesStore(path, MASTER).get(1) == {**DEFAULTS, "Country:GB": True}
+    store.close()
+
+
+def test_pending_changes_are_written_on_close(path):
+    async def change():
+        store = PreferencesStore(path, MASTER, flush_delay=60)
+        store.toggle(1, "Country:FR")
+        store.close()
+
+    asyncio.run(change())
+    assert PreferencesStore(path, MASTER).get(1) == {**DEFAULTS, "Country:FR": False}
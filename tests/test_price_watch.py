@@ -0,0 +1,58 @@
+import pytest
+
+import price_watch
+from conftest import make_itinerary
+from price_watch import WatchStore, diff_itineraries, itinerary_key
+
+DAY = 86400
+
+
+@pytest.fixture
+def store(tmp_path, clock, monkeypatch):
+    monkeypatch.setattr(price_watch, "time", clock)
+    store = WatchStore(str(tmp_path / "watch.sqlite3"))
+    store.add(1, 8, 2027, user_id=1)
+    yield store
+    store.close()
+
+
+def test_diff_finds_new_itineraries_and_price_drops():
+    rome, paris, lisbon = make_itinerary(100, "Roma"), make_itinerary(80, "París"), make_itinerary(50, "Lisboa")
+    previous = {itinerary_key(rome): 120.0, itinerary_key(paris): 82.0}
+    new, drops = diff_itineraries(previous, [rome, paris, lisbon], drop_percent=10)
+    assert new == [lisbon]
+    # París solo baja un 2,4 %
+    assert drops == [(rome, 120.0)]
+
+
+def test_merge_seen_updates_prices_and_marks_the_watch_initialized(store):
+    assert store.grouped() == {(8, 2027): [(1, 1, False)]}
+    rome = make_itinerary(100, "Roma")
+    store.merge_seen(1, 8, 2027, [rome], ttl=7 * DAY)
+    store.merge_seen(1, 8, 2027, [make_itinerary(90, "Roma")], ttl=7 * DAY)
+    assert store.seen(1, 8, 2027) == {itinerary_key(rome): 90}
+    assert store.grouped() == {(8, 2027): [(1, 1, True)]}
+
+
+def test_itineraries_that_leave_the_top_are_remembered_until_the_ttl(store, clock):
+    rome, paris = make_itinerary(100, "Roma"), make_itinerary(80, "París")
+    store.merge_seen(1, 8, 2027, [rome, paris], ttl=7 * DAY)
+
+    # París sale del top unos días: sigue vista y no se avisa como nueva al volver
+    clock.advance(3 * DAY)
+    store.merge_seen(1, 8, 2027, [rome], ttl=7 * DAY)
+    new, _ = diff_itineraries(store.seen(1, 8, 2027), [rome, paris], drop_percent=10)
+    assert new == []
+
+    # Pasado el TTL sin aparecer se olvida; Roma, vista hace poco, se conserva
+    clock.advance(5 * DAY)
+    store.merge_seen(1, 8, 2027, [rome], ttl=7 * DAY)
+    assert set(store.seen(1, 8, 2027)) == {itinerary_key(rome)}
+
+
+def test_remove_forgets_the_seen_itineraries(store):
+    store.merge_seen(1, 8, 2027, [make_itinerary()], ttl=DAY)
+    assert store.remove(1, 8, 2027)
+    assert not store.remove(1, 8, 2027)
+    assert store.seen(1, 8, 2027) == {}
+    assert store.for_chat(1) == []
@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta
+
+from conftest import make_itinerary
+from query_planner import QueryPlanner, SearchWindow
+
+
+def weekend(friday):
+    """Ventana viernes 17:00-23:59 → domingo 11:00-23:59"""
+    sunday = friday + timedelta(days=2)
+    return SearchWindow(friday.replace(hour=17), friday.replace(hour=23, minute=59),
+                        sunday.replace(hour=11), sunday.replace(hour=23, minute=59))
+
+
+FRIDAYS = [datetime(2027, 8, 6) + timedelta(weeks=i) for i in range(4)]
+
+
+def test_without_gap_bridging_each_window_is_a_call():
+    planner = QueryPlanner(window_limit=5)
+    calls = planner.plan([weekend(friday) for friday in FRIDAYS])
+    assert [call.windows for call in calls] == [[weekend(friday)] for friday in FRIDAYS]
+    assert all(call.limit == 5 for call in calls)
+
+
+def test_repeated_windows_are_planned_once():
+    planner = QueryPlanner(window_limit=5)
+    windows = [weekend(FRIDAYS[0]), weekend(FRIDAYS[1]), weekend(FRIDAYS[0])]
+    calls = planner.plan(windows)
+    assert len(calls) == 2
+    assert planner.stats()["saved_calls"] == 1
+
+
+def test_gap_bridging_respects_span_windows_and_limit():
+    planner = QueryPlanner(window_limit=5, max_gap_days=7, max_span_days=17, oversample=3, max_limit=40)
+    calls = planner.plan([weekend(friday) for friday in reversed(FRIDAYS)])
+    # Del viernes 6 al domingo 22 de agosto caben en 17 días; el 27 empieza otra llamada
+    assert [len(call.windows) for call in calls] == [3, 1]
+    assert calls[0].outbound_start == FRIDAYS[0].replace(hour=17)
+    assert calls[0].inbound_end == (FRIDAYS[2] + timedelta(days=2)).replace(hour=23, minute=59)
+    assert calls[0].limit == 40
+    assert calls[1].limit == 5
+
+    capped = QueryPlanner(window_limit=5, max_gap_days=7, max_span_days=31, max_windows=2)
+    assert [len(call.windows) for call in capped.plan([weekend(friday) for friday in FRIDAYS])] == [2, 2]
+
+
+def test_split_assigns_itineraries_to_their_windows():
+    planner = QueryPlanner(window_limit=5, max_gap_days=7, max_span_days=31)
+    call, = planner.plan([weekend(FRIDAYS[0]), weekend(FRIDAYS[1])])
+    first = [make_itinerary(price=p, outbound=datetime(2027, 8, 6, 18), inbound=datetime(2027, 8, 8, 20))
+             for p in (10, 20, 30)]
+    second = make_itinerary(outbound=datetime(2027, 8, 13, 23, 59), inbound=datetime(2027, 8, 15, 11))
+    # Ni de viernes tarde ni de domingo: la llamada ancha lo devuelve pero no es de ninguna ventana
+    outside = make_itinerary(outbound=datetime(2027, 8, 10, 18), inbound=datetime(2027, 8, 12, 20))
+
+    split = call.split(first + [outside, second], window_limit=2)
+    assert split[weekend(FRIDAYS[0])] == first[:2]
+    assert split[weekend(FRIDAYS[1])] == [second]
@@ -0,0 +1,75 @@
+import json
+import os
+
+import pytest
+
+from itinerary import Itinerary
+from response_parser import ItineraryStream, parse_response
+
+FIXTURE_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            "benchmarks", "fixtures", "round_trip_sample.json")
+
+
+@pytest.fixture(scope="module")
+def sample():
+    with open(FIXTURE_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def stream_all(body, chunk_size):
+    stream = ItineraryStream()
+    itineraries = []
+    for start in range(0, len(body), chunk_size):
+        itineraries.extend(stream.feed(body[start:start + chunk_size]))
+    itineraries.extend(stream.close())
+    return itineraries, stream
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 1 << 20])
+def test_chunking_does_not_change_the_result(sample, chunk_size):
+    body = json.dumps(sample, ensure_ascii=False).encode("utf-8")
+    itineraries, stream = stream_all(body, chunk_size)
+    expected, _ = parse_response(body)
+    assert itineraries == expected["itineraries"]
+    assert stream.items == len(sample["itineraries"])
+    assert stream.bytes == len(body)
+
+
+def test_slim_itineraries_parse_like_the_full_ones(sample):
+    body = json.dumps(sample).encode("utf-8")
+    slim, _ = parse_response(body)
+    full = [Itinerary.from_api(it) for it in sample["itineraries"]]
+    parsed = [Itinerary.from_api(it) for it in slim["itineraries"]]
+    assert [it.to_dict() for it in parsed] == [it.to_dict() for it in full]
+
+
+def test_peak_buffer_stays_below_the_body(sample):
+    body = json.dumps({"metadata": {}, "itineraries": sample["itineraries"] * 50}).encode("utf-8")
+    itineraries, stream = stream_all(body, 4096)
+    assert len(itineraries) == len(sample["itineraries"]) * 50
+    assert stream.peak_buffer < len(body) / 10
+
+
+def test_malformed_itineraries_are_skipped(sample):
+    body = json.dumps({"itineraries": [{"price": {}}] + sample["itineraries"]}).encode("utf-8")
+    itineraries, stream = stream_all(body, 16)
+    assert len(itineraries) == len(sample["itineraries"])
+    assert stream.skipped == 1
+
+
+def test_missing_itineraries_means_no_results():
+    assert parse_response(b'{"itineraries": null}')[0] == {"itineraries": []}
+    assert parse_response(b'{"metadata": {}}')[0] == {"itineraries": []}
+
+
+@pytest.mark.parametrize("body", [b"", b"[1, 2]", b'{"itineraries": [{"price": {"amount": 1}}'])
+def test_invalid_bodies_raise_value_error(body):
+    with pytest.raises(ValueError):
+        parse_response(body)
+
+
+def test_multibyte_characters_split_across_chunks():
+    body = '{"itineraries": [], "nota": "Málaga–Zürich"}'.encode("utf-8")
+    itineraries, stream = stream_all(body, 1)
+    assert itineraries == []
+    assert stream.done
@@ -0,0 +1,66 @@
+from datetime import datetime
+
+import pytest
+
+import result_sessions
+from conftest import make_itinerary
+from result_sessions import ResultSessions, SearchResults, WeekendResults
+
+
+@pytest.fixture
+def path(tmp_path, clock, monkeypatch):
+    monkeypatch.setattr(result_sessions, "time", clock)
+    return str(tmp_path / "sessions.sqlite3")
+
+
+def make_results(title="Agosto 2027"):
+    return SearchResults(title, f"✈️ *{title}*", [
+        WeekendResults(datetime(2027, 8, 6), datetime(2027, 8, 8), [make_itinerary(90), make_itinerary(40)]),
+        WeekendResults(datetime(2027, 8, 13), datetime(2027, 8, 15), error=True),
+    ])
+
+
+def test_round_trip_through_sqlite_keeps_the_results(path):
+    sessions = ResultSessions(path)
+    session_id = sessions.create(make_results())
+    assert len(session_id) == 8
+
+    # Otro worker no la tiene en memoria y la lee de SQLite
+    other = ResultSessions(path)
+    results = other.get(session_id)
+    assert results.title == "Agosto 2027"
+    assert [it.price for it in results.weekends[0].itineraries] == [40, 90]
+    assert results.weekends[0].cheapest.price == 40
+    assert results.weekends[1].error and results.weekends[1].cheapest is None
+    assert other.get("noexiste") is None
+
+
+def test_sessions_expire_after_the_ttl(path, clock):
+    sessions = ResultSessions(path, ttl=60)
+    session_id = sessions.create(make_results())
+    clock.advance(59)
+    assert sessions.get(session_id) is not None
+    clock.advance(2)
+    assert sessions.get(session_id) is None
+    assert sessions.stats()["expired"] == 1
+    # Tampoco se recupera de SQLite
+    assert ResultSessions(path, ttl=60).get(session_id) is None
+
+
+def test_memory_keeps_the_most_recent_and_evicted_ones_reload(path):
+    sessions = ResultSessions(path, max_sessions=2)
+    first, second = sessions.create(make_results("uno")), sessions.create(make_results("dos"))
+    # Leer la primera la hace la más reciente: la expulsada es la segunda
+    sessions.get(first)
+    third = sessions.create(make_results("tres"))
+    assert list(sessions._sessions) == [first, third]
+    assert sessions.get(second).title == "dos"
+    assert sessions.stats()["in_memory"] == 2
+
+
+def test_expired_sessions_are_purged_from_sqlite(path, clock):
+    sessions = ResultSessions(path, ttl=30)
+    old = sessions.create(make_results())
+    clock.advance(61)
+    sessions.create(make_results())
+    assert sessions._db.execute("SELECT id FROM result_sessions WHERE id = ?", (old,)).fetchone() is None
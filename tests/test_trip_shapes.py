@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from trip_shapes import SHAPES, TripCalendar, load_holidays, parse_shape
+
+HOLIDAYS = {
+    np.datetime64("2026-10-12", "D"): "Fiesta Nacional de España",   # lunes
+    np.datetime64("2026-12-06", "D"): "Día de la Constitución",      # domingo
+    np.datetime64("2026-12-08", "D"): "Inmaculada Concepción",       # martes
+    np.datetime64("2027-03-17", "D"): "Festivo suelto",              # miércoles
+}
+
+
+@pytest.fixture(scope="module")
+def trip_calendar():
+    return TripCalendar(HOLIDAYS)
+
+
+def test_free_days_holidays_and_bridges(trip_calendar):
+    assert trip_calendar.is_free(datetime(2026, 10, 10))
+    assert not trip_calendar.is_free(datetime(2026, 10, 9))
+    # Lunes entre el domingo y el festivo del martes
+    assert trip_calendar.is_free(datetime(2026, 12, 7))
+    assert trip_calendar.is_free(datetime(2027, 3, 17))
+    assert not trip_calendar.is_free(datetime(2027, 3, 16))
+    assert trip_calendar.holiday_name(datetime(2026, 12, 8)) == "Inmaculada Concepción"
+    assert trip_calendar.holiday_name(datetime(2026, 12, 9)) is None
+    assert not trip_calendar.is_free(datetime(2040, 1, 1))
+
+
+def test_bridges_leave_the_last_working_day_and_return_the_last_free_one(trip_calendar):
+    pairs = SHAPES["puente"].pairs(trip_calendar, datetime(2026, 10, 1), datetime(2027, 3, 31))
+    assert pairs == [
+        (datetime(2026, 10, 9), datetime(2026, 10, 12)),
+        (datetime(2026, 12, 4), datetime(2026, 12, 8)),
+    ]
+
+
+@pytest.mark.parametrize("name, weekday, nights", [("finde", 4, 2), ("jue-dom", 3, 3), ("vie-lun", 4, 3)])
+def test_weekday_shapes_match_a_day_by_day_scan(trip_calendar, name, weekday, nights):
+    start, end = datetime(2027, 1, 1), datetime(2027, 12, 31)
+    expected = [
+        (day, day + timedelta(days=nights))
+        for day in (start + timedelta(days=i) for i in range((end - start).days + 1))
+        if day.weekday() == weekday
+    ]
+    assert SHAPES[name].pairs(trip_calendar, start, end) == expected
+
+
+def test_return_can_fall_in_the_next_month(trip_calendar):
+    pairs = SHAPES["finde"].pairs(trip_calendar, datetime(2027, 4, 1), datetime(2027, 4, 30))
+    assert pairs[-1] == (datetime(2027, 4, 30), datetime(2027, 5, 2))
+
+
+def test_nights_shape():
+    shape = parse_shape("2-3noches")
+    assert shape.daily and shape.nights == (2, 3)
+    pairs = shape.pairs(TripCalendar(), datetime(2027, 5, 1), datetime(2027, 5, 2))
+    assert pairs == [
+        (datetime(2027, 5, 1), datetime(2027, 5, 3)), (datetime(2027, 5, 1), datetime(2027, 5, 4)),
+        (datetime(2027, 5, 2), datetime(2027, 5, 4)), (datetime(2027, 5, 2), datetime(2027, 5, 5)),
+    ]
+    window = shape.window(*pairs[0])
+    assert window.outbound_start == datetime(2027, 5, 1, 0) and window.inbound_end == datetime(2027, 5, 3, 23, 59)
+
+
+@pytest.mark.parametrize("text", ["", "0n", "3-2n", "15n", "findes"])
+def test_unknown_shapes(text):
+    assert parse_shape(text) is None
+    assert parse_shape("PUENTE") is SHAPES["puente"]
+
+
+def test_load_holidays_filters_regions(tmp_path):
+    path = tmp_path / "holidays.csv"
+    path.write_text(
+        "date,region,name\n2026-03-19,MC,San José\n2026-03-19,VC,San José\n2026-06-24,VC,San Juan\n",
+        encoding="utf-8"
+    )
+    holidays = load_holidays(path, {"ES", "MC"})
+    assert holidays == {np.datetime64("2026-03-19", "D"): "San José"}
+    assert load_holidays(tmp_path / "no_existe.csv", {"ES"}) == {}
@@ -0,0 +1,232 @@
+"""Trazas por actualización en formato Trace Event (JSONL) y perfilado muestreado de handlers.
+
+Cada línea del fichero de trazas es un evento "X" (duración completa) del
+formato Trace Event de Chrome. Para abrirlo en chrome://tracing o en
+https://ui.perfetto.dev se convierte al formato JSON de objeto:
+
+    python tracing.py bot_traces.jsonl > trace.json
+"""
+import asyncio
+import contextvars
+import cProfile
+import itertools
+import json
+import logging
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import uuid
+import weakref
+
+_current_span = contextvars.ContextVar("trace_span", default=None)
+
+
+class _NullSpan:
+    """Span que no registra nada (trazas desactivadas o actualización no muestreada)"""
+
+    def set(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """Intervalo con nombre dentro de una traza; los hijos se enlazan por contextvars"""
+
+    __slots__ = ("tracer", "name", "trace_id", "span_id", "parent_id", "args", "_start", "_token")
+
+    def __init__(self, tracer, name, trace_id, parent_id, args):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.args = args
+
+    def set(self, **args):
+        """Añade atributos al span (p. ej. resultados conocidos al final)"""
+        self.args.update(args)
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter_ns()
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer._record(self, self._start, end)
+        return False
+
+
+class Tracer:
+    """Genera spans anidados y los escribe por lotes en un fichero JSONL.
+
+    Sin `path` todas las llamadas devuelven un span nulo, de modo que el coste
+    con las trazas desactivadas es una comprobación por span.
+    """
+
+    def __init__(self, path=None, sample_rate=1.0, buffer_size=200):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.buffer_size = buffer_size
+        self.traces = 0
+        self.spans = 0
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._tracks = weakref.WeakKeyDictionary()
+        self._track_ids = itertools.count(1)
+        # Marca de tiempo de pared para los contadores monótonos de perf_counter_ns
+        self._epoch_ns = time.time_ns() - time.perf_counter_ns()
+
+    def configure(self, path, sample_rate=1.0):
+        self.path = path or None
+        self.sample_rate = sample_rate
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def trace(self, name, **args):
+        """Span raíz de una nueva traza (o hijo si ya hay una traza en curso)"""
+        parent = _current_span.get()
+        if parent is not None:
+            return Span(self, name, parent.trace_id, parent.span_id, args)
+        if not self.enabled or random.random() >= self.sample_rate:
+            return NULL_SPAN
+        self.traces += 1
+        return Span(self, name, uuid.uuid4().hex[:16], None, args)
+
+    def span(self, name, **args):
+        """Span hijo del actual; nulo si no hay traza en curso"""
+        parent = _current_span.get()
+        if parent is None:
+            return NULL_SPAN
+        return Span(self, name, parent.trace_id, parent.span_id, args)
+
+    def _track(self):
+        """Pista del visor para la tarea actual: las consultas en paralelo no se solapan en la misma"""
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        if task is None:
+            return 0, None
+        track = self._tracks.get(task)
+        if track is not None:
+            return track, None
+        track = self._tracks[task] = next(self._track_ids)
+        return track, task.get_name()
+
+    def _record(self, span, start_ns, end_ns):
+        tid, new_track_name = self._track()
+        events = []
+        if new_track_name is not None:
+            events.append({"name": "thread_name", "ph": "M", "pid": self._pid, "tid": tid,
+                           "args": {"name": new_track_name}})
+        args = {"trace_id": span.trace_id, "span_id": span.span_id}
+        if span.parent_id is not None:
+            args["parent_id"] = span.parent_id
+        args.update(span.args)
+        events.append({
+            "name": span.name, "cat": "bot", "ph": "X", "pid": self._pid, "tid": tid,
+            "ts": (self._epoch_ns + start_ns) // 1000, "dur": (end_ns - start_ns) // 1000,
+            "args": args
+        })
+        self.spans += 1
+        with self._lock:
+            self._buffer.extend(events)
+            if len(self._buffer) < self.buffer_size:
+                return
+            pending, self._buffer = self._buffer, []
+        self._write(pending)
+
+    def _write(self, events):
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.writelines(json.dumps(event, ensure_ascii=False, default=str) + "\n" for event in events)
+        except OSError as e:
+            logging.error(f"Error escribiendo trazas en {self.path}: {e}")
+
+    def flush(self):
+        """Escribe los eventos pendientes"""
+        with self._lock:
+            pending, self._buffer = self._buffer, []
+        if pending and self.enabled:
+            self._write(pending)
+
+
+class HandlerProfiler:
+    """Perfila con cProfile un `sample_percent` % de las invocaciones de cada handler.
+
+    Las estadísticas se acumulan por handler y se vuelcan a `<output_dir>/<handler>.prof`
+    (legibles con `python -m pstats` o snakeviz). cProfile es global al proceso,
+    así que solo se perfila una invocación a la vez y lo medido incluye cualquier
+    otra tarea que se ejecute en el event loop mientras tanto.
+    """
+
+    def __init__(self, sample_percent=0.0, output_dir="profiles"):
+        self.sample_percent = sample_percent
+        self.output_dir = output_dir
+        self.samples = {}
+        self._stats = {}
+        self._active = False
+
+    def sample(self, name):
+        if self.sample_percent <= 0 or self._active or random.random() * 100 >= self.sample_percent:
+            return NULL_SPAN
+        return _ProfiledCall(self, name)
+
+    def _save(self, name, profile):
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats[name] = pstats.Stats(profile)
+        else:
+            stats.add(profile)
+        self.samples[name] = self.samples.get(name, 0) + 1
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            stats.dump_stats(os.path.join(self.output_dir, f"{name}.prof"))
+        except OSError as e:
+            logging.error(f"Error guardando el perfil de {name}: {e}")
+
+
+class _ProfiledCall:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.profile = cProfile.Profile()
+
+    def __enter__(self):
+        self.profiler._active = True
+        self.profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profile.disable()
+        self.profiler._active = False
+        self.profiler._save(self.name, self.profile)
+        return False
+
+
+tracer = Tracer()
+
+
+if __name__ == "__main__":
+    # Convierte un fichero JSONL de trazas en un array JSON para los visores
+    with open(sys.argv[1], "r", encoding="utf-8") as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, sys.stdout)
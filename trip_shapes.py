@@ -0,0 +1,164 @@
+"""Formas de viaje (fin de semana, jueves-domingo, puentes, N noches) sobre un calendario precalculado con NumPy"""
+import csv
+import logging
+import re
+from dataclasses import dataclass
+from datetime import datetime
+
+import numpy as np
+
+from query_planner import SearchWindow
+
+WEEKDAY_SHORT = ("Lu", "Ma", "Mi", "Ju", "Vi", "Sá", "Do")
+CALENDAR_START = "2020-01-01"
+CALENDAR_END = "2036-01-01"
+# Días seguidos sin trabajar (con algún festivo) a partir de los que hay puente
+MIN_BRIDGE_DAYS = 3
+
+
+def load_holidays(path, regions):
+    """Festivos del CSV (date, region, name) de las regiones indicadas: fecha -> nombre"""
+    holidays = {}
+    try:
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                if row["region"] in regions:
+                    holidays.setdefault(np.datetime64(row["date"], "D"), row["name"])
+    except (OSError, KeyError, ValueError) as e:
+        logging.warning(f"No se pudo leer el calendario de festivos {path}: {e}")
+    return holidays
+
+
+class TripCalendar:
+    """Días de CALENDAR_START a CALENDAR_END como arrays de NumPy, calculados una vez.
+
+    `weekday`, `holiday` y `free` (fin de semana, festivo o puente) se
+    calculan con máscaras, sin recorrer los días en Python. Los puentes
+    (bloques de al menos MIN_BRIDGE_DAYS días libres con algún festivo)
+    también se precalculan.
+    """
+
+    def __init__(self, holidays=None, start=CALENDAR_START, end=CALENDAR_END):
+        self.holidays = holidays or {}
+        self.start = np.datetime64(start, "D")
+        self.days = np.arange(self.start, np.datetime64(end, "D"))
+        # Los índices del calendario se pasan a fechas sumando el ordinal del primer día
+        self.start_ordinal = self.start.item().toordinal()
+        # 1970-01-01 fue jueves; lunes = 0
+        self.weekday = (self.days.astype(np.int64) + 3) % 7
+        self.holiday = np.isin(self.days, np.array(list(self.holidays), dtype="datetime64[D]"))
+        off = (self.weekday >= 5) | self.holiday
+        # Un laborable entre un festivo y otro día libre se toma de puente
+        next_to_holiday = np.roll(self.holiday, 1) | np.roll(self.holiday, -1)
+        self.bridge = ~off & np.roll(off, 1) & np.roll(off, -1) & next_to_holiday
+        self.free = off | self.bridge
+
+        # Bloques de días libres: [inicio, fin] y festivos que contienen
+        edges = np.diff(self.free.astype(np.int8))
+        starts = np.flatnonzero(edges == 1) + 1
+        ends = np.flatnonzero(edges == -1)
+        ends = ends[ends >= starts[0]] if len(starts) else ends[:0]
+        starts = starts[:len(ends)]
+        holidays_before = np.concatenate(([0], np.cumsum(self.holiday)))
+        with_holiday = holidays_before[ends + 1] - holidays_before[starts] > 0
+        keep = with_holiday & (ends - starts + 1 >= MIN_BRIDGE_DAYS) & (starts > 0)
+        # Se sale la tarde del último laborable y se vuelve el último día libre
+        self.bridge_departures = starts[keep] - 1
+        self.bridge_returns = ends[keep]
+
+    def span(self, start, end):
+        """Índices [i, j) de las fechas de `start` a `end` (incluidas), recortados al calendario"""
+        i = max(0, start.toordinal() - self.start_ordinal)
+        j = min(len(self.days), end.toordinal() - self.start_ordinal + 1)
+        return i, max(i, j)
+
+    def dates(self, indices):
+        """Índices del calendario (pueden pasar de su final) a datetime a medianoche"""
+        return [datetime.fromordinal(index) for index in (np.asarray(indices) + self.start_ordinal).tolist()]
+
+    def holiday_name(self, day):
+        return self.holidays.get(np.datetime64(day.date() if isinstance(day, datetime) else day, "D"))
+
+    def is_free(self, day):
+        i, j = self.span(day, day)
+        return bool(self.free[i]) if j > i else False
+
+
+@dataclass(frozen=True)
+class TripShape:
+    """Patrón de viaje: qué pares (salida, vuelta) genera y en qué horas se buscan los vuelos"""
+    name: str
+    description: str
+    departure_weekdays: tuple = ()
+    nights: tuple = ()
+    bridges: bool = False
+    outbound_hours: tuple = (17, 23)
+    inbound_hours: tuple = (11, 23)
+
+    @property
+    def daily(self):
+        """Sale cualquier día: genera un par por día y noche (pensada para /matrix)"""
+        return not self.bridges and not self.departure_weekdays
+
+    def pairs(self, calendar, start, end):
+        """Pares (salida, vuelta) como datetime, con la salida entre `start` y `end` (incluidas)"""
+        if self.departure_weekdays:
+            # Pocos pares por mes: con aritmética de fechas sale más barato que pasar por NumPy
+            first_ordinal, last_ordinal = start.toordinal(), end.toordinal()
+            departures = sorted(
+                ordinal
+                for weekday in self.departure_weekdays
+                for ordinal in range(first_ordinal + (weekday - start.weekday()) % 7, last_ordinal + 1, 7)
+            )
+            return [
+                (datetime.fromordinal(ordinal), datetime.fromordinal(ordinal + nights))
+                for ordinal in departures for nights in self.nights
+            ]
+        i, j = calendar.span(start, end)
+        if self.bridges:
+            first, last = np.searchsorted(calendar.bridge_departures, (i, j))
+            departures = calendar.bridge_departures[first:last]
+            returns = calendar.bridge_returns[first:last]
+        else:
+            days = np.arange(i, j)
+            nights = np.asarray(self.nights, dtype=np.int64)
+            departures = np.repeat(days, len(nights))
+            returns = departures + np.tile(nights, len(days))
+        return list(zip(calendar.dates(departures), calendar.dates(returns)))
+
+    def window(self, outbound_date, inbound_date):
+        """Ventana de búsqueda de un par: salida y vuelta dentro de las horas de la forma"""
+        return SearchWindow(
+            outbound_start=outbound_date.replace(hour=self.outbound_hours[0]),
+            outbound_end=outbound_date.replace(hour=self.outbound_hours[1], minute=59),
+            inbound_start=inbound_date.replace(hour=self.inbound_hours[0]),
+            inbound_end=inbound_date.replace(hour=self.inbound_hours[1], minute=59)
+        )
+
+
+SHAPES = {
+    "finde": TripShape("finde", "viernes a domingo", departure_weekdays=(4,), nights=(2,)),
+    "jue-dom": TripShape("jue-dom", "jueves a domingo", departure_weekdays=(3,), nights=(3,)),
+    "vie-lun": TripShape("vie-lun", "viernes a lunes", departure_weekdays=(4,), nights=(3,)),
+    "puente": TripShape("puente", "puentes y festivos", bridges=True),
+}
+NIGHTS_PATTERN = re.compile(r"^(\d{1,2})(?:-(\d{1,2}))?n(?:oches)?$")
+
+
+def parse_shape(text):
+    """Forma de viaje por nombre ("puente", "vie-lun") o noches ("3n", "2-4noches"); None si no se reconoce"""
+    text = text.lower()
+    if text in SHAPES:
+        return SHAPES[text]
+    match = NIGHTS_PATTERN.match(text)
+    if not match:
+        return None
+    low = int(match.group(1))
+    high = int(match.group(2) or low)
+    if not 1 <= low <= high <= 14:
+        return None
+    label = f"{low}" if low == high else f"{low}-{high}"
+    return TripShape(
+        f"{label}n", f"{label} noches", nights=tuple(range(low, high + 1)),
+        outbound_hours=(0, 23), inbound_hours=(0, 23)
+    )